@@ -30,11 +30,36 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
 '''
 
-from flask import Flask, render_template_string, send_file, request
+from flask import Flask, Response, g, jsonify, render_template_string, send_file, request, stream_with_context
+from werkzeug.http import is_resource_modified
 import os
-import glob
-import re
 import math
+import base64
+import binascii
+import csv
+import hashlib
+import gzip
+import io
+import json
+import logging
+import time
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache, wraps
+from itertools import islice
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from adif import QSO_FIELDS
+from adif_diff import diff_files
+from backup_catalog import BackupCatalog
+from backup_files import backup_name, compression_of, open_backup
+from logbook import LogbookCache
+from logstore import LogStore
+from metrics import log_event, metrics, setup_json_logging
 
 # Flask application
 app = Flask(__name__)
@@ -45,6 +70,47 @@ BACKUP_DIR = './qrz_backups'
 # Number of QSOs per page
 QSOS_PER_PAGE = 10
 
+# Most QSOs listed per section on the changes page
+DIFF_DISPLAY_LIMIT = 500
+
+# Parsed copies of the latest backup and of one older snapshot being browsed,
+# shared by all requests
+logbook_cache = LogbookCache(size=2)
+
+# In-memory list of the backups in BACKUP_DIR, see backup_catalog()
+catalog = None
+
+# QSOs per page of /api/qsos, by default and at most
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+# QSOs fetched per step while streaming /api/qsos/export
+EXPORT_CHUNK_SIZE = 1000
+
+# Response compression: content types worth compressing, the smallest body
+# worth the trouble, and the levels used (moderate, since pages are built per request)
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'text/csv', 'application/json')
+COMPRESS_MIN_SIZE = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Backup served instead of the newest one, set by serve.py so that workers keep
+# using the logbook preloaded before they were started
+pinned_backup = None
+
+# Optional SQLite store for very large logs, e.g. './qrz_backups/logbook.sqlite3'.
+# When set, sorting, searching and paging run as indexed queries.
+LOGSTORE_PATH = None
+logstore = LogStore(LOGSTORE_PATH) if LOGSTORE_PATH else None
+
+# Write events (backups loaded, slow or failed requests) as JSON lines to this
+# file, e.g. './qrz_backups/locallogger.log.jsonl'; request timings and cache
+# hits are always counted and served at /metrics for Prometheus
+JSON_LOG = None
+SLOW_REQUEST_SECONDS = 1.0
+if JSON_LOG:
+    setup_json_logging(JSON_LOG)
+
 # HTML template with search, pagination, sorting functionality, and QSO detail links
 html_template = """
 <!DOCTYPE html>
@@ -67,11 +133,32 @@ html_template = """
 <body>
     <div class="container">
         <h1 class="my-4">Local Logger 1.0.0</h1>
+        {% set snap = '&backup=' ~ (snapshot | urlencode) if snapshot else '' %}
+        {% if snapshot %}
+        <p>Viewing Backup: {{ latest_backup }} (<a href="/">back to the latest</a>)</p>
+        {% else %}
         <p>Latest Backup: {{ latest_backup }}</p>
+        {% endif %}
+
+        <form method="get" action="/" class="my-3">
+            <div class="input-group">
+                <label class="input-group-text" for="backupSelect">Snapshot</label>
+                <select id="backupSelect" name="backup" class="form-select" onchange="this.form.submit()">
+                    {% for name, label in snapshots %}
+                    <option value="{{ '' if loop.first else name }}" {% if name == latest_backup %}selected{% endif %}>{{ label }}</option>
+                    {% endfor %}
+                </select>
+                <input type="hidden" name="query" value="{{ query }}">
+                <input type="hidden" name="sort_by" value="{{ sort_by }}">
+                <input type="hidden" name="order" value="{{ order }}">
+                <noscript><button class="btn btn-outline-secondary" type="submit">View</button></noscript>
+            </div>
+        </form>
 
         <form method="get" action="/" class="my-3">
             <div class="input-group">
-                <input type="text" name="query" class="form-control" placeholder="Search (call, frequency, mode, etc.)" value="{{ query }}">
+                <input type="text" name="query" class="form-control" placeholder="Search, e.g. W1AW or call:W1* band:20m mode:FT8 date:2023-01..2023-06" value="{{ query }}">
+                {% if snapshot %}<input type="hidden" name="backup" value="{{ snapshot }}">{% endif %}
                 <button class="btn btn-primary" type="submit">Search</button>
             </div>
         </form>
@@ -79,12 +166,12 @@ html_template = """
         <table class="table table-striped">
             <thead class="table-dark">
                 <tr>
-                    <th><a href="/?sort_by=call&order={{ 'desc' if sort_by == 'call' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}">Call</a></th>
-                    <th><a href="/?sort_by=freq&order={{ 'desc' if sort_by == 'freq' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}">Frequency</a></th>
-                    <th><a href="/?sort_by=band&order={{ 'desc' if sort_by == 'band' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}">Band</a></th>
-                    <th><a href="/?sort_by=mode&order={{ 'desc' if sort_by == 'mode' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}">Mode</a></th>
-                    <th><a href="/?sort_by=qso_date&order={{ 'desc' if sort_by == 'qso_date' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}">Date</a></th>
-                    <th><a href="/?sort_by=time_on&order={{ 'desc' if sort_by == 'time_on' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}">Time</a></th>
+                    <th><a href="/?sort_by=call&order={{ 'desc' if sort_by == 'call' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}{{ snap }}">Call</a></th>
+                    <th><a href="/?sort_by=freq&order={{ 'desc' if sort_by == 'freq' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}{{ snap }}">Frequency</a></th>
+                    <th><a href="/?sort_by=band&order={{ 'desc' if sort_by == 'band' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}{{ snap }}">Band</a></th>
+                    <th><a href="/?sort_by=mode&order={{ 'desc' if sort_by == 'mode' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}{{ snap }}">Mode</a></th>
+                    <th><a href="/?sort_by=qso_date&order={{ 'desc' if sort_by == 'qso_date' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}{{ snap }}">Date</a></th>
+                    <th><a href="/?sort_by=time_on&order={{ 'desc' if sort_by == 'time_on' and order == 'asc' else 'asc' }}&query={{ query }}&page={{ current_page }}{{ snap }}">Time</a></th>
                     <th>Details</th>
                 </tr>
             </thead>
@@ -98,7 +185,7 @@ html_template = """
                     <td>{{ entry['qso_date'] }}</td>
                     <td>{{ entry['time_on'] }}</td>
                     <td>
-                        <a href="/qso/{{ entry['app_qrzlog_logid'] }}" class="btn btn-primary">View</a>
+                        <a href="/qso/{{ entry['app_qrzlog_logid'] }}{{ '?backup=' ~ (snapshot | urlencode) if snapshot }}" class="btn btn-primary">View</a>
                     </td>
                 </tr>
                 {% endfor %}
@@ -106,7 +193,7 @@ html_template = """
         </table>
 
         <div class="d-flex justify-content-between align-items-center my-3">
-            <a class="btn btn-secondary {% if current_page == 1 %}disabled{% endif %}" href="/?page={{ current_page - 1 }}&query={{ query }}&sort_by={{ sort_by }}&order={{ order }}">
+            <a class="btn btn-secondary {% if current_page == 1 %}disabled{% endif %}" href="/?page={{ current_page - 1 }}&query={{ query }}&sort_by={{ sort_by }}&order={{ order }}{{ snap }}">
                 &laquo; Previous
             </a>
 
@@ -116,16 +203,25 @@ html_template = """
                 <input type="hidden" name="query" value="{{ query }}">
                 <input type="hidden" name="sort_by" value="{{ sort_by }}">
                 <input type="hidden" name="order" value="{{ order }}">
+                {% if snapshot %}<input type="hidden" name="backup" value="{{ snapshot }}">{% endif %}
                 <button type="submit" class="btn btn-primary">Go</button>
             </form>
 
-            <a class="btn btn-secondary {% if current_page == total_pages %}disabled{% endif %}" href="/?page={{ current_page + 1 }}&query={{ query }}&sort_by={{ sort_by }}&order={{ order }}">
+            <a class="btn btn-secondary {% if current_page == total_pages %}disabled{% endif %}" href="/?page={{ current_page + 1 }}&query={{ query }}&sort_by={{ sort_by }}&order={{ order }}{{ snap }}">
                 Next &raquo;
             </a>
         </div>
 
         <br>
+        {% if snapshot %}
+        <a href="/download?backup={{ snapshot | urlencode }}" class="btn btn-primary">Download This Logbook</a>
+        {% else %}
         <a href="/download" class="btn btn-primary">Download Latest Logbook</a>
+        {% endif %}
+        <a href="/diff" class="btn btn-outline-secondary">Changes Since Previous Backup</a>
+        {% if compressed %}
+        <a href="/download?format=adif{{ snap }}" class="btn btn-outline-primary">Download as plain ADIF</a>
+        {% endif %}
     </div>
 
     <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js"></script>
@@ -164,131 +260,546 @@ qso_detail_template = """
         <p><strong>QRZ?:</strong> {{ entry['qsl_rcvd'] }}</p>
         <p><strong>Satellite Name:</strong> {{ entry['sat_name'] }}</p>
         <p><strong>QSL Received:</strong> {{ entry['qsl_rcvd'] }}</p>
-        <a href="/" class="btn btn-primary">Back to Logbook</a>
+
+        {% if other_qsos %}
+        <h4 class="mt-4">Other QSOs with {{ entry['call'] }}</h4>
+        <table class="table table-striped">
+            <thead class="table-dark">
+                <tr><th>Date</th><th>Time</th><th>Band</th><th>Mode</th><th>Details</th></tr>
+            </thead>
+            <tbody>
+                {% for other in other_qsos %}
+                <tr>
+                    <td>{{ other['qso_date'] }}</td>
+                    <td>{{ other['time_on'] }}</td>
+                    <td>{{ other['band'] }}</td>
+                    <td>{{ other['mode'] }}</td>
+                    <td><a href="/qso/{{ other['app_qrzlog_logid'] }}{{ '?backup=' ~ (snapshot | urlencode) if snapshot }}" class="btn btn-primary btn-sm">View</a></td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        {% endif %}
+
+        <a href="/{{ '?backup=' ~ (snapshot | urlencode) if snapshot }}" class="btn btn-primary">Back to Logbook</a>
     </div>
 </body>
 </html>
 """
 
-# Function to parse ADIF data into a list of dictionaries
-def parse_adif(adif_data):
-    entries = []
-    qsos = adif_data.split('<eor>')
-
-    for qso in qsos:
-        entry = {}
-        entry['call'] = re.search(r'<call:(\d+)>(\S+)', qso)
-        entry['name'] = re.search(r'<name:(\d+)>(\S+)', qso)
-        entry['dxcc'] = re.search(r'<dxcc:(\d+)>(\S+)', qso)
-        entry['state'] = re.search(r'<state:(\d+)>(\S+)', qso)
-        entry['gridsquare'] = re.search(r'<gridsquare:(\d+)>(\S+)', qso)
-        entry['my_gridsquare'] = re.search(r'<my_gridsquare:(\d+)>(\S+)', qso)
-        entry['cqz'] = re.search(r'<cqz:(\d+)>(\S+)', qso)
-        entry['ituz'] = re.search(r'<ituz:(\d+)>(\S+)', qso)
-        entry['freq'] = re.search(r'<freq:(\d+)>(\S+)', qso)
-        entry['freq_rx'] = re.search(r'<freq_rx:(\d+)>(\S+)', qso)
-        entry['band'] = re.search(r'<band:(\d+)>(\S+)', qso)
-        entry['mode'] = re.search(r'<mode:(\d+)>(\S+)', qso)
-        entry['qso_date'] = re.search(r'<qso_date:(\d+)>(\S+)', qso)
-        entry['time_on'] = re.search(r'<time_on:(\d+)>(\S+)', qso)
-        entry['eqsl_qsl_rcvd'] = re.search(r'<eqsl_qsl_rcvd:(\d+)>(\S+)', qso)
-        entry['lotw_qsl_rcvd'] = re.search(r'<lotw_qsl_rcvd:(\d+)>(\S+)', qso)
-        entry['qsl_rcvd'] = re.search(r'<qsl_rcvd:(\d+)>(\S+)', qso)
-        entry['sat_name'] = re.search(r'<sat_name:(\d+)>(\S+)', qso)
-        entry['app_qrzlog_logid'] = re.search(r'<app_qrzlog_logid:(\d+)>(\S+)', qso)
-
-        for key in entry.keys():
-            match = entry[key]
-            entry[key] = match.group(2) if match else None
-
-        # Ensure the call field is present and non-empty
-        if entry['call']:
-            entries.append(entry)
-
-    return entries
-
-# Function to get the latest backup file from the backup directory
-def get_latest_backup():
-    # List all files in the backup directory
-    backup_files = glob.glob(os.path.join(BACKUP_DIR, '*.adif'))  # Assuming .adi files are the backups
 
-    if not backup_files:
-        return None
+# HTML template for comparing two backups
+diff_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Backup Changes</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
+</head>
+<body>
+    <div class="container">
+        <h1 class="my-4">Backup Changes</h1>
+
+        <form method="get" action="/diff" class="row g-2 my-3">
+            <div class="col">
+                <select name="old" class="form-select">
+                    {% for name in backups %}
+                    <option value="{{ name }}" {% if name == old %}selected{% endif %}>{{ name }}</option>
+                    {% endfor %}
+                </select>
+            </div>
+            <div class="col">
+                <select name="new" class="form-select">
+                    {% for name in backups %}
+                    <option value="{{ name }}" {% if name == new %}selected{% endif %}>{{ name }}</option>
+                    {% endfor %}
+                </select>
+            </div>
+            <div class="col-auto">
+                <button type="submit" class="btn btn-primary">Compare</button>
+            </div>
+        </form>
 
-    # Sort the files by modification time, newest first
-    latest_backup = max(backup_files, key=os.path.getmtime)
-    
-    return latest_backup
+        <p>
+            <span class="badge bg-success">{{ diff['added']|length }} added</span>
+            <span class="badge bg-danger">{{ diff['deleted']|length }} deleted</span>
+            <span class="badge bg-warning text-dark">{{ diff['modified']|length }} modified</span>
+        </p>
+
+        {% for title, records in [('Deleted', diff['deleted']), ('Added', diff['added'])] if records %}
+        <h4 class="mt-4">{{ title }}</h4>
+        <table class="table table-striped">
+            <thead class="table-dark">
+                <tr><th>Call</th><th>Date</th><th>Time</th><th>Band</th><th>Mode</th></tr>
+            </thead>
+            <tbody>
+                {% for entry in records[:limit] %}
+                <tr>
+                    <td>{{ entry['call'] }}</td>
+                    <td>{{ entry['qso_date'] }}</td>
+                    <td>{{ entry['time_on'] }}</td>
+                    <td>{{ entry['band'] }}</td>
+                    <td>{{ entry['mode'] }}</td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        {% endfor %}
+
+        {% if diff['modified'] %}
+        <h4 class="mt-4">Modified</h4>
+        <table class="table table-striped">
+            <thead class="table-dark">
+                <tr><th>Call</th><th>Date</th><th>Field</th><th>Before</th><th>After</th></tr>
+            </thead>
+            <tbody>
+                {% for entry, changes in diff['modified'][:limit] %}
+                {% for field, change in changes|dictsort %}
+                <tr>
+                    <td>{{ entry['call'] }}</td>
+                    <td>{{ entry['qso_date'] }}</td>
+                    <td>{{ field }}</td>
+                    <td>{{ change[0] }}</td>
+                    <td>{{ change[1] }}</td>
+                </tr>
+                {% endfor %}
+                {% endfor %}
+            </tbody>
+        </table>
+        {% endif %}
+
+        <a href="/" class="btn btn-primary">Back to Logbook</a>
+    </div>
+</body>
+</html>
+"""
+
+# Function to get the backup being served: the pinned one when serve.py has
+# preloaded it, otherwise the newest file in the backup directory
+def get_latest_backup():
+    if pinned_backup and backup_catalog().find(os.path.basename(pinned_backup)):
+        return pinned_backup
+    return find_latest_backup()
+
+# Function to get the catalog of BACKUP_DIR, kept up to date in the
+# background (made again if BACKUP_DIR is changed)
+def backup_catalog():
+    global catalog
+    if catalog is None or catalog.backup_dir != BACKUP_DIR:
+        if catalog is not None:
+            catalog.stop()
+        catalog = BackupCatalog(BACKUP_DIR)
+    return catalog
+
+# Function to find the latest backup file in the backup directory
+def find_latest_backup():
+    # .adif, .adif.gz and .adif.zst backups, newest first, from memory
+    return backup_catalog().latest()
+
+# Function to get the backup a request is about: ?backup=<file name> picks an
+# older snapshot from the catalog, otherwise the latest
+def selected_backup():
+    name = request.args.get('backup')
+    if name:
+        snapshot = backup_catalog().find(name)
+        return snapshot.path if snapshot else None
+    return get_latest_backup()
+
+# Function to say why selected_backup() found nothing
+def missing_backup():
+    if request.args.get('backup'):
+        return "Backup file not found."
+    return "No backup files found."
+
+# Function to describe a snapshot in the picker
+def snapshot_label(snapshot):
+    when = datetime.fromtimestamp(snapshot.mtime).strftime('%Y-%m-%d %H:%M')
+    if snapshot.status == 'ok':
+        qsos = f'{snapshot.qso_count:,} QSOs' + (', verified' if snapshot.verified else ', NOT verified' if snapshot.verified is False else '')
+    elif snapshot.status == 'error':
+        qsos = 'unreadable'
+    else:
+        qsos = 'counting QSOs'
+    return f'{snapshot.name} ({when}, {snapshot.size / 1e6:.1f} MB, {qsos})'
+
+# Function to get the logbook of a backup: the SQLite store for the latest
+# backup when configured, otherwise the parsed in-memory copy (only re-read
+# when the file changes)
+def open_logbook(backup):
+    if logstore and backup == get_latest_backup():
+        logstore.sync(backup)
+        return logstore
+    return logbook_cache.get(backup, backup_catalog().key(backup))
+
+# Function to pick the compression for this request's response: brotli when
+# the client takes it and the brotli package is installed, else gzip, else None
+def response_encoding():
+    encodings = ['br', 'gzip'] if brotli else ['gzip']
+    return request.accept_encodings.best_match(encodings)
+
+# Function to build the cache validators for a response built from backups: a
+# strong ETag from the files' identity, the URL and anything else the response
+# depends on, and the newest file's modification time
+def backup_validators(backups, *parts):
+    keys = [backup_catalog().key(path) for path in backups]
+    identity = json.dumps([keys, request.path, sorted(request.args.items(multi=True)), *parts])
+    etag = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+    last_modified = datetime.fromtimestamp(max(key[1] for key in keys) // 10**9, timezone.utc)
+    return etag, last_modified
+
+# Decorator for routes whose response depends only on the backups and the
+# query string. The response carries an ETag and Last-Modified, and a client
+# that already has the current version gets a 304 without the page being
+# rebuilt. sources returns the backups the route reads (default: the one
+# selected by the request), state anything else the page shows.
+def cacheable(sources=None, state=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            backups = [path for path in (sources() if sources else [selected_backup()]) if path]
+            if not backups:
+                return view(*args, **kwargs)
+
+            etag, last_modified = backup_validators(backups, response_encoding(), state() if state else None)
+            hit = not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+            metrics.inc('locallogger_http_cache_requests_total', result='hit' if hit else 'miss',
+                        help='Cacheable requests answered with 304 (hit) or in full (miss)')
+            if hit:
+                response = Response(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+# Function to compress a streamed response body chunk by chunk
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, flush = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, flush = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield flush()
+
+# Start timing a request
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+# Count and time every request by route. Registered before compress_response
+# so it runs after it and the timing includes compression; streamed bodies
+# are timed until their first byte.
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('locallogger_request_seconds', elapsed, help='Request latency by route', route=route)
+    metrics.inc('locallogger_responses_total', help='Responses by route and status code',
+                route=route, status=response.status_code)
+    if response.status_code >= 500 or elapsed >= SLOW_REQUEST_SECONDS:
+        log_event('request', level=logging.WARNING, route=route, path=request.full_path,
+                  status=response.status_code, seconds=round(elapsed, 3))
+    return response
+
+# Compress text responses for clients that accept it. Byte ranges, files sent
+# as they are and responses that are already encoded are left alone.
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.accept_ranges
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = response_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# Function to encode a keyset cursor: the log ID of the last QSO sent that has
+# one (None for the start of the logbook), how many QSOs were sent after it,
+# plus the order they were sent in so the cursor cannot be used with a different one
+def encode_cursor(log_id, sort_by, order, skip=0):
+    data = {'after': log_id, 'sort_by': sort_by, 'order': order}
+    if skip:
+        data['skip'] = skip
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii').rstrip('=')
+
+# Function to decode a keyset cursor, returning the log ID to start after and
+# the number of QSOs to skip past it (ValueError if invalid)
+def decode_cursor(cursor, sort_by, order):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("invalid cursor")
+    if not isinstance(data, dict) or data.get('sort_by') != sort_by or data.get('order') != order:
+        raise ValueError("cursor does not match sort_by and order")
+    after, skip = data.get('after'), data.get('skip', 0)
+    if 'after' not in data or not (after is None or isinstance(after, str)):
+        raise ValueError("invalid cursor")
+    if type(skip) is not int or skip < 0:
+        raise ValueError("invalid cursor")
+    return after, skip
+
+# Function to read the filter and sort parameters shared by the API routes
+def api_params():
+    return (request.args.get('query', ''), request.args.get('sort_by', 'call'),
+            'desc' if request.args.get('order') == 'desc' else 'asc')
+
+# Function to render QSOs as CSV text, with the header row if asked for
+def qsos_csv(entries, header=False):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(QSO_FIELDS)
+    writer.writerows([entry[field] for field in QSO_FIELDS] for entry in entries)
+    return out.getvalue()
 
 # Route to render the logbook with search, pagination, sorting functionality
 @app.route('/')
+@cacheable(state=lambda: backup_catalog().version)
 def logbook():
     query = request.args.get('query', '')
     page = int(request.args.get('page', 1))
     sort_by = request.args.get('sort_by', 'call')
     order = request.args.get('order', 'asc')
 
-    # Get the latest backup file
-    latest_backup = get_latest_backup()
+    # Get the latest backup file, or the snapshot picked
+    latest_backup = selected_backup()
 
     if not latest_backup:
-        return "No backup files found.", 404
-
-    # Read the latest backup file and parse ADIF data
-    with open(latest_backup, 'r') as f:
-        adif_data = f.read()
+        return missing_backup(), 404
 
-    logbook_entries = parse_adif(adif_data)
+    logbook = open_logbook(latest_backup)
 
-    # Sort logbook entries by the specified field and order
-    reverse = (order == 'desc')
-    logbook_entries = sorted(logbook_entries, key=lambda x: x.get(sort_by, ''), reverse=reverse)
-
-    # Filter logbook entries by query
-    if query:
-        logbook_entries = [entry for entry in logbook_entries if query.lower() in str(entry).lower()]
+    # Sort by the specified field and order, filter by query and cut out one page
+    logbook_entries, total_entries = logbook.search(query, sort_by, order, page, QSOS_PER_PAGE)
 
     # Pagination logic
-    total_entries = len(logbook_entries)
     total_pages = math.ceil(total_entries / QSOS_PER_PAGE)
-    logbook_entries = logbook_entries[(page - 1) * QSOS_PER_PAGE: page * QSOS_PER_PAGE]
+
+    snapshots = [(snapshot.name, snapshot_label(snapshot)) for snapshot in backup_catalog().snapshots()]
 
     return render_template_string(html_template, latest_backup=os.path.basename(latest_backup),
+                                  snapshot=request.args.get('backup', ''), snapshots=snapshots,
                                   logbook_entries=logbook_entries, query=query,
                                   current_page=page, total_pages=total_pages,
-                                  sort_by=sort_by, order=order)
+                                  sort_by=sort_by, order=order,
+                                  compressed=bool(compression_of(latest_backup)))
 
 # Route to display QSO details for a specific QSO based on APP_QRZLOG_LOGID
 @app.route('/qso/<string:log_id>')
+@cacheable()
 def qso_detail(log_id):
-    latest_backup = get_latest_backup()
+    latest_backup = selected_backup()
 
     if not latest_backup:
-        return "No backup files found.", 404
+        return missing_backup(), 404
 
-    # Read the latest backup file and parse ADIF data
-    with open(latest_backup, 'r') as f:
-        adif_data = f.read()
-
-    logbook_entries = parse_adif(adif_data)
+    logbook = open_logbook(latest_backup)
 
     # Find the entry with the given APP_QRZLOG_LOGID
-    entry = next((entry for entry in logbook_entries if entry['app_qrzlog_logid'] == log_id), None)
+    entry = logbook.find(log_id)
 
     if not entry:
         return "QSO not found.", 404
 
-    return render_template_string(qso_detail_template, entry=entry)
+    # Other QSOs with the same station
+    other_qsos = [other for other in logbook.find_call(entry['call']) if other['app_qrzlog_logid'] != log_id]
+
+    return render_template_string(qso_detail_template, entry=entry, other_qsos=other_qsos,
+                                  snapshot=request.args.get('backup', ''))
 
-# Route to download the latest logbook file
+# Route to return one page of QSOs as JSON (or CSV with format=csv), with the
+# same query, sort_by and order as the logbook page. Pages are chained with
+# keyset cursors: pass next_cursor back as cursor to get the following page.
+@app.route('/api/qsos')
+@cacheable()
+def api_qsos():
+    latest_backup = selected_backup()
+    if not latest_backup:
+        return jsonify(error=missing_backup()), 404
+
+    query, sort_by, order = api_params()
+    output = request.args.get('format', 'json')
+    try:
+        limit = min(max(int(request.args.get('limit', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        after, skip = None, 0
+        if request.args.get('cursor'):
+            after, skip = decode_cursor(request.args['cursor'], sort_by, order)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    try:
+        entries, total = open_logbook(latest_backup).search(query, sort_by, order, per_page=skip + limit,
+                                                            after=after)
+    except KeyError:
+        return jsonify(error="The QSO this cursor points at is no longer in the logbook, start again."), 410
+
+    entries = [dict(entry) for entry in islice(entries, skip, None)]
+
+    # The next page starts after the last QSO with a log ID, skipping the ones
+    # sent after it, so QSOs without a log ID neither end nor loop the paging
+    next_cursor = None
+    if len(entries) == limit:
+        skip += limit
+        for index in range(limit - 1, -1, -1):
+            if entries[index]['app_qrzlog_logid']:
+                after, skip = entries[index]['app_qrzlog_logid'], limit - 1 - index
+                break
+        next_cursor = encode_cursor(after, sort_by, order, skip)
+
+    if output == 'csv':
+        response = Response(qsos_csv(entries, header=True), mimetype='text/csv')
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+    else:
+        response = jsonify(backup=os.path.basename(latest_backup), total=total, qsos=entries,
+                           next_cursor=next_cursor)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+# Route to stream every matching QSO as JSON (or CSV with format=csv) in one
+# chunked response, fetched from the logbook a chunk at a time
+@app.route('/api/qsos/export')
+@cacheable()
+def api_qsos_export():
+    latest_backup = selected_backup()
+    if not latest_backup:
+        return jsonify(error=missing_backup()), 404
+
+    query, sort_by, order = api_params()
+    output = request.args.get('format', 'json')
+
+    logbook = open_logbook(latest_backup)
+
+    # Keyset steps from the last log ID sent; a QSO without one falls back to page numbers
+    def chunks():
+        page, after = 1, None
+        while True:
+            entries, _ = logbook.search(query, sort_by, order, page, EXPORT_CHUNK_SIZE, after=after)
+            if entries:
+                yield entries
+            if len(entries) < EXPORT_CHUNK_SIZE:
+                return
+            page += 1
+            after = entries[-1]['app_qrzlog_logid'] or None
+
+    def generate_csv():
+        yield qsos_csv([], header=True)
+        for entries in chunks():
+            yield qsos_csv(entries)
+
+    def generate_json():
+        separator = '['
+        for entries in chunks():
+            yield separator + ','.join(json.dumps(dict(entry)) for entry in entries)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+    if output == 'csv':
+        filename = backup_name(latest_backup) + '.csv'
+        response = Response(stream_with_context(generate_csv()), mimetype='text/csv',
+                            headers={'Content-Disposition': f'attachment; filename={filename}'})
+    else:
+        response = Response(stream_with_context(generate_json()), mimetype='application/json')
+    return response
+
+# Function to diff two backups, remembering recent results while the files are unchanged
+@lru_cache(maxsize=4)
+def cached_diff(old_key, new_key):
+    return diff_files(old_key[0], new_key[0])
+
+# Route to show the QSOs added, deleted or modified between two backups
+@app.route('/diff')
+@cacheable(lambda: [snapshot.path for snapshot in backup_catalog().snapshots()])
+def backup_diff():
+    backups = [snapshot.path for snapshot in reversed(backup_catalog().snapshots())]
+    if len(backups) < 2:
+        return "At least two backup files are needed to compare.", 404
+
+    by_name = {os.path.basename(path): path for path in backups}
+    old = request.args.get('old', os.path.basename(backups[-2]))
+    new = request.args.get('new', os.path.basename(backups[-1]))
+    if old not in by_name or new not in by_name:
+        return "Backup file not found.", 404
+
+    diff = cached_diff(backup_catalog().key(by_name[old]), backup_catalog().key(by_name[new]))
+
+    return render_template_string(diff_template, diff=diff, old=old, new=new,
+                                  backups=list(reversed(list(by_name))), limit=DIFF_DISPLAY_LIMIT)
+
+# Function to read a backup as plain ADIF bytes, decompressing it on the fly
+def iter_plain_backup(path):
+    with open_backup(path) as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+            yield chunk.encode('utf-8')
+
+# Function to get the size of a backup as plain ADIF, worked out once per file
+@lru_cache(maxsize=4)
+def plain_backup_size(key):
+    return sum(map(len, iter_plain_backup(key[0])))
+
+# Route to download the latest logbook file. Both the stored file and the
+# plain ADIF version answer conditional and Range requests, so an interrupted
+# download of a large log can be resumed.
 @app.route('/download')
 def download():
-    latest_backup = get_latest_backup()
+    latest_backup = selected_backup()
 
     if not latest_backup:
-        return "No backup files found.", 404
-
-    return send_file(latest_backup, as_attachment=True)
+        return missing_backup(), 404
+
+    etag, last_modified = backup_validators([latest_backup])
+
+    # ?format=adif sends plain ADIF, decompressing the backup on the fly
+    if request.args.get('format') == 'adif' and compression_of(latest_backup):
+        filename = backup_name(latest_backup) + '.adif'
+        response = Response(stream_with_context(iter_plain_backup(latest_backup)), mimetype='text/plain',
+                            headers={'Content-Disposition': f'attachment; filename={filename}'})
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response.make_conditional(request, accept_ranges=True,
+                                         complete_length=plain_backup_size(backup_catalog().key(latest_backup)))
+
+    return send_file(latest_backup, as_attachment=True, etag=etag, last_modified=last_modified)
+
+# Route to expose request, cache and logbook metrics in the Prometheus text format
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True)
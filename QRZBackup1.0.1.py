@@ -29,81 +29,216 @@
 # THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
 
 
-import requests
 import os
 from datetime import datetime
-import glob
-import html  # To decode HTML entities
+import logging
+import shutil
+import time
+
+from adif_diff import diff_files
+from backup_files import atomic_backup, compression_suffix, list_backups
+from backup_manifest import write_manifest
+from backup_store import prune_snapshots, store_snapshot
+from qrz_api import download_adif
+from metrics import log_event, metrics, setup_json_logging
+from qrz_sync import check_unchanged, record_backup, sync_logbook
+from retention import apply_retention, print_plan
 
 # QRZ API key
 QRZ_API_KEY = 'your-qrz-api-key'
 
 # Backup settings
 BACKUP_DIR = './qrz_backups'
-BACKUP_COUNT = 7
 ADIF_FILENAME = 'qrz_logbook_backup_{timestamp}.adif'
 
-# QRZ API URL for fetching logbook in ADIF format
-QRZ_LOGBOOK_ADIF_URL = f"https://logbook.qrz.com/api?key={QRZ_API_KEY}&action=fetch&option=ALL"
+# Compress backups with 'gzip' (.adif.gz) or 'zstd' (.adif.zst, needs the
+# zstandard package); None writes plain .adif files
+COMPRESSION = None
+
+# Which backups to keep: the newest 'last' backups, then the newest backup of
+# each of the last 'daily' days, 'weekly' weeks, 'monthly' months and 'yearly'
+# years. Backups with no QSO changes since the previous one do not use up a
+# slot, and verified backups are kept before unverified ones. Set
+# RETENTION_DRY_RUN = True to only print what would be deleted.
+RETENTION = {'last': 1, 'daily': 7, 'weekly': 4, 'monthly': 12, 'yearly': 0}
+RETENTION_DRY_RUN = False
+
+# 'files' keeps full ADIF copies as set by RETENTION. 'dedup' adds every backup to a
+# deduplicated store that keeps STORE_HISTORY snapshots for about the disk
+# cost of one log, and keeps only the newest full copy for Local Logger.
+BACKUP_STORE = 'files'
+STORE_DIR = os.path.join(BACKUP_DIR, 'store')
+STORE_HISTORY = 90
+
+# Compare each backup with the previous one and warn about deleted QSOs
+DIFF_AFTER_BACKUP = True
+
+# 'full' downloads the whole log every run, 'incremental' only fetches QSOs
+# added or changed since the last run and merges them into a local master copy
+SYNC_MODE = 'full'
+
+# Ask QRZ for the logbook's QSO count and changes first, and skip the download
+# when nothing changed since the last verified backup (the whole log is still
+# fetched every FULL_SYNC_DAYS days). A fresh download with exactly the same
+# QSOs as the last backup is not kept either.
+SKIP_UNCHANGED = True
+
+# Monitoring: write each run's events (download, verification, retention,
+# errors) as JSON lines to JSON_LOG, and its metrics (phase timings, bytes
+# downloaded, QSO count, success) to METRICS_FILE in the Prometheus text
+# format, e.g. for node_exporter's textfile collector:
+# METRICS_FILE = '/var/lib/node_exporter/textfile_collector/qrz_backup.prom'
+JSON_LOG = None
+METRICS_FILE = None
+
+# QRZ Logbook API endpoint (point this at qrz_stub.py for testing)
+QRZ_API_URL = 'https://logbook.qrz.com/api'
+
+# Number of QSOs requested per page; each page is written to disk as it arrives
+PAGE_SIZE = 250
 
 # Custom application header
 HEADERS = {
     'User-Agent': 'QRZLogBackup/1.0.1'
 }
 
-# Fetch logbook data in ADIF format using API key
-def fetch_logbook_adif():
-    response = requests.get(QRZ_LOGBOOK_ADIF_URL, headers=HEADERS)
-    if response.status_code == 200:
-        if 'STATUS=FAIL' in response.text:
-            raise Exception(f"QRZ API failed: {response.text}")
-        
-        # Decode the HTML entities
-        decoded_data = html.unescape(response.text)
-        return decoded_data  # Return decoded ADIF data
-    else:
-        raise Exception(f"Failed to fetch logbook from QRZ API, status code: {response.status_code}")
+# Fetch logbook data in ADIF format using API key, page by page into adif_file
+def fetch_logbook_adif(adif_file):
+    qso_count, _ = download_adif(QRZ_API_KEY, adif_file, page_size=PAGE_SIZE, api_url=QRZ_API_URL, headers=HEADERS)
+    return qso_count
 
-# Save logbook data to ADIF file
-def save_logbook_data(logbook_data):
+# Path for a new timestamped backup file
+def new_backup_file():
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    adif_file = os.path.join(BACKUP_DIR, ADIF_FILENAME.format(timestamp=timestamp))
-    
-    # Write the decoded data to the ADIF file
-    with open(adif_file, 'w', encoding='utf-8') as f:
-        f.write(logbook_data)
-    
-    print(f"Backup saved: {adif_file}")
-    return adif_file
-
-# Manage backups, keep only the 7 most recent
+    return os.path.join(BACKUP_DIR, ADIF_FILENAME.format(timestamp=timestamp) + compression_suffix(COMPRESSION))
+
+# Compare a new backup with the one before it and report what changed
+def report_changes(adif_file):
+    previous = [backup for backup in list_backups(BACKUP_DIR) if backup != adif_file]
+    if not previous:
+        return
+
+    previous_backup = max(previous, key=os.path.getmtime)
+    diff = diff_files(previous_backup, adif_file)
+    print(f"Changes since {os.path.basename(previous_backup)}: {len(diff['added'])} added, "
+          f"{len(diff['deleted'])} deleted, {len(diff['modified'])} modified")
+    log_event('changes', level=logging.WARNING if diff['deleted'] else logging.INFO,
+              previous=os.path.basename(previous_backup), **{kind: len(records) for kind, records in diff.items()})
+    if diff['deleted']:
+        print(f"WARNING: {len(diff['deleted'])} QSOs are missing compared to the previous backup, "
+              f"check your QRZ logbook (python adif_diff.py {previous_backup} {adif_file})")
+
+# Manage backups, thinning them out to the RETENTION tiers
 def manage_backups():
-    backups = sorted(glob.glob(os.path.join(BACKUP_DIR, '*.adif')), key=os.path.getctime)
-    
-    # If more than BACKUP_COUNT backups exist, remove the oldest ones
-    if len(backups) > BACKUP_COUNT:
-        for old_backup in backups[:-BACKUP_COUNT]:
-            os.remove(old_backup)
-            print(f"Deleted old backup: {old_backup}")
+    # The dedup store holds the history, so one full copy is enough
+    retention = {'last': 1} if BACKUP_STORE == 'dedup' else RETENTION
+
+    keep, delete = apply_retention(BACKUP_DIR, retention, dry_run=RETENTION_DRY_RUN)
+    if RETENTION_DRY_RUN:
+        print_plan(keep, delete, dry_run=True)
+    else:
+        for old_backup, reason in delete.items():
+            print(f"Deleted old backup: {old_backup} ({reason})")
+
+# Record how a backup run ended and write the metrics file
+def finish_run(status, started, **fields):
+    elapsed = time.perf_counter() - started
+    metrics.set('qrz_backup_last_run_timestamp_seconds', time.time(), help='When the backup last ran')
+    metrics.set('qrz_backup_success', int(status != 'failed'), help='1 if the last backup run succeeded')
+    metrics.set('qrz_backup_unchanged', int(status == 'unchanged'),
+                help='1 if the logbook had not changed and no new backup was saved')
+    metrics.set('qrz_backup_duration_seconds', elapsed, help='Length of the last backup run')
+    log_event(f'backup_{status}', level=logging.ERROR if status == 'failed' else logging.INFO,
+              seconds=round(elapsed, 3), **fields)
+    if METRICS_FILE:
+        try:
+            metrics.write_textfile(METRICS_FILE)
+        except OSError as e:
+            print(f"WARNING: could not write {METRICS_FILE}: {e}")
+
+# Time one step of the backup into qrz_backup_phase_seconds
+def phase(name):
+    return metrics.timer('qrz_backup_phase_seconds', help='Time taken by each step of the last backup run',
+                         gauge=True, phase=name)
 
 # Main function to run the backup process
 def run_backup():
+    started = time.perf_counter()
+    if JSON_LOG:
+        setup_json_logging(JSON_LOG)
+
     try:
         # Ensure backup directory exists
         if not os.path.exists(BACKUP_DIR):
             os.makedirs(BACKUP_DIR)
+
+        if SKIP_UNCHANGED:
+            with phase('check'):
+                check = check_unchanged(QRZ_API_KEY, BACKUP_DIR, api_url=QRZ_API_URL, headers=HEADERS)
+            if check:
+                print(f"Logbook unchanged since {check['backup']} ({check['qso_count']} QSOs), nothing to download")
+                metrics.set('qrz_backup_qsos', check['qso_count'], help='QSOs in the latest backup')
+                finish_run('unchanged', started, backup=check['backup'], qsos=check['qso_count'])
+                return
         
-        # Fetch logbook in ADIF format using API key
-        logbook_data = fetch_logbook_adif()
-        
-        # Save logbook data to ADIF file
-        save_logbook_data(logbook_data)
+        adif_file = new_backup_file()
+
+        with phase('fetch'):
+            if SYNC_MODE == 'incremental':
+                # Fetch only the changes, merge them into the master copy and save a copy of it
+                master_file, stats = sync_logbook(QRZ_API_KEY, BACKUP_DIR, page_size=PAGE_SIZE,
+                                                  api_url=QRZ_API_URL, headers=HEADERS)
+                print(f"Synced {stats['fetched']} QSOs ({stats['added']} new, {stats['updated']} updated)")
+                with open(master_file, 'r', encoding='utf-8') as src, atomic_backup(adif_file) as dst:
+                    shutil.copyfileobj(src, dst)
+                qso_count = stats['total']
+            else:
+                # Fetch logbook in ADIF format using API key
+                qso_count = fetch_logbook_adif(adif_file)
+
+        print(f"Backup saved: {adif_file}")
+        print(f"Backup contains {qso_count} QSOs")
+        metrics.set('qrz_backup_qsos', qso_count, help='QSOs in the latest backup')
+        metrics.set('qrz_backup_bytes', os.path.getsize(adif_file), help='Size of the latest backup file')
+
+        # Read the backup back and record its checksum next to it
+        with phase('verify'):
+            manifest = write_manifest(adif_file, qso_count)
+        metrics.set('qrz_backup_verified', int(manifest['verified']), help='1 if the latest backup was verified')
+        log_event('backup_saved', file=os.path.basename(adif_file), qsos=qso_count, bytes=manifest['bytes'],
+                  verified=manifest['verified'], error=manifest.get('error'))
+        if manifest['verified']:
+            print(f"Backup verified (sha256 {manifest['sha256'][:16]}...)")
+        else:
+            print(f"WARNING: backup could not be verified: {manifest.get('error')}")
+
+        if SKIP_UNCHANGED:
+            kept = record_backup(BACKUP_DIR, adif_file, manifest)
+            if kept and kept != adif_file:
+                print(f"Logbook unchanged, same QSOs as {os.path.basename(kept)}; removed the new copy")
+                finish_run('unchanged', started, backup=os.path.basename(kept), qsos=qso_count)
+                return
+
+        if DIFF_AFTER_BACKUP:
+            with phase('diff'):
+                report_changes(adif_file)
+
+        if BACKUP_STORE == 'dedup':
+            # Add the backup to the deduplicated store
+            with phase('store'):
+                snapshot = store_snapshot(STORE_DIR, adif_file)
+                print(f"Stored snapshot {snapshot['name']} ({snapshot['new_objects']} new records)")
+                prune_snapshots(STORE_DIR, STORE_HISTORY)
         
         # Manage backups
-        manage_backups()
+        with phase('retention'):
+            manage_backups()
+
+        finish_run('succeeded', started, file=os.path.basename(adif_file), qsos=qso_count)
 
     except Exception as e:
         print(f"Error: {e}")
+        finish_run('failed', started, error=str(e))
 
 # Schedule this script to run nightly (via cron or task scheduler)
 if __name__ == '__main__':
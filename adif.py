@@ -0,0 +1,234 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Shared ADIF reader and writer used by the QRZ backup scripts and Local Logger.
+#
+# The file is read in a single pass: every <field:len> tag is located once and
+# its value is sliced using the length prefix, so values containing spaces,
+# newlines or even '<' characters come through intact. Tag names are matched
+# case-insensitively and returned in lowercase.
+
+import re
+
+# Matches <name>, <name:len> and <name:len:type>
+ADIF_TAG_RE = re.compile(r'<([A-Za-z0-9_]+)(?::(\d+))?(?::[^>]*)?>')
+ADIF_EOH_RE = re.compile(r'<eoh>', re.IGNORECASE)
+ADIF_EOR_RE = re.compile(r'<eor>', re.IGNORECASE)
+
+# Splits a record into [text, tag, value, tag, value, ...]
+ADIF_SPLIT_RE = re.compile(r'<([^<>]*)>')
+
+# Size of the blocks read by iter_adif_file
+READ_CHUNK_SIZE = 1 << 20
+
+# Fields shown by Local Logger (and the ones parse_adif always fills in)
+QSO_FIELDS = (
+    'call', 'name', 'dxcc', 'state', 'gridsquare', 'my_gridsquare', 'cqz',
+    'ituz', 'freq', 'freq_rx', 'band', 'mode', 'qso_date', 'time_on',
+    'eqsl_qsl_rcvd', 'lotw_qsl_rcvd', 'qsl_rcvd', 'sat_name', 'app_qrzlog_logid',
+)
+
+# Caches mapping a raw tag such as 'CALL:6' to its field name and length
+class _TagNames(dict):
+    def __missing__(self, tag):
+        match = ADIF_TAG_RE.fullmatch(f'<{tag}>')
+        if match is None:
+            raise KeyError(tag)
+        name = self[tag] = match.group(1).lower()
+        return name
+
+class _TagLengths(dict):
+    def __missing__(self, tag):
+        match = ADIF_TAG_RE.fullmatch(f'<{tag}>')
+        if match is None or match.group(2) is None:
+            raise KeyError(tag)
+        length = self[tag] = int(match.group(2))
+        return length
+
+_TAG_NAMES = _TagNames()
+_TAG_LENGTHS = _TagLengths()
+
+# Function to read one record starting at pos, honouring every length prefix.
+# Returns (kind, fields, end) where kind is 'eor', 'eoh' or None at end of data.
+def _read_exact(adif_data, pos):
+    search = ADIF_TAG_RE.search
+    fields = {}
+
+    while True:
+        match = search(adif_data, pos)
+        if match is None:
+            return None, fields, len(adif_data)
+
+        tag, length = match.group(1, 2)
+        pos = match.end()
+
+        if length is not None:
+            end = pos + int(length)
+            fields[tag.lower()] = adif_data[pos:end]
+            pos = end
+            continue
+
+        tag = tag.lower()
+        if tag in ('eor', 'eoh'):
+            return tag, fields, pos
+
+# Function to split one record into fields with a single C-level regex split.
+# Every value is checked against its length prefix; None means the record
+# needs the exact reader.
+def _read_fast(chunk):
+    parts = ADIF_SPLIT_RE.split(chunk)
+    tags = parts[1::2]
+    values = parts[2::2]
+
+    try:
+        lengths = list(map(_TAG_LENGTHS.__getitem__, tags))
+        if list(map(len, values)) != lengths:
+            # Allow whitespace between fields, as written by most loggers
+            values = list(map(str.rstrip, values))
+            if list(map(len, values)) != lengths:
+                return None
+        return dict(zip(map(_TAG_NAMES.__getitem__, tags), values))
+    except KeyError:
+        return None
+
+# Function to find where the QSO records start, returning (header, offset)
+def _read_header(adif_data):
+    eoh = ADIF_EOH_RE.search(adif_data)
+    if eoh is None:
+        return {}, 0
+
+    eor = ADIF_EOR_RE.search(adif_data, 0, eoh.start())
+    if eor is not None:
+        return {}, 0
+
+    kind, header, pos = _read_exact(adif_data, 0)
+    if kind != 'eoh':
+        return {}, 0
+    return header, pos
+
+# Function to yield (fields, end offset) for every complete record after pos
+def _iter_records(adif_data, pos):
+    search = ADIF_EOR_RE.search
+
+    while True:
+        eor = search(adif_data, pos)
+        if eor is None:
+            # Anything after the last <eor> is an incomplete record
+            return
+
+        fields = _read_fast(adif_data[pos:eor.start()])
+        if fields is None:
+            kind, fields, end = _read_exact(adif_data, pos)
+            if kind is None:
+                return
+            if kind == 'eoh':
+                # A header we did not spot up front; its fields are not a QSO
+                fields = {}
+        else:
+            end = eor.end()
+
+        yield fields, end
+        pos = end
+
+# Function to iterate over the QSO records in ADIF data, one dict per QSO
+def iter_adif(adif_data):
+    _, pos = _read_header(adif_data)
+    for fields, _ in _iter_records(adif_data, pos):
+        if fields:
+            yield fields
+
+# Function to iterate over the QSO records in ADIF data as (fields, text)
+# pairs, where text is the record exactly as it appears in adif_data
+def iter_adif_text(adif_data):
+    _, pos = _read_header(adif_data)
+    for fields, end in _iter_records(adif_data, pos):
+        if fields:
+            yield fields, adif_data[pos:end]
+        pos = end
+
+# Function to iterate over the QSO records of an open ADIF file, reading it in
+# blocks so memory use does not grow with the size of the log
+def iter_adif_file(f, chunk_size=READ_CHUNK_SIZE):
+    return read_adif_file(f, chunk_size)[1]
+
+# Function to read the header of an open ADIF file, returning it together with
+# an iterator over the QSO records. The file is read once from start to end,
+# so this also works on streams that cannot seek back, such as zstandard's.
+def read_adif_file(f, chunk_size=READ_CHUNK_SIZE):
+    buffer = f.read(chunk_size)
+    header, pos = _read_header(buffer)
+    return header, _iter_file_records(f, buffer, pos, chunk_size)
+
+# Function to yield the records of an open file, starting at pos in buffer
+def _iter_file_records(f, buffer, pos, chunk_size):
+    while True:
+        for fields, pos in _iter_records(buffer, pos):
+            if fields:
+                yield fields
+
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+# Function to read the ADIF header fields (empty if the file has no <eoh>)
+def parse_adif_header(adif_data):
+    return _read_header(adif_data)[0]
+
+# Function to parse ADIF data into a list of dictionaries
+def parse_adif(adif_data, fields=QSO_FIELDS):
+    entries = []
+    for record in iter_adif(adif_data):
+        entry = dict(zip(fields, map(record.get, fields)))
+
+        # Ensure the call field is present and non-empty
+        if entry.get('call'):
+            entries.append(entry)
+
+    return entries
+
+# Function to count the QSO records in ADIF data
+def count_adif(adif_data):
+    return sum(1 for _ in iter_adif(adif_data))
+
+# Function to render one record (or header) as ADIF fields
+def format_adif_fields(fields):
+    return ''.join(f'<{name}:{len(value)}>{value}' for name, value in fields.items() if value is not None)
+
+# Function to write ADIF records to an open text file
+def write_adif(f, records, header=None):
+    count = 0
+    if header:
+        f.write('QRZ Log Backup\n' + format_adif_fields(header) + '<eoh>\n')
+    for record in records:
+        f.write(format_adif_fields(record) + '<eor>\n')
+        count += 1
+    return count
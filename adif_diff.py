@@ -0,0 +1,122 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Compare two logbook backups and report added, deleted and modified QSOs.
+#
+# QSOs are matched on APP_QRZLOG_LOGID with a hash join: the old backup is
+# indexed once and the new one is streamed past it, so the cost grows
+# linearly with the size of the log. QSOs sharing a key (duplicates) are
+# matched one for one, identical copies first, so deleting one of two
+# duplicates is reported too.
+#
+# Usage: python adif_diff.py OLD_BACKUP NEW_BACKUP
+#
+# Exits with status 2 if QSOs were deleted, so a cron job can raise the alarm.
+
+import sys
+
+from adif import iter_adif_file
+from backup_files import open_backup
+
+# Fields that identify a QSO when it has no APP_QRZLOG_LOGID
+FALLBACK_KEY_FIELDS = ('call', 'qso_date', 'time_on', 'band', 'mode')
+
+# Function to get the key a QSO is matched on
+def qso_key(record):
+    log_id = record.get('app_qrzlog_logid')
+    if log_id:
+        return log_id
+    return tuple(record.get(field) for field in FALLBACK_KEY_FIELDS)
+
+# Function to list the fields that differ between two versions of a QSO
+def field_changes(old, new):
+    changes = {}
+    for field in old.keys() | new.keys():
+        if old.get(field) != new.get(field):
+            changes[field] = (old.get(field), new.get(field))
+    return changes
+
+# Function to diff two iterables of QSO records
+def diff_logbooks(old_records, new_records):
+    old_index = {}
+    for record in old_records:
+        old_index.setdefault(qso_key(record), []).append(record)
+    added = []
+    modified = []
+
+    for record in new_records:
+        key = qso_key(record)
+        olds = old_index.get(key)
+        if not olds:
+            added.append(record)
+            continue
+
+        if record in olds:
+            olds.remove(record)
+        else:
+            old = olds.pop(0)
+            modified.append((record, field_changes(old, record)))
+        if not olds:
+            del old_index[key]
+
+    # Whatever was not matched is gone from the new backup
+    deleted = [record for olds in old_index.values() for record in olds]
+    return {'added': added, 'deleted': deleted, 'modified': modified}
+
+# Function to diff two backup files (plain or compressed)
+def diff_files(old_path, new_path):
+    with open_backup(old_path) as old_f, open_backup(new_path) as new_f:
+        return diff_logbooks(iter_adif_file(old_f), iter_adif_file(new_f))
+
+# Function to describe a QSO on one line
+def describe_qso(record):
+    return ' '.join(record.get(field) or '-' for field in ('call', 'qso_date', 'time_on', 'band', 'mode'))
+
+# Function to summarise a diff as text lines
+def format_diff(diff):
+    lines = [f"{len(diff['added'])} added, {len(diff['deleted'])} deleted, {len(diff['modified'])} modified"]
+    for record in diff['added']:
+        lines.append(f"+ {describe_qso(record)}")
+    for record in diff['deleted']:
+        lines.append(f"- {describe_qso(record)}")
+    for record, changes in diff['modified']:
+        lines.append(f"~ {describe_qso(record)}")
+        for field, (old, new) in sorted(changes.items()):
+            lines.append(f"    {field}: {old!r} -> {new!r}")
+    return lines
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python adif_diff.py OLD_BACKUP NEW_BACKUP")
+        sys.exit(1)
+
+    diff = diff_files(sys.argv[1], sys.argv[2])
+    print('\n'.join(format_diff(diff)))
+    sys.exit(2 if diff['deleted'] else 0)
@@ -0,0 +1,281 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Catalog of the backups in a folder, for Local Logger.
+#
+# The list of backups is kept in memory so requests never glob and stat the
+# backup folder themselves, which is slow with long retention or a network
+# share. It is brought up to date when files appear, change or disappear:
+# straight away through watchdog (inotify on Linux) when it is installed, and
+# otherwise by rescanning every POLL_INTERVAL seconds. Each backup's QSOs are
+# taken from its manifest, or counted in the background, so the snapshot
+# picker can show them. A process forked from one using the catalog (a
+# gunicorn worker) only takes counts from manifests and leaves the counting to
+# the parent, which serve.py has do it before forking.
+
+import fnmatch
+import os
+import threading
+import weakref
+
+from backup_files import BACKUP_PATTERNS
+from backup_manifest import count_qsos, read_manifest
+from logbook import backup_key
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# Seconds between rescans without watchdog
+POLL_INTERVAL = 5
+
+# Seconds between rescans with watchdog, in case events are missed (network shares)
+WATCHDOG_RESCAN_INTERVAL = 60
+
+# Seconds to let a burst of file events settle before rescanning
+SETTLE_DELAY = 0.2
+
+# One backup file. status is 'pending' until its QSOs are counted, then 'ok'
+# or 'error' (with the reason in error) if it could not be read. verified is
+# the manifest's verdict, or None if the backup has no manifest.
+class Snapshot:
+    __slots__ = ('path', 'name', 'size', 'mtime_ns', 'qso_count', 'status', 'error', 'verified')
+
+    def __init__(self, path, size, mtime_ns):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.qso_count = None
+        self.status = 'pending'
+        self.error = None
+        self.verified = None
+
+    # Same identity as logbook.backup_key(path)
+    @property
+    def key(self):
+        return (self.path, self.mtime_ns, self.size)
+
+    @property
+    def mtime(self):
+        return self.mtime_ns / 1e9
+
+# Function to work out the QSO count, status, error and verified flag of a
+# snapshot, trusting its manifest when it was verified and the size matches.
+# With count=False a snapshot without such a manifest stays pending.
+def inspect_snapshot(snapshot, count=True):
+    manifest = read_manifest(snapshot.path)
+    verified = bool(manifest.get('verified')) if manifest else None
+    if verified and manifest.get('bytes') == snapshot.size:
+        return manifest.get('qso_count'), 'ok', None, True
+    if not count:
+        return None, 'pending', None, verified
+    try:
+        return count_qsos(snapshot.path), 'ok', None, verified
+    except Exception as e:
+        # Unreadable, corrupt or removed while counting
+        return None, 'error', str(e), verified
+
+# Watchdog handler that asks the catalog for a rescan on any change
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, catalog):
+        super().__init__()
+        self.catalog = catalog
+
+    def on_any_event(self, event):
+        self.catalog._dirty.set()
+
+class BackupCatalog:
+    def __init__(self, backup_dir, poll_interval=POLL_INTERVAL, count_qsos=True):
+        self.backup_dir = backup_dir
+        self.poll_interval = poll_interval
+        self.count_qsos = count_qsos
+        # Bumped whenever a snapshot is added, removed, changed or counted
+        self.version = 0
+        self._snapshots = {}
+        self._ordered = []
+        # Set in a forked child, which leaves counting to its parent
+        self._forked = False
+        self._reset()
+        _catalogs.add(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._uncounted = threading.Event()
+        self._stopped = threading.Event()
+        self._observer = None
+        self._started = False
+
+    # Scan the folder once and start watching it, the first time the catalog is used
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self.scan()
+            if Observer is not None and os.path.isdir(self.backup_dir):
+                self._observer = Observer()
+                self._observer.schedule(_ChangeHandler(self), self.backup_dir, recursive=False)
+                self._observer.daemon = True
+                self._observer.start()
+            threading.Thread(target=self._watch, name='backup-catalog', daemon=True).start()
+            if self.count_qsos:
+                threading.Thread(target=self._count, name='backup-counter', daemon=True).start()
+            self._started = True
+
+    # Stop watching the folder
+    def stop(self):
+        self._stopped.set()
+        self._dirty.set()
+        self._uncounted.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    # Rescan the folder, keeping what is known about unchanged files.
+    # Returns True if anything changed.
+    def scan(self):
+        found = {}
+        try:
+            with os.scandir(self.backup_dir) as entries:
+                for entry in entries:
+                    if any(fnmatch.fnmatch(entry.name, pattern) for pattern in BACKUP_PATTERNS) and entry.is_file():
+                        stat = entry.stat()
+                        found[entry.name] = (os.path.join(self.backup_dir, entry.name), stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            snapshots = {}
+            changed = len(found) != len(self._snapshots)
+            for name, (path, size, mtime_ns) in found.items():
+                snapshot = self._snapshots.get(name)
+                if snapshot is None or snapshot.size != size or snapshot.mtime_ns != mtime_ns:
+                    snapshot = Snapshot(path, size, mtime_ns)
+                    changed = True
+                snapshots[name] = snapshot
+
+            if changed:
+                self._snapshots = snapshots
+                self._ordered = sorted(snapshots.values(), key=lambda snapshot: snapshot.mtime_ns, reverse=True)
+                self.version += 1
+                self._uncounted.set()
+        return changed
+
+    # Rescan after file events (or every poll_interval without watchdog)
+    def _watch(self):
+        interval = WATCHDOG_RESCAN_INTERVAL if self._observer is not None else self.poll_interval
+        while not self._stopped.is_set():
+            if self._dirty.wait(interval):
+                # Let the rest of a burst of events (a file being written) arrive
+                self._stopped.wait(SETTLE_DELAY)
+            self._dirty.clear()
+            if not self._stopped.is_set():
+                self.scan()
+
+    # Count the QSOs of new snapshots in the background
+    def _count(self):
+        while not self._stopped.is_set():
+            self._uncounted.wait()
+            self._uncounted.clear()
+            self._count_pending()
+
+    # Count the QSOs of the snapshots not counted yet, newest first (only from
+    # manifests in a forked child)
+    def _count_pending(self):
+        with self._count_lock:
+            for snapshot in list(self._ordered):
+                if self._stopped.is_set():
+                    return
+                if snapshot.status != 'pending':
+                    continue
+                count, status, error, verified = inspect_snapshot(snapshot, count=not self._forked)
+                if status == 'pending' and verified == snapshot.verified:
+                    continue
+                with self._lock:
+                    snapshot.qso_count, snapshot.status, snapshot.error, snapshot.verified = count, status, error, verified
+                    self.version += 1
+
+    # Count every snapshot not counted yet now, e.g. before forking workers
+    # that will not count them themselves
+    def count_pending(self):
+        self._ensure_started()
+        self._count_pending()
+
+    # In a forked child: threads do not survive a fork, so start them again
+    # (with fresh locks) the next time the catalog is used
+    def _after_fork(self):
+        self._reset()
+        self._forked = True
+
+    # All snapshots, newest first
+    def snapshots(self):
+        self._ensure_started()
+        return list(self._ordered)
+
+    # Path of the newest backup that is not known to be unreadable, or None
+    def latest(self):
+        self._ensure_started()
+        for snapshot in self._ordered:
+            if snapshot.status != 'error':
+                return snapshot.path
+        return None
+
+    # Look up a snapshot by file name
+    def find(self, name):
+        self._ensure_started()
+        return self._snapshots.get(name)
+
+    # Identity of a backup as logbook.backup_key gives it, from memory when cataloged
+    def key(self, path):
+        self._ensure_started()
+        snapshot = self._snapshots.get(os.path.basename(path))
+        if snapshot is not None and snapshot.path == path:
+            return snapshot.key
+        return backup_key(path)
+
+# Catalogs in use in this process, see _after_fork_in_child
+_catalogs = weakref.WeakSet()
+
+# Function to reset the catalogs in a forked child, registered once for the
+# whole process. Stopped catalogs stay stopped.
+def _after_fork_in_child():
+    for catalog in list(_catalogs):
+        if not catalog._stopped.is_set():
+            catalog._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
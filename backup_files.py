@@ -0,0 +1,123 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Helpers for reading and writing backup files, plain or compressed.
+#
+# Backups are named *.adif, *.adif.gz or *.adif.zst. ADIF text compresses very
+# well, so gzip (always available) or zstd (needs the zstandard package) cut
+# both disk use and upload size by roughly an order of magnitude.
+
+import glob
+import gzip
+import os
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Suffix added after '.adif' for each compression setting
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Every file name pattern a backup can have
+BACKUP_PATTERNS = ('*.adif', '*.adif.gz', '*.adif.zst')
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+# Function to get the compression used by a backup file from its name
+def compression_of(path):
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+# Function to get the suffix for a compression setting, checking it is usable
+def compression_suffix(compression):
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+    return COMPRESSION_SUFFIXES[compression]
+
+# Function to open a backup file as UTF-8 text ('r' or 'w'), compressed or not.
+# The compression is taken from the file name unless given explicitly.
+def open_backup(path, mode='r', compression=None):
+    if compression is None:
+        compression = compression_of(path)
+
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("Reading .zst backups needs the zstandard package (pip install zstandard)")
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if mode == 'w' else None
+        return zstandard.open(path, mode + 't', cctx=cctx, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+# Function to flush a finished file to disk before it is renamed into place
+def fsync_file(path):
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+# Context manager to write a backup atomically: the text goes to a temporary
+# file that is flushed to disk and only then renamed over path, so a crash
+# never leaves a half-written backup behind
+@contextmanager
+def atomic_backup(path, compression=None):
+    tmp_path = path + '.tmp'
+    try:
+        with open_backup(tmp_path, 'w', compression or compression_of(path)) as f:
+            yield f
+        fsync_file(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# Function to list every backup file in a directory
+def list_backups(backup_dir):
+    backups = []
+    for pattern in BACKUP_PATTERNS:
+        backups.extend(glob.glob(os.path.join(backup_dir, pattern)))
+    return backups
+
+# Function to get a backup's name without its .adif/.gz/.zst extensions
+def backup_name(path):
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.zst'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name.endswith('.adif'):
+        name = name[:-len('.adif')]
+    return name
@@ -0,0 +1,215 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Checksummed manifests for backup files.
+#
+# Next to every backup sits a small JSON manifest (<backup>.manifest.json)
+# with its SHA-256, size in bytes, QSO count and a fingerprint of the QSOs
+# themselves (the same whatever the compression), and whether the file was
+# read back and parsed after it was written (verified). Retention uses it to keep
+# good backups over truncated ones, and the verify command checks a whole
+# backup folder against its manifests, one process per core:
+#
+#   python backup_manifest.py verify qrz_backups
+#   python backup_manifest.py write qrz_backups    (manifests for older backups)
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from adif import format_adif_fields, iter_adif_file
+from backup_files import list_backups, open_backup
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Size of the blocks hashed at a time
+HASH_CHUNK_SIZE = 1 << 20
+
+# Function to get the manifest path of a backup
+def manifest_path(path):
+    return path + MANIFEST_SUFFIX
+
+# Function to get the SHA-256 (hex) and size of a file
+def hash_file(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+# Function to count the QSOs of a backup by parsing all of it
+def count_qsos(path):
+    with open_backup(path) as f:
+        return sum(1 for _ in iter_adif_file(f))
+
+# Function to parse a whole backup, returning its QSO count and a SHA-256
+# fingerprint of the records. Two backups of an unchanged log have the same
+# fingerprint even when compressed differently or with a different header.
+def scan_qsos(path):
+    digest = hashlib.sha256()
+    count = 0
+    with open_backup(path) as f:
+        for record in iter_adif_file(f):
+            digest.update((format_adif_fields(record) + '\n').encode('utf-8'))
+            count += 1
+    return count, digest.hexdigest()
+
+# Function to read a backup back and describe it. The backup is verified if it
+# decompresses and parses to the end and, when expected_count is given, holds
+# exactly that many QSOs.
+def build_manifest(path, expected_count=None):
+    sha256, size = hash_file(path)
+    manifest = {
+        'file': os.path.basename(path),
+        'bytes': size,
+        'sha256': sha256,
+        'qso_count': None,
+        'fingerprint': None,
+        'verified': False,
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+    try:
+        manifest['qso_count'], manifest['fingerprint'] = scan_qsos(path)
+    except Exception as e:
+        # Truncated or corrupt compressed data, bad UTF-8...
+        manifest['error'] = str(e)
+        return manifest
+
+    if expected_count is not None and manifest['qso_count'] != expected_count:
+        manifest['error'] = f"expected {expected_count} QSOs, found {manifest['qso_count']}"
+        return manifest
+
+    manifest['verified'] = True
+    return manifest
+
+# Function to write the manifest of a backup (atomically) and return it
+def write_manifest(path, expected_count=None):
+    manifest = build_manifest(path, expected_count)
+    tmp_path = manifest_path(path) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path(path))
+    return manifest
+
+# Function to read the manifest of a backup, or None if it has none
+def read_manifest(path):
+    try:
+        with open(manifest_path(path), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+# Function to check a backup against its manifest. Returns a dict with the
+# file, its status ('ok', 'no manifest', 'unverified', 'size mismatch',
+# 'checksum mismatch', 'unreadable', 'count mismatch' or 'fingerprint
+# mismatch') and details.
+def verify_backup(path):
+    result = {'file': path, 'status': 'ok'}
+    manifest = read_manifest(path)
+    if manifest is None:
+        result['status'] = 'no manifest'
+        return result
+
+    try:
+        sha256, size = hash_file(path)
+    except OSError as e:
+        result.update(status='unreadable', error=str(e))
+        return result
+    result['bytes'] = size
+
+    if size != manifest.get('bytes'):
+        result.update(status='size mismatch', error=f"{size} bytes, manifest says {manifest.get('bytes')}")
+    elif sha256 != manifest.get('sha256'):
+        result['status'] = 'checksum mismatch'
+    elif not manifest.get('verified'):
+        result.update(status='unverified', error=manifest.get('error'))
+    else:
+        try:
+            result['qso_count'], fingerprint = scan_qsos(path)
+        except Exception as e:
+            result.update(status='unreadable', error=str(e))
+            return result
+        if result['qso_count'] != manifest.get('qso_count'):
+            result.update(status='count mismatch',
+                          error=f"{result['qso_count']} QSOs, manifest says {manifest.get('qso_count')}")
+        elif manifest.get('fingerprint') not in (None, fingerprint):
+            result['status'] = 'fingerprint mismatch'
+    return result
+
+# Function to verify every backup in a directory, jobs at a time (default:
+# one per core), largest first so the work spreads evenly
+def verify_dir(backup_dir, jobs=None):
+    backups = sorted(list_backups(backup_dir), key=os.path.getsize, reverse=True)
+    if not backups:
+        return []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(verify_backup, backups))
+    return sorted(results, key=lambda result: result['file'])
+
+# Function to delete a backup together with its manifest
+def remove_backup(path):
+    os.remove(path)
+    if os.path.exists(manifest_path(path)):
+        os.remove(manifest_path(path))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write and check checksummed manifests for backups.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    verify = commands.add_parser('verify', help='check every backup in a folder against its manifest')
+    verify.add_argument('backup_dir')
+    verify.add_argument('--jobs', type=int, help='processes to use (default: one per core)')
+    write = commands.add_parser('write', help='write manifests for backups that have none')
+    write.add_argument('backup_dir')
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        results = verify_dir(args.backup_dir, args.jobs)
+        for result in results:
+            detail = f" ({result['error']})" if result.get('error') else ''
+            print(f"{result['status']:18s} {os.path.basename(result['file'])}{detail}")
+        failed = [result for result in results if result['status'] != 'ok']
+        print(f"{len(results) - len(failed)} of {len(results)} backups verified")
+        sys.exit(1 if failed else 0)
+
+    for backup in sorted(list_backups(args.backup_dir)):
+        if read_manifest(backup) is None:
+            manifest = write_manifest(backup)
+            state = 'verified' if manifest['verified'] else f"NOT verified: {manifest.get('error')}"
+            print(f"{os.path.basename(backup)}: {manifest['qso_count']} QSOs, {state}")
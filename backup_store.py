@@ -0,0 +1,337 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Deduplicated backup store.
+#
+# Nightly backups are mostly the same QSOs over and over. Instead of keeping a
+# full ADIF copy per night, each QSO record is stored once, keyed by the
+# SHA-256 of its text. The records new in a snapshot are appended together to
+# one pack file (packs/pack-<hash>.pack) with an index of where each one
+# starts (packs/pack-<hash>.idx). Every snapshot is a small JSON manifest
+# (snapshots/<name>.json) listing its records as changes against the snapshot
+# before it: runs of records copied from that snapshot plus the new ones, so
+# a night without changes costs a few bytes. Any snapshot can be rebuilt as a
+# normal ADIF file on demand.
+#
+# Usage: python backup_store.py STORE_DIR list
+#        python backup_store.py STORE_DIR restore NAME DEST.adif
+#        python backup_store.py STORE_DIR prune KEEP
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from adif import format_adif_fields, read_adif_file, write_adif
+from backup_files import backup_name, open_backup
+
+PACKS_DIR = 'packs'
+SNAPSHOTS_DIR = 'snapshots'
+
+# Share of a pack that must be unused records before pruning rewrites it
+REPACK_SHARE = 0.25
+
+# Function to write a file atomically via a temporary file
+def _write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# Function to get the path of a snapshot manifest
+def _manifest_path(store_dir, name):
+    return os.path.join(store_dir, SNAPSHOTS_DIR, name + '.json')
+
+# Function to list pack names (without extension) that have an index
+def list_packs(store_dir):
+    packs_dir = os.path.join(store_dir, PACKS_DIR)
+    if not os.path.isdir(packs_dir):
+        return []
+    return sorted(name[:-4] for name in os.listdir(packs_dir) if name.endswith('.idx'))
+
+# Function to read a pack index: {digest: [offset, length]}
+def load_pack_index(store_dir, pack):
+    with open(os.path.join(store_dir, PACKS_DIR, pack + '.idx'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Function to map every stored record to (pack, offset, length)
+def load_index(store_dir):
+    index = {}
+    for pack in list_packs(store_dir):
+        for digest, (offset, length) in load_pack_index(store_dir, pack).items():
+            index[digest] = (pack, offset, length)
+    return index
+
+# Function to write records (digest, encoded text) as a new pack, returning its name.
+# The pack is written before its index, so a pack without one is never read.
+def write_pack(store_dir, records):
+    packs_dir = os.path.join(store_dir, PACKS_DIR)
+    os.makedirs(packs_dir, exist_ok=True)
+    tmp_path = os.path.join(packs_dir, 'pack.tmp')
+    pack_hash = hashlib.sha256()
+    pack_index = {}
+    offset = 0
+    with open(tmp_path, 'wb') as f:
+        for digest, data in records:
+            f.write(data)
+            pack_hash.update(data)
+            pack_index[digest] = [offset, len(data)]
+            offset += len(data)
+
+    pack = 'pack-' + pack_hash.hexdigest()[:16]
+    os.replace(tmp_path, os.path.join(packs_dir, pack + '.pack'))
+    _write_atomic(os.path.join(packs_dir, pack + '.idx'), json.dumps(pack_index))
+    return pack
+
+# Function to describe records as changes against base: [start, count] copies
+# a run of base records and a digest adds that record
+def encode_delta(base, records):
+    positions = {}
+    for i, digest in enumerate(base):
+        positions.setdefault(digest, i)
+
+    delta = []
+    i = 0
+    while i < len(records):
+        start = positions.get(records[i])
+        if start is None:
+            delta.append(records[i])
+            i += 1
+            continue
+
+        count = 1
+        while (i + count < len(records) and start + count < len(base)
+               and records[i + count] == base[start + count]):
+            count += 1
+        delta.append([start, count])
+        i += count
+    return delta
+
+# Function to rebuild the record list described by encode_delta
+def apply_delta(base, delta):
+    records = []
+    for change in delta:
+        if isinstance(change, str):
+            records.append(change)
+        else:
+            start, count = change
+            records.extend(base[start:start + count])
+    return records
+
+# Function to list snapshot names, oldest first
+def list_snapshots(store_dir):
+    snapshots_dir = os.path.join(store_dir, SNAPSHOTS_DIR)
+    if not os.path.isdir(snapshots_dir):
+        return []
+    return sorted(name[:-5] for name in os.listdir(snapshots_dir) if name.endswith('.json'))
+
+# Function to read a snapshot manifest
+def load_manifest(store_dir, name):
+    with open(_manifest_path(store_dir, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Function to write a snapshot manifest listing records, as changes against
+# the snapshot named base if there is one
+def write_manifest(store_dir, manifest, records, base=None, base_records=None):
+    manifest = dict(manifest, count=len(records))
+    manifest.pop('records', None)
+    manifest.pop('base', None)
+    manifest.pop('delta', None)
+    if base is None:
+        manifest['records'] = records
+    else:
+        manifest['base'] = base
+        manifest['delta'] = encode_delta(base_records, records)
+
+    os.makedirs(os.path.join(store_dir, SNAPSHOTS_DIR), exist_ok=True)
+    _write_atomic(_manifest_path(store_dir, manifest['name']), json.dumps(manifest))
+
+# Function to get the record digests of a snapshot in order, following its
+# chain of deltas. Pass the same cache dict to resolve many snapshots at once.
+def snapshot_records(store_dir, name, cache=None):
+    if cache is None:
+        cache = {}
+    chain = []
+    while name not in cache:
+        manifest = load_manifest(store_dir, name)
+        chain.append(manifest)
+        if 'base' not in manifest:
+            break
+        name = manifest['base']
+
+    records = cache.get(name)
+    for manifest in reversed(chain):
+        if 'base' in manifest:
+            records = apply_delta(records, manifest['delta'])
+        else:
+            records = manifest['records']
+        cache[manifest['name']] = records
+    return records
+
+# Function to add an ADIF backup file to the store as a snapshot
+def store_snapshot(store_dir, adif_file, name=None):
+    name = name or backup_name(adif_file)
+    if os.path.exists(_manifest_path(store_dir, name)):
+        raise FileExistsError(f"snapshot {name} is already in the store")
+
+    index = load_index(store_dir)
+    digests = []
+    new_records = {}
+
+    with open_backup(adif_file) as f:
+        header, records = read_adif_file(f)
+        for record in records:
+            data = (format_adif_fields(record) + '<eor>\n').encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()
+            if digest not in index:
+                new_records.setdefault(digest, data)
+            digests.append(digest)
+
+    if new_records:
+        write_pack(store_dir, new_records.items())
+
+    # Store the list of records as changes against the newest older snapshot
+    older = [snapshot for snapshot in list_snapshots(store_dir) if snapshot < name]
+    base = older[-1] if older else None
+    base_records = snapshot_records(store_dir, base) if base else None
+    manifest = {
+        'name': name,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'header': header,
+    }
+    write_manifest(store_dir, manifest, digests, base, base_records)
+
+    return {'name': name, 'count': len(digests), 'new_objects': len(new_records)}
+
+# Function to iterate over the raw ADIF text of each record in a snapshot
+def iter_snapshot(store_dir, name):
+    index = load_index(store_dir)
+    files = {}
+    try:
+        for digest in snapshot_records(store_dir, name):
+            pack, offset, length = index[digest]
+            if pack not in files:
+                files[pack] = open(os.path.join(store_dir, PACKS_DIR, pack + '.pack'), 'rb')
+            f = files[pack]
+            f.seek(offset)
+            yield f.read(length).decode('utf-8')
+    finally:
+        for f in files.values():
+            f.close()
+
+# Function to rebuild a snapshot as a normal ADIF file
+def restore_snapshot(store_dir, name, dest_path):
+    manifest = load_manifest(store_dir, name)
+    tmp_path = dest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        write_adif(f, [], manifest.get('header'))
+        for data in iter_snapshot(store_dir, name):
+            f.write(data)
+    os.replace(tmp_path, dest_path)
+    return manifest['count']
+
+# Function to delete one snapshot, first rewriting the snapshots based on it
+# against its own base (or in full)
+def remove_snapshot(store_dir, name, cache=None):
+    if cache is None:
+        cache = {}
+    manifest = load_manifest(store_dir, name)
+    base = manifest.get('base')
+    for other in list_snapshots(store_dir):
+        other_manifest = load_manifest(store_dir, other)
+        if other_manifest.get('base') == name:
+            records = snapshot_records(store_dir, other, cache)
+            base_records = snapshot_records(store_dir, base, cache) if base else None
+            write_manifest(store_dir, other_manifest, records, base, base_records)
+    os.remove(_manifest_path(store_dir, name))
+    cache.pop(name, None)
+
+# Function to keep only the newest snapshots and delete records nothing refers to
+def prune_snapshots(store_dir, keep):
+    snapshots = list_snapshots(store_dir)
+    removed = snapshots[:-keep] if keep > 0 else snapshots
+    cache = {}
+    for name in removed:
+        remove_snapshot(store_dir, name, cache)
+
+    # Mark every record still in use, then sweep the rest
+    live = set()
+    cache = {}
+    for name in list_snapshots(store_dir):
+        live.update(snapshot_records(store_dir, name, cache))
+
+    deleted_objects = 0
+    packs_dir = os.path.join(store_dir, PACKS_DIR)
+    for pack in list_packs(store_dir):
+        pack_index = load_pack_index(store_dir, pack)
+        unused = [digest for digest in pack_index if digest not in live]
+        unused_size = sum(pack_index[digest][1] for digest in unused)
+        total_size = sum(length for _, length in pack_index.values())
+        if not unused or (len(unused) < len(pack_index) and unused_size < total_size * REPACK_SHARE):
+            # Not worth rewriting yet; the records are dropped by a later prune
+            continue
+
+        # Copy the records still in use to a new pack, then drop the old one
+        with open(os.path.join(packs_dir, pack + '.pack'), 'rb') as f:
+            kept = []
+            for digest, (offset, length) in pack_index.items():
+                if digest in live:
+                    f.seek(offset)
+                    kept.append((digest, f.read(length)))
+        if kept:
+            write_pack(store_dir, kept)
+        os.remove(os.path.join(packs_dir, pack + '.idx'))
+        os.remove(os.path.join(packs_dir, pack + '.pack'))
+        deleted_objects += len(unused)
+
+    return {'snapshots': removed, 'objects': deleted_objects}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect and restore the deduplicated backup store.')
+    parser.add_argument('store_dir')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    restore = commands.add_parser('restore')
+    restore.add_argument('name')
+    restore.add_argument('dest')
+    prune = commands.add_parser('prune')
+    prune.add_argument('keep', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name in list_snapshots(args.store_dir):
+            print(f"{name}  {load_manifest(args.store_dir, name)['count']} QSOs")
+    elif args.command == 'restore':
+        count = restore_snapshot(args.store_dir, args.name, args.dest)
+        print(f"Restored {count} QSOs to {args.dest}")
+    else:
+        result = prune_snapshots(args.store_dir, args.keep)
+        print(f"Removed {len(result['snapshots'])} snapshots and {result['objects']} unused records")
@@ -0,0 +1,521 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Benchmarks for the QRZ backup tools.
+#
+# Usage: python bench.py [qso_count ...] [--only parse view ...] [--seed N]
+#                        [--output results.json] [--compare previous.json]
+#
+# Every benchmark runs on a reproducible synthetic log (the same seed gives
+# the same QSOs) of each size given, e.g. python bench.py 1000 100000 1000000.
+# The backup benchmark runs the nightly script against the QRZ stub in
+# qrz_stub.py, so nothing touches QRZ. Results can be saved as JSON and
+# compared with an earlier run to spot regressions between releases.
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from adif import parse_adif, write_adif
+from backup_files import open_backup
+from logbook import Logbook
+
+# Default size of the synthetic log
+DEFAULT_QSO_COUNT = 100000
+
+# The legacy regex parser takes minutes on bigger logs, so it is only timed up to this size
+LEGACY_MAX_QSOS = 200000
+
+# Detail pages fetched by the viewer benchmark
+DETAIL_LOOKUPS = 100
+
+# Share of QSOs modified, deleted and added between the two logs diffed
+DIFF_CHANGE_RATE = 0.01
+
+# Backup script run by the backup benchmark
+BACKUP_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'QRZBackup1.2.1Canary.py')
+
+# Nightly backups laid out for the retention benchmark
+RETENTION_BACKUPS = 730
+
+# A timing this much slower than in the compared run is reported as a regression
+REGRESSION_THRESHOLD = 1.2
+
+# Workers forked by the serving benchmark
+BENCH_WORKERS = 4
+
+# Requests each benchmark worker serves: every sort order both ways, a search and an API page
+BENCH_URLS = ([f'/?sort_by={field}&order={order}' for field in ('call', 'freq', 'band', 'mode', 'qso_date', 'time_on')
+               for order in ('asc', 'desc')] + ['/?query=mode:FT8 band:20m', '/api/qsos?limit=100'])
+
+# Bands and a typical frequency (MHz) on each
+BANDS = {
+    '160m': 1.840, '80m': 3.573, '40m': 7.074, '30m': 10.136, '20m': 14.074,
+    '17m': 18.100, '15m': 21.074, '12m': 24.915, '10m': 28.074, '6m': 50.313,
+    '2m': 144.174, '70cm': 432.100,
+}
+MODES = ['FT8', 'FT4', 'SSB', 'CW', 'RTTY', 'FM', 'JT65', 'PSK31']
+STATES = ['CA', 'TX', 'NY', 'FL', 'OH', 'WA', 'MI', 'PA', 'IL', 'CO']
+NAMES = ['John Smith', 'Maria Garcia', 'Bob', 'Li Wei', "Sean O'Brien", 'Anna-Lena Vogel']
+PREFIXES = ['W1', 'K2', 'N3', 'AA4', 'KD5', 'W6', 'K7', 'N8', 'W9', 'K0', 'VE3', 'G4', 'DL1', 'JA1']
+
+# Function to build one ADIF field
+def adif_field(name, value):
+    return f'<{name}:{len(value)}>{value}'
+
+# Function to generate reproducible synthetic QSO records
+def generate_records(count, seed=0):
+    rng = random.Random(seed)
+    band_names = list(BANDS)
+
+    for logid in range(1, count + 1):
+        band = rng.choice(band_names)
+        call = rng.choice(PREFIXES) + ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rng.randint(1, 3)))
+        grid = rng.choice('CDEFN') + rng.choice('MNOL') + str(rng.randint(10, 99))
+        yield {
+            'call': call,
+            'name': rng.choice(NAMES),
+            'dxcc': str(rng.choice([291, 1, 230, 339, 223])),
+            'state': rng.choice(STATES),
+            'gridsquare': grid,
+            'my_gridsquare': 'EN52',
+            'cqz': str(rng.randint(1, 40)),
+            'ituz': str(rng.randint(1, 75)),
+            'freq': f'{BANDS[band] + rng.randint(0, 3000) / 1000000:.6f}',
+            'freq_rx': f'{BANDS[band]:.6f}',
+            'band': band,
+            'mode': rng.choice(MODES),
+            'qso_date': f'20{rng.randint(15, 24):02d}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}',
+            'time_on': f'{rng.randint(0, 23):02d}{rng.randint(0, 59):02d}{rng.randint(0, 59):02d}',
+            'eqsl_qsl_rcvd': rng.choice('YN'),
+            'lotw_qsl_rcvd': rng.choice('YN'),
+            'qsl_rcvd': rng.choice('YN'),
+            'rst_sent': '-10',
+            'rst_rcvd': '-12',
+            'tx_pwr': str(rng.choice([5, 10, 50, 100])),
+            'qso_date_off': '',
+            'time_off': '',
+            'station_callsign': 'W9XYZ',
+            'operator': 'W9XYZ',
+            'my_city': 'Springfield',
+            'my_country': 'United States',
+            'my_cq_zone': '4',
+            'my_itu_zone': '8',
+            'country': 'United States',
+            'cont': 'NA',
+            'lat': f'N0{rng.randint(25, 48)} {rng.randint(0, 59):02d}.000',
+            'lon': f'W0{rng.randint(70, 124)} {rng.randint(0, 59):02d}.000',
+            'distance': str(rng.randint(0, 20000)),
+            'qsl_sent': rng.choice('YN'),
+            'lotw_qsl_sent': 'Y',
+            'eqsl_qsl_sent': rng.choice('YN'),
+            'qrzcom_qso_upload_status': 'Y',
+            'app_qrzlog_status': rng.choice('CN'),
+            'comment': 'tnx fer QSO <3' if rng.random() < 0.02 else rng.choice(['', 'tnx fer QSO', 'POTA K-1234', 'nice sig']),
+            'app_qrzlog_logid': str(1000000 + logid),
+        }
+
+# Function to render records as ADIF text, optionally with a header
+def generate_adif(count, seed=0, header=True):
+    parts = []
+    if header:
+        parts.append('Synthetic QRZ logbook\n' + adif_field('adif_ver', '3.1.4') + '<eoh>\n')
+    for record in generate_records(count, seed):
+        parts.append(''.join(adif_field(name, value) for name, value in record.items()) + '<eor>\n')
+    return ''.join(parts)
+
+# Function to write a synthetic backup file one record at a time, so even
+# a million QSO log never has to be held in memory. Returns the QSO count.
+def write_synthetic_backup(path, count, seed=0, records=None):
+    with open_backup(path, 'w') as f:
+        return write_adif(f, records if records is not None else generate_records(count, seed),
+                          header={'adif_ver': '3.1.4'})
+
+# The original 19-regex parser, kept as the baseline for the parser benchmark
+def legacy_parse_adif(adif_data):
+    entries = []
+    qsos = adif_data.split('<eor>')
+
+    for qso in qsos:
+        entry = {}
+        for field in ('call', 'name', 'dxcc', 'state', 'gridsquare', 'my_gridsquare', 'cqz',
+                      'ituz', 'freq', 'freq_rx', 'band', 'mode', 'qso_date', 'time_on',
+                      'eqsl_qsl_rcvd', 'lotw_qsl_rcvd', 'qsl_rcvd', 'sat_name', 'app_qrzlog_logid'):
+            match = re.search(rf'<{field}:(\d+)>(\S+)', qso)
+            entry[field] = match.group(2) if match else None
+
+        if entry['call']:
+            entries.append(entry)
+
+    return entries
+
+# Function to time a callable, returning (best seconds, result)
+def timed(func, *args, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+# Compare the single-pass parser with the legacy regex parser
+def bench_parse(count, seed=0):
+    adif_data = generate_adif(count, seed)
+    print(f"Synthetic log: {count} QSOs, {len(adif_data) / 1e6:.1f} MB")
+
+    new_time, new_entries = timed(parse_adif, adif_data)
+    assert len(new_entries) == count
+    results = {'adif_mb': len(adif_data) / 1e6, 'parse_s': new_time}
+
+    if count <= LEGACY_MAX_QSOS:
+        legacy_time, legacy_entries = timed(legacy_parse_adif, adif_data, repeat=1)
+        assert len(legacy_entries) == count
+        print(f"legacy parse_adif: {legacy_time:.3f}s")
+        results.update(legacy_parse_s=legacy_time, speedup=legacy_time / new_time)
+    print(f"parse_adif:        {new_time:.3f}s")
+    if 'speedup' in results:
+        print(f"speedup:           {results['speedup']:.1f}x")
+    return results
+
+# Function to measure the memory held by the result of func(*args)
+def traced_memory(func, *args):
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+# Compare the memory of a list of dicts with the columnar Logbook
+def bench_memory(count, seed=0):
+    adif_data = generate_adif(count, seed)
+    dict_bytes, entries = traced_memory(parse_adif, adif_data)
+    logbook_bytes, logbook = traced_memory(Logbook, 'bench', None, entries)
+
+    assert len(logbook) == len(entries) == count
+    print(f"list of dicts:     {dict_bytes / 1e6:.1f} MB")
+    print(f"columnar Logbook:  {logbook_bytes / 1e6:.1f} MB")
+    print(f"reduction:         {dict_bytes / logbook_bytes:.1f}x")
+    return {'dicts_mb': dict_bytes / 1e6, 'logbook_mb': logbook_bytes / 1e6,
+            'reduction': dict_bytes / logbook_bytes}
+
+# Time Local Logger's pages through the Flask test client: the first page
+# (parse and index), every sort order, searches, deep pages, API pages and
+# QSO detail lookups
+def bench_view(count, seed=0):
+    from serve import load_local_logger
+
+    with tempfile.TemporaryDirectory() as backup_dir:
+        write_synthetic_backup(os.path.join(backup_dir, 'qrz_logbook_backup_bench.adif'), count, seed)
+        logger = load_local_logger()
+        logger.BACKUP_DIR = backup_dir
+        client = logger.app.test_client()
+
+        def get(url):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            return response
+
+        first_page, _ = timed(get, '/', repeat=1)
+        results = {'first_page_s': first_page}
+        print(f"first page (parse and index): {first_page:.2f}s")
+
+        pages = {
+            'sort': [url for url in BENCH_URLS if 'sort_by' in url],
+            'filter': ['/?query=mode:FT8 band:20m', '/?query=W1*', '/?query=qso_date:2020',
+                       '/?query=freq:14.074-14.077', '/?query=POTA'],
+            'paginate': [f'/?page={page}&sort_by=qso_date' for page in (1, 10, 100, 1000)],
+            'api': ['/api/qsos?limit=100', '/api/qsos?limit=1000&sort_by=freq&order=desc',
+                    '/api/qsos?limit=100&format=csv'],
+        }
+        for name, urls in pages.items():
+            best = [timed(get, url)[0] for url in urls]
+            results[f'{name}_ms'] = sum(best) / len(best) * 1000
+            print(f"{name:9s} {results[f'{name}_ms']:8.1f} ms per page ({len(urls)} pages)")
+
+        # Follow the API cursor ten pages deep
+        start = time.perf_counter()
+        url = '/api/qsos?limit=100&sort_by=call'
+        for _ in range(10):
+            cursor = get(url).get_json()['next_cursor']
+            if not cursor:
+                break
+            url = f'/api/qsos?limit=100&sort_by=call&cursor={cursor}'
+        results['cursor_ms'] = (time.perf_counter() - start) / 10 * 1000
+        print(f"cursor    {results['cursor_ms']:8.1f} ms per page")
+
+        rng = random.Random(seed)
+        log_ids = [1000000 + rng.randint(1, count) for _ in range(DETAIL_LOOKUPS)]
+        start = time.perf_counter()
+        for log_id in log_ids:
+            get(f'/qso/{log_id}')
+        results['detail_ms'] = (time.perf_counter() - start) / len(log_ids) * 1000
+        print(f"detail    {results['detail_ms']:8.1f} ms per QSO")
+
+        logger.backup_catalog().stop()
+    return results
+
+# Function to copy the synthetic records with some QSOs modified, deleted and added
+def changed_records(count, seed=0, rate=DIFF_CHANGE_RATE):
+    rng = random.Random(seed + 1)
+    for record in generate_records(count, seed):
+        roll = rng.random()
+        if roll < rate:
+            continue
+        if roll < rate * 2:
+            record = dict(record, comment='edited', qsl_rcvd='Y')
+        yield record
+    for record in generate_records(int(count * rate), seed + 1):
+        yield dict(record, app_qrzlog_logid=str(int(record['app_qrzlog_logid']) + count))
+
+# Time the diff between two backups about DIFF_CHANGE_RATE apart
+def bench_diff(count, seed=0):
+    from adif_diff import diff_files
+
+    with tempfile.TemporaryDirectory() as backup_dir:
+        old_path = os.path.join(backup_dir, 'old.adif')
+        new_path = os.path.join(backup_dir, 'new.adif')
+        write_synthetic_backup(old_path, count, seed)
+        write_synthetic_backup(new_path, count, records=changed_records(count, seed))
+
+        diff_time, diff = timed(diff_files, old_path, new_path)
+    changes = {kind: len(records) for kind, records in diff.items()}
+    print(f"diff: {diff_time:.3f}s ({changes['added']} added, {changes['deleted']} deleted, "
+          f"{changes['modified']} modified)")
+    return {'diff_s': diff_time, **changes}
+
+# Time the nightly backup script against the QRZ stub: a full download with
+# manifest, diff and retention, then a night with no changes (STATUS check
+# only), then planning retention over two years of nightly backups
+def bench_backup(count, seed=0):
+    import importlib.util
+
+    from qrz_stub import StubLogbook, start_stub
+    from retention import apply_retention
+
+    server, url = start_stub(StubLogbook(generate_records(count, seed), moddate='2024-01-01'))
+    spec = importlib.util.spec_from_file_location('qrz_backup', BACKUP_SCRIPT_PATH)
+    backup = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(backup)
+
+    try:
+        with tempfile.TemporaryDirectory() as backup_dir:
+            backup.BACKUP_DIR = backup_dir
+            backup.QRZ_API_URL = url
+            backup.QRZ_API_KEY = 'bench'
+            backup.DESTINATIONS = []
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                full, _ = timed(backup.run_backup, repeat=1)
+                # Backups are named by the second
+                time.sleep(1)
+                unchanged, _ = timed(backup.run_backup, repeat=1)
+            assert 'Error' not in output.getvalue(), output.getvalue()
+            print(f"full backup:      {full:.2f}s")
+            print(f"unchanged night:  {unchanged * 1000:.0f} ms")
+
+        with tempfile.TemporaryDirectory() as backup_dir:
+            night = datetime(2024, 1, 1, 3, 0)
+            for day in range(RETENTION_BACKUPS):
+                name = f"qrz_logbook_backup_{night + timedelta(days=day):%Y%m%d_%H%M%S}.adif"
+                with open(os.path.join(backup_dir, name), 'w', encoding='utf-8') as f:
+                    f.write('<eoh>\n')
+            retention_time, (keep, _) = timed(apply_retention, backup_dir, {'last': 1, 'daily': 7, 'weekly': 4,
+                                                                              'monthly': 12, 'yearly': 5}, True)
+            print(f"retention plan:   {retention_time * 1000:.1f} ms for {RETENTION_BACKUPS} backups "
+                  f"({len(keep)} kept)")
+    finally:
+        server.shutdown()
+    return {'full_backup_s': full, 'unchanged_s': unchanged, 'retention_ms': retention_time * 1000}
+
+# Function to read a process's memory from /proc (Linux only): resident,
+# proportional (shared pages split between the processes using them) and private bytes
+def process_memory(pid='self'):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return values['Rss'], values['Pss'], values['Private_Clean'] + values['Private_Dirty']
+
+# Function to fork workers that each serve BENCH_URLS, returning the memory of
+# every worker measured while all of them are still running
+def fork_workers(logger, workers):
+    children = []
+    for _ in range(workers):
+        ready_read, ready_write = os.pipe()
+        go_read, go_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                client = logger.app.test_client()
+                for url in BENCH_URLS:
+                    client.get(url)
+                os.write(ready_write, b'.')
+                os.read(go_read, 1)
+            finally:
+                os._exit(0)
+        os.close(ready_write)
+        os.close(go_read)
+        children.append((pid, ready_read, go_write))
+
+    for _, ready_read, _ in children:
+        os.read(ready_read, 1)
+    memory = [process_memory(pid) for pid, _, _ in children]
+    for pid, ready_read, go_write in children:
+        os.write(go_write, b'.')
+        os.close(go_write)
+        os.close(ready_read)
+        os.waitpid(pid, 0)
+    return memory
+
+# Compare serving with the logbook preloaded before forking (as serve.py does
+# under gunicorn) against workers that each load it on their first request
+def bench_serve(count, seed=0, workers=BENCH_WORKERS):
+    if not os.path.exists('/proc/self/smaps_rollup') or not hasattr(os, 'fork'):
+        print("serving benchmark needs Linux")
+        return None
+
+    from serve import load_local_logger, preload
+
+    with tempfile.TemporaryDirectory() as backup_dir:
+        with open(os.path.join(backup_dir, 'qrz_logbook_backup_bench.adif'), 'w', encoding='utf-8') as f:
+            f.write(generate_adif(count, seed))
+
+        logger = load_local_logger()
+        logger.BACKUP_DIR = backup_dir
+        client = logger.app.test_client()
+
+        start = time.perf_counter()
+        client.get('/')
+        lazy_start = time.perf_counter() - start
+        logger.logbook_cache.clear()
+        lazy = fork_workers(logger, workers)
+
+        start = time.perf_counter()
+        preload(logger)
+        preload_time = time.perf_counter() - start
+        start = time.perf_counter()
+        client.get('/?sort_by=freq&order=desc')
+        first_page = time.perf_counter() - start
+        gc.freeze()
+        preloaded = fork_workers(logger, workers)
+        gc.unfreeze()
+
+    print(f"first page, parsed on request:   {lazy_start:.2f}s")
+    print(f"preload before serving:          {preload_time:.2f}s, then first page {first_page * 1000:.0f} ms")
+    results = {'lazy_first_page_s': lazy_start, 'preload_s': preload_time, 'preloaded_first_page_s': first_page}
+    for name, key, memory in (('loaded per worker', 'lazy', lazy), ('preloaded, shared', 'preloaded', preloaded)):
+        rss = sum(m[0] for m in memory) / len(memory) / 1e6
+        pss = sum(m[1] for m in memory) / len(memory) / 1e6
+        private = sum(m[2] for m in memory) / len(memory) / 1e6
+        print(f"{name:18s} per worker: RSS {rss:.1f} MB, PSS {pss:.1f} MB, private {private:.1f} MB")
+        results[f'{key}_private_mb'] = private
+    return results
+
+# Benchmarks by name, in the order they run
+BENCHMARKS = {
+    'parse': bench_parse,
+    'memory': bench_memory,
+    'view': bench_view,
+    'diff': bench_diff,
+    'backup': bench_backup,
+    'serve': bench_serve,
+}
+
+# Function to run the chosen benchmarks on logs of each size, returning the
+# results in the form saved as JSON
+def run_benchmarks(counts, names=tuple(BENCHMARKS), seed=0):
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'runs': {},
+    }
+    for count in counts:
+        for name in names:
+            print(f"== {name}, {count} QSOs")
+            result = BENCHMARKS[name](count, seed)
+            if result is not None:
+                results['runs'].setdefault(str(count), {})[name] = result
+    return results
+
+# Function to compare timings (the *_s and *_ms results) with an earlier run,
+# returning the ones more than REGRESSION_THRESHOLD times slower
+def compare_results(old, new, threshold=REGRESSION_THRESHOLD):
+    regressions = []
+    for count, benches in new['runs'].items():
+        for name, results in benches.items():
+            previous = old.get('runs', {}).get(count, {}).get(name, {})
+            for metric, value in results.items():
+                if not metric.endswith(('_s', '_ms')) or not previous.get(metric):
+                    continue
+                ratio = value / previous[metric]
+                flag = ' REGRESSION' if ratio > threshold else ''
+                print(f"{name:7s} {count:>8s} {metric:24s} {previous[metric]:10.3f} -> {value:10.3f} ({ratio:.2f}x){flag}")
+                if flag:
+                    regressions.append((name, count, metric, ratio))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the QRZ backup tools on synthetic logs.')
+    parser.add_argument('counts', nargs='*', type=int, default=[DEFAULT_QSO_COUNT],
+                        help=f'QSOs in the synthetic log, one run per size (default {DEFAULT_QSO_COUNT})')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='benchmarks to run (default all)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic log')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare with results saved by an earlier run')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.counts, args.only, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_results(json.load(f), results)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,317 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Places a finished backup can be copied to, and a runner that sends one file
+# to all of them at once.
+#
+# Each destination is built from a small config dict, e.g.
+#
+#   {'type': 'local', 'path': '/mnt/nas/qrz_backups'}
+#   {'type': 'sftp', 'host': 'nas.local', 'username': 'backup', 'remote_dir': 'qrz'}
+#   {'type': 's3', 'bucket': 'qrz-backups', 'endpoint_url': 'http://localhost:9000'}
+#   {'type': 'onedrive', 'client_id': '...', 'remote_dir': 'backups'}
+#   {'type': 'google_drive', 'settings_file': 'settings.yaml', 'folder_id': '...'}
+#
+# Uploads run in one thread per destination, so a slow target never holds up
+# the others. Every upload gets a deadline and stops itself once it passes;
+# the threads are daemon threads, so even an upload stuck inside a library
+# call cannot keep the nightly job from exiting. Cloud destinations share one pooled HTTP
+# session and the saved sign-ins of token_cache.py.
+#
+# SFTP needs the paramiko package, S3 needs boto3 (any S3-compatible server
+# such as MinIO works through endpoint_url), OneDrive needs msal and Google
+# Drive needs PyDrive. Only the packages for the destinations you use have to
+# be installed.
+
+import logging
+import os
+import shutil
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import log_event, metrics
+from token_cache import (GOOGLE_DRIVE_CREDENTIALS_FILE, ONEDRIVE_AUTHORITY, ONEDRIVE_CACHE_FILE, ONEDRIVE_SCOPES,
+                         google_drive_token, onedrive_token)
+from transfer import DRIVE_UPLOAD_URL, GRAPH_URL, upload_google_drive, upload_onedrive
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+# Give up waiting for uploads after this many seconds
+UPLOAD_TIMEOUT = 30 * 60
+
+# Copy block size for local destinations, checked against the deadline between blocks
+COPY_CHUNK_SIZE = 1 << 20
+
+# Function to raise TimeoutError once deadline (a time.monotonic() value) has passed
+def check_deadline(deadline):
+    if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError("upload ran out of time")
+
+# Function to create the pooled HTTP session shared by cloud destinations
+def upload_session(pool_size=8):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Base class: subclasses set kind and implement upload()
+class Destination:
+    kind = None
+
+    def __init__(self, name=None):
+        self.name = name or self.kind
+
+    # Copy file_path to the destination and return where it ended up,
+    # stopping with an error once deadline (a time.monotonic() value) passes
+    def upload(self, file_path, deadline=None):
+        raise NotImplementedError
+
+# A directory, e.g. a second disk or a mounted NAS share
+class LocalDestination(Destination):
+    kind = 'local'
+
+    def __init__(self, path, name=None):
+        super().__init__(name)
+        self.path = path
+
+    def upload(self, file_path, deadline=None):
+        os.makedirs(self.path, exist_ok=True)
+        target = os.path.join(self.path, os.path.basename(file_path))
+
+        # Copy under a temporary name so a half-copied file is never mistaken for a backup
+        tmp_path = target + '.part'
+        try:
+            with open(file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    check_deadline(deadline)
+                    block = src.read(COPY_CHUNK_SIZE)
+                    if not block:
+                        break
+                    dst.write(block)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        shutil.copystat(file_path, tmp_path)
+        os.replace(tmp_path, target)
+        return target
+
+# A directory on a server reachable over SFTP
+class SFTPDestination(Destination):
+    kind = 'sftp'
+
+    def __init__(self, host, username, remote_dir='.', port=22, password=None, key_filename=None, name=None):
+        super().__init__(name or f'sftp:{host}')
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.key_filename = key_filename
+        self.remote_dir = remote_dir
+
+    def upload(self, file_path, deadline=None):
+        if paramiko is None:
+            raise RuntimeError("SFTP uploads need the paramiko package")
+
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        try:
+            client.connect(self.host, port=self.port, username=self.username, password=self.password,
+                           key_filename=self.key_filename)
+            sftp = client.open_sftp()
+            target = f'{self.remote_dir.rstrip("/")}/{os.path.basename(file_path)}'
+            # paramiko calls back after every block; raising there aborts the transfer
+            sftp.put(file_path, target + '.part', callback=lambda sent, total: check_deadline(deadline))
+            sftp.posix_rename(target + '.part', target)
+            return f'{self.host}:{target}'
+        finally:
+            client.close()
+
+# A bucket on S3 or any S3-compatible server
+class S3Destination(Destination):
+    kind = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, name=None, **client_options):
+        super().__init__(name or f's3:{bucket}')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.client_options = client_options
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if boto3 is None:
+            raise RuntimeError("S3 uploads need the boto3 package")
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client('s3', endpoint_url=self.endpoint_url, **self.client_options)
+            return self._client
+
+    def upload(self, file_path, deadline=None):
+        key = self.prefix + os.path.basename(file_path)
+        # upload_file does multipart uploads and retries on its own; raising
+        # from its progress callback aborts it
+        self.client().upload_file(file_path, self.bucket, key, Callback=lambda sent: check_deadline(deadline))
+        return f's3://{self.bucket}/{key}'
+
+# A folder in OneDrive, uploaded in resumable chunks
+class OneDriveDestination(Destination):
+    kind = 'onedrive'
+
+    def __init__(self, client_id=None, authority=ONEDRIVE_AUTHORITY, scopes=ONEDRIVE_SCOPES,
+                 username=None, cache_file=ONEDRIVE_CACHE_FILE, remote_dir='backups', access_token=None,
+                 graph_url=GRAPH_URL, session=None, name=None):
+        super().__init__(name)
+        self.client_id = client_id
+        self.authority = authority
+        self.scopes = scopes
+        self.username = username
+        self.cache_file = cache_file
+        self.remote_dir = remote_dir
+        self.access_token = access_token
+        self.graph_url = graph_url
+        self.session = session
+
+    def upload(self, file_path, deadline=None):
+        token = self.access_token or onedrive_token(self.client_id, self.authority, self.scopes,
+                                                    username=self.username, cache_file=self.cache_file)
+        remote_path = f'{self.remote_dir.strip("/")}/{os.path.basename(file_path)}'
+        item = upload_onedrive(file_path, token, remote_path, session=self.session, graph_url=self.graph_url,
+                               deadline=deadline)
+        return f"OneDrive:{self.remote_dir}/{item['name']}"
+
+# A folder in Google Drive, uploaded in resumable chunks
+class GoogleDriveDestination(Destination):
+    kind = 'google_drive'
+
+    def __init__(self, settings_file='settings.yaml', credentials_file=GOOGLE_DRIVE_CREDENTIALS_FILE, folder_id=None,
+                 access_token=None, upload_url=DRIVE_UPLOAD_URL, session=None, name=None):
+        super().__init__(name)
+        self.settings_file = settings_file
+        self.credentials_file = credentials_file
+        self.folder_id = folder_id
+        self.access_token = access_token
+        self.upload_url = upload_url
+        self.session = session
+
+    def upload(self, file_path, deadline=None):
+        token = self.access_token or google_drive_token(self.settings_file, self.credentials_file)
+        item = upload_google_drive(file_path, token, folder_id=self.folder_id, session=self.session,
+                                   upload_url=self.upload_url, deadline=deadline)
+        return f"Google Drive:{item['name']} ({item['id']})"
+
+DESTINATION_TYPES = {
+    destination.kind: destination
+    for destination in (LocalDestination, SFTPDestination, S3Destination, OneDriveDestination, GoogleDriveDestination)
+}
+
+# Destinations that talk HTTP through the shared session
+HTTP_DESTINATIONS = (OneDriveDestination, GoogleDriveDestination)
+
+# Function to build destinations from their config dicts
+def build_destinations(configs, session=None):
+    destinations = []
+    for config in configs:
+        options = dict(config)
+        kind = options.pop('type', None)
+        if kind not in DESTINATION_TYPES:
+            raise ValueError(f"Unknown destination type: {kind}")
+
+        cls = DESTINATION_TYPES[kind]
+        if cls in HTTP_DESTINATIONS and session is not None:
+            options.setdefault('session', session)
+        destinations.append(cls(**options))
+    return destinations
+
+# Function to upload to one destination, returning its result instead of raising
+def _timed_upload(destination, file_path, deadline=None):
+    started = time.perf_counter()
+    try:
+        location = destination.upload(file_path, deadline)
+        return {'name': destination.name, 'ok': True, 'location': location,
+                'seconds': time.perf_counter() - started}
+    except Exception as e:
+        return {'name': destination.name, 'ok': False, 'error': str(e),
+                'seconds': time.perf_counter() - started}
+
+# Function to send file_path to every destination at once. Returns one result
+# per destination, in order. Uploads are told to stop after timeout seconds,
+# and any that has not returned by then is reported as timed out; its daemon
+# thread does not keep the process alive.
+def upload_to_destinations(file_path, destinations, timeout=UPLOAD_TIMEOUT):
+    if not destinations:
+        return []
+
+    deadline = time.monotonic() + timeout
+    slots = [None] * len(destinations)
+
+    def run(index, destination):
+        slots[index] = _timed_upload(destination, file_path, deadline)
+
+    threads = [threading.Thread(target=run, args=(index, destination), name=f'upload-{destination.name}', daemon=True)
+               for index, destination in enumerate(destinations)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+
+    results = []
+    for destination, result in zip(destinations, slots):
+        if result is None:
+            result = {'name': destination.name, 'ok': False, 'seconds': timeout,
+                      'error': f"timed out after {timeout}s"}
+        results.append(result)
+
+    for result in results:
+        metrics.observe('destination_upload_seconds', result['seconds'], help='Upload time per destination',
+                        destination=result['name'], result='ok' if result['ok'] else 'failed')
+        log_event('upload', level=logging.INFO if result['ok'] else logging.ERROR, file=os.path.basename(file_path),
+                  **result)
+    return results
+
+# Function to print one line per destination
+def print_upload_results(results):
+    for result in results:
+        if result['ok']:
+            print(f"Uploaded to {result['name']} in {result['seconds']:.1f}s: {result['location']}")
+        else:
+            print(f"Failed to upload to {result['name']} after {result['seconds']:.1f}s: {result['error']}")
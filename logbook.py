@@ -0,0 +1,536 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Parsed logbook snapshots for Local Logger.
+#
+# A backup file is parsed once and kept in memory for as long as its
+# (path, mtime, size) stays the same. A new nightly backup is parsed in full
+# before it replaces the old snapshot, so requests never see a half-built one.
+#
+# The snapshot is stored by column rather than as one dict per QSO: fields
+# with few distinct values (band, mode, state, dxcc, ...) as small integer
+# codes into a table of interned strings, numbers such as dates, times and
+# frequencies as 64-bit integers, and free text (call, name, grid) as one
+# UTF-8 buffer with offsets. That takes a fraction of the memory of the
+# dicts, and sorting and searching work on whole columns at once. Rows are
+# read through lightweight QSO views that behave like read-only dicts, and
+# searches go through the index in logindex.py.
+
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from itertools import chain, compress
+
+from adif import QSO_FIELDS, iter_adif_file
+from backup_files import open_backup
+from logindex import LogIndex
+from metrics import log_event, metrics
+
+# Fields with few distinct values, stored as codes into a table of values
+CATEGORY_FIELDS = (
+    'dxcc', 'state', 'my_gridsquare', 'cqz', 'ituz', 'band', 'mode',
+    'eqsl_qsl_rcvd', 'lotw_qsl_rcvd', 'qsl_rcvd', 'sat_name',
+)
+
+# Fields holding plain decimal numbers, stored as integers
+NUMBER_FIELDS = ('freq', 'freq_rx', 'qso_date', 'time_on', 'app_qrzlog_logid')
+
+# Decimal numbers that fit a NumberColumn code exactly (at most 15 digits)
+NUMBER_RE = re.compile(r'(\d{1,15})(?:\.(\d{1,7}))?')
+
+# Codes of a NumberColumn for a missing value and for one kept as text
+MISSING = -1
+IRREGULAR = -2
+
+# Bands from the longest wavelength to the shortest, as named by ADIF
+BAND_ORDER = (
+    '2190m', '630m', '560m', '160m', '80m', '60m', '40m', '30m', '20m', '17m', '15m',
+    '12m', '10m', '8m', '6m', '5m', '4m', '2m', '1.25m', '70cm', '33cm', '23cm', '13cm',
+    '9cm', '6cm', '3cm', '1.25cm', '6mm', '4mm', '2.5mm', '2mm', '1mm', 'submm',
+)
+BAND_RANKS = {band: rank for rank, band in enumerate(BAND_ORDER)}
+
+# Fields the logbook can be sorted on, as on the logbook page. Anything else
+# lists QSOs in log order, here and in LogStore.
+SORT_FIELDS = ('call', 'freq', 'band', 'mode', 'qso_date', 'time_on')
+
+# Function to sort numbers by value; text that is not a number sorts as missing
+def number_key(value):
+    try:
+        key = float(value)
+    except ValueError:
+        return None
+    return None if key != key else key
+
+# Function to sort bands by wavelength, unknown bands after the known ones
+def band_key(value):
+    band = value.lower()
+    return (BAND_RANKS.get(band, len(BAND_ORDER)), band)
+
+# Function to turn an ADIF date (YYYYMMDD) into a number
+def date_key(value):
+    return int(value) if len(value) == 8 and value.isdigit() else None
+
+# Function to turn an ADIF time (HHMM or HHMMSS) into an HHMMSS number
+def time_key(value):
+    if not value.isdigit():
+        return None
+    if len(value) == 4:
+        return int(value) * 100
+    return int(value) if len(value) == 6 else None
+
+# Function to sort text without regard to case
+def text_key(value):
+    return value.casefold()
+
+# Function to combine date and time keys into one, ordering by date and then
+# by time within the day (None if there is no date)
+def date_time_key(date, time):
+    return None if date is None else date * 1000000 + (time or 0)
+
+# How the values of each field compare when sorting (text_key for the rest).
+# qso_date sorts on date and time together.
+SORT_KEYS = {
+    'freq': number_key, 'freq_rx': number_key, 'app_qrzlog_logid': number_key,
+    'dxcc': number_key, 'cqz': number_key, 'ituz': number_key,
+    'band': band_key, 'qso_date': date_key, 'time_on': time_key,
+}
+
+# Function to work out the sort key of one QSO (a dict) for a field, the same
+# key Logbook.sort_keys gives its row (None if the value is missing)
+def qso_sort_key(qso, field):
+    value = qso.get(field)
+    key = SORT_KEYS.get(field, text_key)(value) if value else None
+    if field == 'qso_date':
+        time = qso.get('time_on')
+        key = date_time_key(key, time_key(time) if time else None)
+    return key
+
+# Column of strings with few distinct values
+class CategoryColumn:
+    def __init__(self):
+        self.values = [None]
+        self.codes = array('H')
+        self._code_of = {None: 0}
+
+    def append(self, value):
+        code = self._code_of.get(value)
+        if code is None:
+            code = self._code_of[value] = len(self.values)
+            self.values.append(value)
+            if code > 0xFFFF and self.codes.typecode == 'H':
+                self.codes = array('I', self.codes)
+        self.codes.append(code)
+
+    def finish(self):
+        del self._code_of
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    # Per-row sort keys from value_key, worked out once per distinct value.
+    # Missing and empty values get None.
+    def sort_keys(self, value_key):
+        keys = [value_key(value) if value else None for value in self.values]
+        return list(map(keys.__getitem__, self.codes))
+
+# Column of free text held in one UTF-8 buffer
+class TextColumn:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+        self.nulls = bytearray()
+
+    def append(self, value):
+        if value is None:
+            self.nulls.append(1)
+        else:
+            self.nulls.append(0)
+            self.data += value.encode('utf-8')
+        self.offsets.append(len(self.data))
+
+    def finish(self):
+        self.data = bytes(self.data)
+
+    def __getitem__(self, row):
+        if self.nulls[row]:
+            return None
+        return self.data[self.offsets[row]:self.offsets[row + 1]].decode('utf-8')
+
+    # Per-row sort keys from value_key; missing and empty values get None
+    def sort_keys(self, value_key):
+        return [value_key(value) if value else None for value in map(self.__getitem__, range(len(self.nulls)))]
+
+# Column of decimal numbers. Each value is stored as
+# (digits << 8) | (integer digits << 3) | decimals, so it round-trips to the
+# exact text (leading zeros, trailing zeros) it was read from.
+class NumberColumn:
+    def __init__(self):
+        self.codes = array('q')
+        self.irregular = {}
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(MISSING)
+            return
+
+        match = NUMBER_RE.fullmatch(value)
+        whole, fraction = match.groups('') if match else ('', '')
+        if not match or len(whole) + len(fraction) > 15:
+            # Not a plain number, keep the text as it is
+            self.irregular[len(self.codes)] = value
+            self.codes.append(IRREGULAR)
+            return
+        self.codes.append(int(whole + fraction) << 8 | len(whole) << 3 | len(fraction))
+
+    def finish(self):
+        pass
+
+    def __getitem__(self, row):
+        code = self.codes[row]
+        if code < 0:
+            return self.irregular.get(row)
+
+        decimals = code & 7
+        digits = f'{code >> 8:0{(code >> 3 & 31) + decimals}d}'
+        return f'{digits[:-decimals]}.{digits[-decimals:]}' if decimals else digits
+
+    # Function to encode a value the way append would, or None if it is not a plain number
+    @staticmethod
+    def encode(value):
+        match = NUMBER_RE.fullmatch(value)
+        if not match:
+            return None
+        whole, fraction = match.groups('')
+        return int(whole + fraction) << 8 | len(whole) << 3 | len(fraction)
+
+    # Per-row sort keys from value_key; missing and empty values get None
+    def sort_keys(self, value_key):
+        return [value_key(value) if value else None for value in map(self.__getitem__, range(len(self.codes)))]
+
+# Column class for each field Local Logger shows
+def column_for(field):
+    if field in CATEGORY_FIELDS:
+        return CategoryColumn()
+    if field in NUMBER_FIELDS:
+        return NumberColumn()
+    return TextColumn()
+
+# Read-only view of one QSO in a Logbook, used like a dict
+class QSO(Mapping):
+    __slots__ = ('_columns', '_row')
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    def __getitem__(self, field):
+        return self._columns[field][self._row]
+
+    def __iter__(self):
+        return iter(QSO_FIELDS)
+
+    def __len__(self):
+        return len(QSO_FIELDS)
+
+    def __repr__(self):
+        return f'QSO({dict(self)!r})'
+
+# Sequence of QSO views over some rows of a Logbook
+class Rows(Sequence):
+    __slots__ = ('_columns', '_rows')
+
+    def __init__(self, columns, rows):
+        self._columns = columns
+        self._rows = rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Rows(self._columns, self._rows[index])
+        return QSO(self._columns, self._rows[index])
+
+    def __len__(self):
+        return len(self._rows)
+
+# Rows in a cached sort order, read forwards or (for descending order)
+# backwards, always keeping the rows without a value at the end. Indexing and
+# slicing do not copy the order, so a page costs only its own length.
+class SortedRows(Sequence):
+    __slots__ = ('_rows', '_filled', '_descending')
+
+    def __init__(self, rows, filled, descending=False):
+        self._rows = rows
+        self._filled = filled
+        self._descending = descending
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._rows)))]
+        if index < 0:
+            index += len(self._rows)
+        if self._descending and 0 <= index < self._filled:
+            index = self._filled - 1 - index
+        return self._rows[index]
+
+    def __iter__(self):
+        if not self._descending:
+            return iter(self._rows)
+        filled = self._filled
+        return chain(reversed(self._rows[:filled]), self._rows[filled:])
+
+# A parsed backup file. Treat it as read-only once built.
+class Logbook:
+    def __init__(self, path, key, records=()):
+        self.path = path
+        self.key = key
+        self.columns = {field: column_for(field) for field in QSO_FIELDS}
+
+        count = 0
+        appends = [(field, column.append) for field, column in self.columns.items()]
+        for record in records:
+            # Ensure the call field is present and non-empty
+            if not record.get('call'):
+                continue
+            for field, append in appends:
+                append(record.get(field))
+            count += 1
+
+        self.count = count
+        for column in self.columns.values():
+            column.finish()
+
+        # Rows ordered by log ID code, for lookups
+        log_ids = self.columns['app_qrzlog_logid'].codes
+        self._logid_rows = array('I', sorted((row for row in range(count) if log_ids[row] >= 0),
+                                             key=log_ids.__getitem__))
+
+        # Sort orders (and each row's place in them) worked out so far, see sort_order
+        self._sort_orders = {}
+        self._sort_ranks = {}
+        self._sort_lock = threading.Lock()
+
+        # Search index over calls, grids, names, bands, modes and so on
+        self.index = LogIndex(self)
+
+    def __len__(self):
+        return self.count
+
+    # All QSOs, in log order
+    @property
+    def entries(self):
+        return Rows(self.columns, range(self.count))
+
+    # Look up one QSO by its APP_QRZLOG_LOGID
+    def find(self, log_id):
+        column = self.columns['app_qrzlog_logid']
+        code = NumberColumn.encode(log_id)
+        if code is None:
+            rows = [row for row, value in column.irregular.items() if value == log_id]
+            return QSO(self.columns, rows[0]) if rows else None
+
+        codes = column.codes
+        index = bisect_left(self._logid_rows, code, key=codes.__getitem__)
+        if index < len(self._logid_rows) and codes[self._logid_rows[index]] == code:
+            return QSO(self.columns, self._logid_rows[index])
+        return None
+
+    # All QSOs with a callsign, in log order
+    def find_call(self, call):
+        return Rows(self.columns, self.index.rows_for('call', call))
+
+    # Function to work out typed, null-safe sort keys for a field
+    def sort_keys(self, field):
+        keys = self.columns[field].sort_keys(SORT_KEYS.get(field, text_key))
+        if field == 'qso_date':
+            # Order by date, then by time within the day
+            times = self.columns['time_on'].sort_keys(time_key)
+            keys = list(map(date_time_key, keys, times))
+        return keys
+
+    # Function to get the rows in ascending order of a field, with the rows
+    # missing a value at the end, and the number of rows that have one.
+    # Worked out the first time a field is sorted on and then reused.
+    def sort_order(self, field):
+        order = self._sort_orders.get(field)
+        if order is not None:
+            return order
+
+        with self._sort_lock:
+            order = self._sort_orders.get(field)
+            if order is None:
+                keys = self.sort_keys(field)
+                rows = [row for row, key in enumerate(keys) if key is not None]
+                rows.sort(key=keys.__getitem__)
+                filled = len(rows)
+                rows.extend(row for row, key in enumerate(keys) if key is None)
+                order = self._sort_orders[field] = (array('I', rows), filled)
+            return order
+
+    # Function to get each row's position in the sort order of a field
+    def sort_ranks(self, field):
+        ranks = self._sort_ranks.get(field)
+        if ranks is None:
+            rows, _ = self.sort_order(field)
+            ranks = array('I', bytes(4 * len(rows)))
+            for position, row in enumerate(rows):
+                ranks[row] = position
+            self._sort_ranks[field] = ranks
+        return ranks
+
+    # Function to list the rows in the order of one of SORT_FIELDS (log order
+    # for anything else). Rows without a value come last either way, and rows
+    # with equal values are listed in reverse log order when descending.
+    def sorted_rows(self, sort_by, descending=False):
+        if sort_by not in SORT_FIELDS:
+            return range(self.count)
+        rows, filled = self.sort_order(sort_by)
+        return SortedRows(rows, filled, descending)
+
+    # Function to put some rows (sorted by row number) into the order of one
+    # field. A few rows are sorted by their place in the cached order; many
+    # are picked out of the cached order with a mask.
+    def order_rows(self, rows, sort_by, descending=False):
+        if sort_by not in SORT_FIELDS:
+            return rows
+
+        if len(rows) * 8 > self.count:
+            mask = bytearray(self.count)
+            for row in rows:
+                mask[row] = 1
+            ordered = self.sorted_rows(sort_by, descending)
+            return list(compress(ordered, map(mask.__getitem__, ordered)))
+
+        _, filled = self.sort_order(sort_by)
+        ranks = self.sort_ranks(sort_by)
+        rows = sorted(rows, key=ranks.__getitem__)
+        if descending:
+            # Reverse the rows with a value, keep the ones without at the end
+            split = bisect_left(rows, filled, key=ranks.__getitem__)
+            rows = rows[:split][::-1] + rows[split:]
+        return rows
+
+    # Function to get a key giving each row's place in the order rows are
+    # listed for sort_by, for finding where a keyset page starts
+    def position_key(self, sort_by, descending=False):
+        if sort_by not in SORT_FIELDS:
+            return None
+        _, filled = self.sort_order(sort_by)
+        ranks = self.sort_ranks(sort_by)
+        if not descending:
+            return ranks.__getitem__
+        return lambda row: filled - 1 - ranks[row] if ranks[row] < filled else ranks[row]
+
+    # Return (entries, total) for one page of the logbook, like LogStore.search.
+    # With after (an APP_QRZLOG_LOGID) the page starts just after that QSO
+    # instead of at page, so paging is not thrown off by QSOs added since;
+    # KeyError if that QSO is not in the logbook.
+    def search(self, query='', sort_by='call', order='asc', page=1, per_page=10, after=None):
+        rows = self.sorted_rows(sort_by, order == 'desc')
+
+        hits = self.index.search(query)
+        if hits is not None:
+            rows = self.order_rows(hits, sort_by, order == 'desc')
+
+        if after is None:
+            start = (max(page, 1) - 1) * per_page
+        else:
+            anchor = self.find(after)
+            if anchor is None:
+                raise KeyError(after)
+            position = self.position_key(sort_by, order == 'desc')
+            if position is None:
+                start = bisect_right(rows, anchor._row)
+            else:
+                start = bisect_right(rows, position(anchor._row), key=position)
+
+        return Rows(self.columns, rows[start:start + per_page]), len(rows)
+
+# Function to build the cache key for a backup file
+def backup_key(path):
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+# Function to read and parse a backup file into a Logbook, streaming the
+# records straight into the columns
+def load_logbook(path, key=None):
+    if key is None:
+        key = backup_key(path)
+
+    with open_backup(path) as f:
+        return Logbook(path, key, iter_adif_file(f))
+
+# Process-wide cache holding the logbooks of the last `size` backups viewed
+# (just the latest by default)
+class LogbookCache:
+    def __init__(self, loader=load_logbook, size=1):
+        self._loader = loader
+        self._size = size
+        self._lock = threading.Lock()
+        self._logbooks = OrderedDict()
+
+    # Return the parsed logbook for path, parsing it only if it changed. key
+    # is the file's backup_key when the caller already knows it.
+    def get(self, path, key=None):
+        if key is None:
+            key = backup_key(path)
+        current = self._logbooks.get(path)
+        if current is not None and current.key == key:
+            metrics.inc('logbook_cache_requests_total', help='Parsed logbook lookups', result='hit')
+            return current
+
+        with self._lock:
+            # Another request may have loaded it while we waited
+            current = self._logbooks.get(path)
+            if current is None or current.key != key:
+                # Parse in full before replacing the old copy, which stays in
+                # place if the new file cannot be read
+                metrics.inc('logbook_cache_requests_total', help='Parsed logbook lookups', result='miss')
+                with metrics.timer('logbook_load_seconds', help='Time to parse and index a backup'):
+                    current = self._loader(path, key)
+                log_event('logbook_loaded', backup=os.path.basename(path), qsos=len(current))
+            else:
+                metrics.inc('logbook_cache_requests_total', help='Parsed logbook lookups', result='hit')
+            self._logbooks[path] = current
+            self._logbooks.move_to_end(path)
+            while len(self._logbooks) > self._size:
+                self._logbooks.popitem(last=False)
+            return current
+
+    # Drop the cached logbooks so the next request parses again
+    def clear(self):
+        with self._lock:
+            self._logbooks.clear()
@@ -0,0 +1,258 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Search index for Local Logger's in-memory logbook.
+#
+# The index is built once when a backup is loaded. A search is a list of
+# words that must all match; a word can name the field it applies to:
+#
+#   call:W1AW  call:W1*  grid:EN52*  state:CA  mode:FT8  band:20m  dxcc:291
+#   name:sean  sat:AO-91  freq:14.074  freq:14..14.35
+#   date:2023  date:2023-06  date:2023-01-01..2023-06-30  date:20240101..
+#
+# A word without a field matches the start of a callsign, grid square, name,
+# band, mode, state or satellite, or a date or frequency it is the start of.
+# Quote values with spaces: name:"sean o". Each word turns into a posting
+# list (sorted row numbers) and the lists are intersected smallest first.
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from fnmatch import fnmatchcase
+from itertools import chain
+
+# Query field names and the logbook field each one searches
+FIELD_ALIASES = {
+    'call': 'call', 'grid': 'gridsquare', 'gridsquare': 'gridsquare', 'name': 'name',
+    'state': 'state', 'mode': 'mode', 'band': 'band', 'dxcc': 'dxcc', 'sat': 'sat_name',
+    'sat_name': 'sat_name', 'date': 'qso_date', 'qso_date': 'qso_date', 'freq': 'freq',
+}
+
+# Fields looked up by prefix in a sorted list of rows
+PREFIX_FIELDS = ('call', 'gridsquare')
+
+# Fields with few distinct values, indexed by value
+VALUE_FIELDS = ('state', 'mode', 'band', 'dxcc', 'sat_name')
+
+# One query word: optional field, then a quoted or plain value
+QUERY_WORD_RE = re.compile(r'(?:([A-Za-z_]+):)?("[^"]*"|\S+)')
+
+# Splits names into words
+NAME_WORD_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+
+# Function to split a query into (field, value) pairs; field is None for
+# words that do not name one (or name a field that is not searchable)
+def parse_query(query):
+    terms = []
+    for match in QUERY_WORD_RE.finditer(query):
+        name, value = match.groups()
+        field = FIELD_ALIASES.get(name.lower()) if name else None
+        if name and field is None:
+            value = f'{name}:{value}'
+        value = value.strip('"')
+        if value:
+            terms.append((field, value))
+    return terms
+
+# Function to turn a date or partial date into YYYYMMDD bounds ('2023-05' -> 20230500..20230599)
+def date_bounds(value):
+    low, sep, high = value.partition('..')
+    if not sep:
+        high = low
+    low = low.replace('-', '')
+    high = high.replace('-', '')
+    for bound in (low, high):
+        if bound and not (bound.isdigit() and len(bound) <= 8):
+            return None
+    return (int(low.ljust(8, '0')) if low else 0,
+            int(high.ljust(8, '9')) if high else 99999999)
+
+# Function to turn a number or range into [low, high) bounds ('14.07' -> 14.07..14.08)
+def number_bounds(value):
+    low, sep, high = value.partition('..')
+    try:
+        if sep:
+            return (float(low) if low else float('-inf'),
+                    float(high) if high else float('inf'), True)
+        decimals = len(low.partition('.')[2])
+        return float(low), float(low) + 10 ** -decimals, False
+    except ValueError:
+        return None
+
+# Function to intersect sorted posting lists, smallest first
+def intersect(postings):
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for posting in postings[1:]:
+        if not result:
+            break
+        size = len(posting)
+        result = [row for row in result
+                  if (index := bisect_left(posting, row)) < size and posting[index] == row]
+    return result
+
+# Function to merge posting lists into one sorted list
+def union(postings):
+    postings = [posting for posting in postings if posting]
+    if len(postings) == 1:
+        return postings[0]
+    return sorted(set(chain.from_iterable(postings)))
+
+class LogIndex:
+    def __init__(self, logbook):
+        self.logbook = logbook
+        columns = logbook.columns
+        count = logbook.count
+
+        # Rows with a value, sorted by the upper-case value, for prefix lookups
+        self.sorted_rows = {}
+        for field in PREFIX_FIELDS:
+            keys = [value.upper() if value else None for value in map(columns[field].__getitem__, range(count))]
+            self.sorted_rows[field] = array('I', sorted((row for row in range(count) if keys[row] is not None),
+                                                        key=keys.__getitem__))
+
+        # Lower-case value -> rows, for the fields with few distinct values
+        self.values = {}
+        for field in VALUE_FIELDS:
+            column = columns[field]
+            buckets = [array('I') for _ in column.values]
+            for row, code in enumerate(column.codes):
+                buckets[code].append(row)
+
+            postings = {}
+            for value, rows in zip(column.values, buckets):
+                if value and rows:
+                    key = value.lower()
+                    postings[key] = union([postings[key], rows]) if key in postings else rows
+            self.values[field] = postings
+
+        # Lower-case name word -> rows, and the sorted words for prefix lookups
+        words = {}
+        for row, name in enumerate(map(columns['name'].__getitem__, range(count))):
+            if name:
+                for word in set(NAME_WORD_RE.findall(name.lower())):
+                    words.setdefault(word, array('I')).append(row)
+        self.words = words
+        self.word_list = sorted(words)
+
+    # Rows whose field starts with (or equals) value, via the sorted rows
+    def _prefix_rows(self, field, value, prefix):
+        column = self.logbook.columns[field]
+        rows = self.sorted_rows[field]
+        value = value.upper()
+        if prefix:
+            size = len(value)
+            key = lambda row: column[row].upper()[:size]
+        else:
+            key = lambda row: column[row].upper()
+        start = bisect_left(rows, value, key=key)
+        end = bisect_right(rows, value, lo=start, key=key)
+        return sorted(rows[start:end])
+
+    # Rows for one field:value word, as a sorted list
+    def rows_for(self, field, value):
+        columns = self.logbook.columns
+        pattern = value.lower()
+        wildcard = any(char in pattern for char in '*?[')
+        prefix = wildcard and pattern.endswith('*') and not any(char in pattern[:-1] for char in '*?[')
+        if prefix:
+            pattern = pattern[:-1]
+
+        if field in PREFIX_FIELDS:
+            if wildcard and not prefix:
+                column = columns[field]
+                return sorted(row for row in self.sorted_rows[field] if fnmatchcase(column[row].lower(), pattern))
+            return self._prefix_rows(field, pattern, prefix)
+
+        if field in VALUE_FIELDS:
+            postings = self.values[field]
+            if not wildcard:
+                return postings.get(pattern, [])
+            if prefix:
+                return union([rows for value, rows in postings.items() if value.startswith(pattern)])
+            return union([rows for value, rows in postings.items() if fnmatchcase(value, pattern)])
+
+        if field == 'name':
+            words = NAME_WORD_RE.findall(pattern)
+            if not words:
+                return []
+            postings = [self.words.get(word, []) for word in words[:-1]]
+            last = words[-1]
+            if prefix:
+                # name:"sean o*" matches any word starting with the last one
+                start = bisect_left(self.word_list, last)
+                end = bisect_left(self.word_list, last + '\U0010ffff', lo=start)
+                postings.append(union([self.words[word] for word in self.word_list[start:end]]))
+            else:
+                postings.append(self.words.get(last, []))
+            return intersect(postings)
+
+        if field == 'qso_date':
+            bounds = date_bounds(pattern)
+            return self._range_rows(field, bounds[0], bounds[1], True, int) if bounds else []
+
+        if field == 'freq':
+            bounds = number_bounds(pattern)
+            return self._range_rows(field, *bounds, float) if bounds else []
+
+        return []
+
+    # Rows whose value lies between low and high (inclusive or not), using the
+    # cached sort order of the field; rows with a sort key always convert
+    def _range_rows(self, field, low, high, inclusive, convert):
+        column = self.logbook.columns[field]
+        rows, filled = self.logbook.sort_order(field)
+        key = lambda row: convert(column[row])
+        start = bisect_left(rows, low, hi=filled, key=key)
+        end = (bisect_right if inclusive else bisect_left)(rows, high, lo=start, hi=filled, key=key)
+        return sorted(rows[start:end])
+
+    # Rows for a word that does not name a field: the start of any indexed field
+    def rows_for_text(self, value):
+        word = value.rstrip('*')
+        if not word:
+            return []
+        postings = [self.rows_for(field, word + '*') for field in PREFIX_FIELDS + VALUE_FIELDS]
+        postings.append(self.rows_for('name', word + '*'))
+        digits = word.replace('-', '')
+        if digits.isdigit() and len(digits) >= 4:
+            postings.append(self.rows_for('qso_date', word))
+        if word.replace('.', '', 1).isdigit() and '.' in word:
+            postings.append(self.rows_for('freq', word))
+        return union(postings)
+
+    # Function to find the rows matching every word of a query, as a sorted
+    # list, or None when the query has no words
+    def search(self, query):
+        terms = parse_query(query)
+        if not terms:
+            return None
+        return intersect([self.rows_for(field, value) if field else self.rows_for_text(value)
+                          for field, value in terms])
@@ -0,0 +1,324 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Optional SQLite store for Local Logger.
+#
+# Each new backup is ingested once into an indexed table (plus an FTS5 index
+# for free-text search when SQLite has it), so sorting, searching and paging
+# run as a single query instead of over the whole log in Python.
+
+import json
+import sqlite3
+import threading
+from itertools import islice
+
+from adif import QSO_FIELDS, iter_adif_file
+from backup_files import open_backup
+from logbook import SORT_FIELDS, backup_key, qso_sort_key
+from logindex import PREFIX_FIELDS, VALUE_FIELDS, date_bounds, number_bounds, parse_query
+
+# QSOs inserted per executemany call while ingesting a backup
+INGEST_BATCH_SIZE = 5000
+
+# Bumped whenever the tables change; an older store is dropped and ingested again
+SCHEMA_VERSION = 4
+
+# Columns holding each sortable field's sort key, worked out in Python at
+# ingest with the same functions as Logbook so both sort exactly alike. A band
+# key is a (wavelength rank, name) pair and takes two columns.
+SORT_COLUMNS = {field: (f'{field}_key',) for field in SORT_FIELDS}
+SORT_COLUMNS['band'] = ('band_key', 'band_name_key')
+
+# Lower-case copies of the fields field:value words match on, so the match
+# compares an indexed column directly instead of wrapping it in lower()
+FILTER_COLUMNS = {field: f'{field}_lower' for field in PREFIX_FIELDS + VALUE_FIELDS}
+
+# ORDER BY terms for each sort: missing values last in either direction, then
+# the sort keys, then log order (reversed for the rows with a value when
+# descending). Every one has an index with exactly these terms, so a page is
+# read straight off the index instead of sorting the whole table.
+def sort_terms(sort_by, order):
+    if sort_by not in SORT_FIELDS:
+        return [('rowid', 'ASC')]
+    columns = SORT_COLUMNS[sort_by]
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    tie = f'(CASE WHEN {columns[0]} IS NULL THEN log_order ELSE -log_order END)' if order == 'desc' else 'log_order'
+    return [(f'({columns[0]} IS NULL)', 'ASC')] + [(column, direction) for column in columns] + [(tie, 'ASC')]
+
+# Indexes on the qsos table, name -> indexed terms. They are dropped while a
+# backup is ingested and built again afterwards, which is much quicker than
+# updating them row by row.
+INDEXES = {
+    'qsos_call': 'call',
+    'qsos_date_time': 'qso_date, time_on',
+    'qsos_logid': 'app_qrzlog_logid',
+}
+INDEXES.update((f'qsos_{column}', column) for column in FILTER_COLUMNS.values())
+INDEXES.update(
+    (f'qsos_{field}_{order}',
+     ', '.join(term if term_direction == 'ASC' else f'{term} DESC' for term, term_direction in sort_terms(field, order)))
+    for field in SORT_FIELDS for order in ('asc', 'desc')
+)
+
+# Columns covered by free-text search
+SEARCH_FIELDS = (
+    'call', 'name', 'state', 'gridsquare', 'my_gridsquare', 'freq', 'band',
+    'mode', 'qso_date', 'time_on', 'sat_name', 'dxcc',
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS qsos (
+    {', '.join(f'{field} TEXT' for field in QSO_FIELDS)},
+    {', '.join(column for columns in SORT_COLUMNS.values() for column in columns)},
+    {', '.join(FILTER_COLUMNS.values())},
+    log_order INTEGER
+);
+{''.join(f'CREATE INDEX IF NOT EXISTS {name} ON qsos ({terms});' for name, terms in INDEXES.items())}
+"""
+
+FTS_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS qsos_fts USING fts5(
+    {', '.join(SEARCH_FIELDS)}, content='qsos', content_rowid='rowid'
+);
+"""
+
+# Function to turn a search box query into an FTS5 prefix query
+def fts_query(query):
+    terms = query.split()
+    return ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+# Function to turn a search wildcard (* and ?) into a LIKE pattern
+def like_pattern(value):
+    value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return value.replace('*', '%').replace('?', '_')
+
+# Function to turn a search wildcard (* and ?) into a GLOB pattern; unlike
+# LIKE, GLOB can use the index on a lower-case column for a prefix
+def glob_pattern(value):
+    return value.replace('[', '[[]')
+
+# Function to turn a QSO into its row: the fields, the sort keys, then the
+# lower-case filter fields
+def qso_row(entry):
+    row = [entry.get(field) for field in QSO_FIELDS]
+    for field in SORT_FIELDS:
+        sort_key = qso_sort_key(entry, field)
+        if len(SORT_COLUMNS[field]) == 1:
+            row.append(sort_key)
+        else:
+            row += sort_key or (None,) * len(SORT_COLUMNS[field])
+    for field in FILTER_COLUMNS:
+        value = entry.get(field)
+        row.append(value.lower() if value is not None else None)
+    return row
+
+class LogStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            conn.executescript('DROP TABLE IF EXISTS qsos_fts; DROP TABLE IF EXISTS qsos; DROP TABLE IF EXISTS meta;')
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5, fall back to LIKE matching
+            self.has_fts = False
+        conn.commit()
+
+    # One connection per thread; WAL lets readers run during an ingest
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    # Identity of the backup currently loaded into the store
+    def source_key(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        return json.loads(row['value']) if row else None
+
+    # Make sure the store holds the given backup, ingesting it if needed
+    def sync(self, path):
+        key = list(backup_key(path))
+        if self.source_key() == key:
+            return False
+
+        with self._lock:
+            if self.source_key() == key:
+                return False
+
+            # Stream the records in rather than reading the whole file first
+            with open_backup(path) as f:
+                self.ingest(iter_adif_file(f), key)
+            return True
+
+    # Replace the stored QSOs with entries (any iterable, read as it goes) in
+    # one transaction, INGEST_BATCH_SIZE rows at a time
+    def ingest(self, entries, key):
+        conn = self._connect()
+        columns = list(QSO_FIELDS) + [column for field in SORT_FIELDS for column in SORT_COLUMNS[field]]
+        columns += list(FILTER_COLUMNS.values()) + ['log_order']
+        insert = f"INSERT INTO qsos ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        # QSOs without a call are left out, as in Logbook
+        rows = (qso_row(entry) + [log_order]
+                for log_order, entry in enumerate(entry for entry in entries if entry.get('call')))
+
+        with conn:
+            # DELETE first: it opens the transaction the index changes are part of
+            conn.execute('DELETE FROM qsos')
+            for name in INDEXES:
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+            while True:
+                batch = list(islice(rows, INGEST_BATCH_SIZE))
+                if not batch:
+                    break
+                conn.executemany(insert, batch)
+            for name, terms in INDEXES.items():
+                conn.execute(f'CREATE INDEX {name} ON qsos ({terms})')
+            if self.has_fts:
+                conn.execute("INSERT INTO qsos_fts (qsos_fts) VALUES ('rebuild')")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?)",
+                (json.dumps(key),),
+            )
+
+    # Build the condition and parameters for one field:value word of a query,
+    # close to what LogIndex.rows_for does for the in-memory logbook (names
+    # match anywhere rather than by word)
+    def _field_condition(self, field, value):
+        if field in FILTER_COLUMNS:
+            column = FILTER_COLUMNS[field]
+            if '*' in value or '?' in value:
+                return f'{column} GLOB ?', [glob_pattern(value.lower())]
+            return f'{column} = ?', [value.lower()]
+
+        if field == 'name':
+            # Matches anywhere in the name, which no index can help with
+            return f"lower(name) LIKE ? ESCAPE '\\'", [like_pattern(f'*{value.lower()}*')]
+
+        if field == 'qso_date':
+            bounds = date_bounds(value)
+            if bounds is None:
+                return '0', []
+            return 'qso_date BETWEEN ? AND ?', [f'{bounds[0]:08d}', f'{bounds[1]:08d}']
+
+        bounds = number_bounds(value)
+        if bounds is None:
+            return '0', []
+        low, high, inclusive = bounds
+        return f"freq_key >= ? AND freq_key {'<=' if inclusive else '<'} ?", [low, high]
+
+    # Build the WHERE clause and parameters for a search query
+    def _where(self, query):
+        conditions = []
+        params = []
+        words = []
+        for field, value in parse_query(query):
+            if field is None:
+                words.append(value)
+                continue
+            condition, condition_params = self._field_condition(field, value)
+            conditions.append(condition)
+            params += condition_params
+
+        if words and self.has_fts:
+            conditions.append('rowid IN (SELECT rowid FROM qsos_fts WHERE qsos_fts MATCH ?)')
+            params.append(fts_query(' '.join(words)))
+        elif words:
+            for word in words:
+                pattern = '%' + like_pattern(word) + '%'
+                conditions.append('(' + ' OR '.join(f"{field} LIKE ? ESCAPE '\\'" for field in SEARCH_FIELDS) + ')')
+                params += [pattern] * len(SEARCH_FIELDS)
+
+        if not conditions:
+            return '', []
+        return 'WHERE ' + ' AND '.join(f'({condition})' for condition in conditions), params
+
+    # Return (entries, total) for one page of the logbook, in the same order
+    # as Logbook.search. With after (an APP_QRZLOG_LOGID) the page starts just
+    # after that QSO instead of at page; KeyError if that QSO is not in the store.
+    def search(self, query='', sort_by='call', order='asc', page=1, per_page=10, after=None):
+        where, params = self._where(query.strip())
+
+        terms = sort_terms(sort_by, order)
+        order_by = ', '.join(f'{term} {term_direction}' for term, term_direction in terms)
+
+        conn = self._connect()
+        total = conn.execute(f'SELECT count(*) FROM qsos {where}', params).fetchone()[0]
+
+        if after is None:
+            offset = (max(page, 1) - 1) * per_page
+            keyset, keyset_params = '', []
+        else:
+            anchor = conn.execute(
+                f"SELECT {', '.join(term for term, _ in terms)} FROM qsos WHERE app_qrzlog_logid = ?", (after,),
+            ).fetchone()
+            if anchor is None:
+                raise KeyError(after)
+
+            # Rows after the anchor in ORDER BY order: equal on the leading
+            # terms and past it on the next one. IS compares NULLs as equal.
+            offset = 0
+            branches = []
+            keyset_params = []
+            for index, (term, term_direction) in enumerate(terms):
+                branch = [f'{previous} IS ?' for previous, _ in terms[:index]]
+                branch.append(f"{term} {'<' if term_direction == 'DESC' else '>'} ?")
+                branches.append('(' + ' AND '.join(branch) + ')')
+                keyset_params += list(anchor[:index + 1])
+            keyset = ('AND' if where else 'WHERE') + ' (' + ' OR '.join(branches) + ')'
+
+        rows = conn.execute(
+            f"SELECT {', '.join(QSO_FIELDS)} FROM qsos {where} {keyset} ORDER BY {order_by} LIMIT ? OFFSET ?",
+            params + keyset_params + [per_page, offset],
+        ).fetchall()
+        return [dict(row) for row in rows], total
+
+    # Look up one QSO by its APP_QRZLOG_LOGID
+    def find(self, log_id):
+        row = self._connect().execute(f"SELECT {', '.join(QSO_FIELDS)} FROM qsos WHERE app_qrzlog_logid = ?",
+                                      (log_id,)).fetchone()
+        return dict(row) if row else None
+
+    # All QSOs with a callsign, in log order
+    def find_call(self, call):
+        rows = self._connect().execute(f"SELECT {', '.join(QSO_FIELDS)} FROM qsos WHERE call = ? ORDER BY rowid",
+                                       (call,)).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,327 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Metrics and structured logging for the backup scripts and Local Logger.
+#
+# Counters, gauges and histograms are kept in process and rendered in the
+# Prometheus text format: Local Logger serves them at /metrics, and the backup
+# scripts can write them to a file for node_exporter's textfile collector.
+# Updating a metric is one dict lookup under a lock, cheap enough to leave on.
+#
+# Under gunicorn every worker keeps its own numbers, so serve.py has each
+# process share them (Metrics.share): a process writes its numbers to its own
+# file in a shared directory about once a second, and /metrics adds up the
+# files of every process. The files of workers that have exited are kept, so
+# the totals do not go back when gunicorn replaces its workers.
+#
+# Events are logged as one JSON object per line through the 'qrz' logger;
+# nothing is written until setup_json_logging() is called.
+
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Histogram buckets in seconds, from a cached page to a large download
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Seconds between writes of a shared process's metrics file, when they change
+SHARE_INTERVAL = 1.0
+
+# File each sharing process writes its metrics to, by process ID
+SHARE_FILENAME = 'metrics-{pid}.json'
+
+logger = logging.getLogger('qrz')
+logger.addHandler(logging.NullHandler())
+
+# Handlers added by setup_json_logging, by file
+_json_handlers = {}
+
+# Function to render a label set as {name="value",...}
+def format_labels(labels):
+    if not labels:
+        return ''
+    values = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, values)) + '}'
+
+# Function to render a number the way Prometheus expects
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Function to render metrics ({name: (type, help, buckets, {label tuple: value})})
+# in the Prometheus text format
+def render_metrics(metrics):
+    lines = []
+    for name, (kind, help_text, buckets, series) in sorted(metrics.items()):
+        if help_text:
+            lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series.items()):
+            if kind != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                continue
+            counts, count, total = value
+            cumulative = 0
+            for bound, bucket in zip(buckets, counts):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+# Function to add up the metrics files of every process sharing a directory:
+# counters and histograms are summed, gauges come from the newest file
+def read_shared_metrics(directory):
+    shared = []
+    for path in glob.glob(os.path.join(directory, SHARE_FILENAME.format(pid='*'))):
+        try:
+            with open(path, encoding='utf-8') as f:
+                shared.append(json.load(f))
+        except (OSError, ValueError):
+            # Gone or unreadable, skip it this time
+            continue
+
+    merged = {}
+    for data in sorted(shared, key=lambda data: data['time']):
+        for name, (kind, help_text, buckets, series) in data['metrics'].items():
+            metric = merged.get(name)
+            if metric is None:
+                metric = merged[name] = (kind, help_text, buckets, {})
+            totals = metric[3]
+            for labels, value in series:
+                key = tuple(map(tuple, labels))
+                if kind == 'counter':
+                    totals[key] = totals.get(key, 0) + value
+                elif kind == 'gauge':
+                    totals[key] = value
+                elif key in totals:
+                    counts, count, total = totals[key]
+                    totals[key] = [[a + b for a, b in zip(counts, value[0])], count + value[1], total + value[2]]
+                else:
+                    totals[key] = value
+    return merged
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help, buckets, {label tuple: value})
+        self._metrics = {}
+        # Directory this process shares its metrics through (see share) and
+        # whether they changed since they were last written there
+        self._share_dir = None
+        self._changed = False
+        self._write_lock = threading.Lock()
+
+    # Series of a metric for a label set, registering the metric on first use
+    def _series(self, kind, name, help_text, labels, buckets=None):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = (kind, help_text, buckets, {})
+        return metric[3], tuple(sorted(labels.items()))
+
+    # Add to a counter
+    def inc(self, name, value=1, help='', **labels):
+        with self._lock:
+            series, key = self._series('counter', name, help, labels)
+            series[key] = series.get(key, 0) + value
+            self._changed = True
+
+    # Set a gauge
+    def set(self, name, value, help='', **labels):
+        with self._lock:
+            series, key = self._series('gauge', name, help, labels)
+            series[key] = value
+            self._changed = True
+
+    # Record one observation in a histogram
+    def observe(self, name, value, help='', buckets=DEFAULT_BUCKETS, **labels):
+        with self._lock:
+            series, key = self._series('histogram', name, help, labels, buckets)
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = [[0] * len(buckets), 0, 0.0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+            self._changed = True
+
+    # Time a block into a histogram, or into a gauge with gauge=True
+    @contextmanager
+    def timer(self, name, help='', gauge=False, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if gauge:
+                self.set(name, elapsed, help, **labels)
+            else:
+                self.observe(name, elapsed, help, **labels)
+
+    # Current value of a counter or gauge (None if it was never set)
+    def value(self, name, **labels):
+        with self._lock:
+            metric = self._metrics.get(name)
+            return metric[3].get(tuple(sorted(labels.items()))) if metric else None
+
+    # Render every metric in the Prometheus text format, added up over every
+    # process when they are shared
+    def render(self):
+        if self._share_dir is not None:
+            self.flush()
+            return render_metrics(read_shared_metrics(self._share_dir))
+        with self._lock:
+            return render_metrics(self._metrics)
+
+    # Share this process's metrics with the others writing to directory, so
+    # render() adds them all up. Processes forked afterwards start from zero
+    # and write their own file; the numbers from before the fork stay in
+    # this process's file.
+    def share(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            first = self._share_dir is None
+            self._share_dir = directory
+            self._changed = True
+        if first:
+            _shared.add(self)
+            atexit.register(self.flush)
+        self._start_writer()
+
+    # Write this process's metrics to its shared file if they changed
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                if self._share_dir is None or not self._changed:
+                    return
+                data = json.dumps({'time': time.time(), 'metrics': {
+                    name: (kind, help_text, buckets, list(series.items()))
+                    for name, (kind, help_text, buckets, series) in self._metrics.items()
+                }})
+                path = os.path.join(self._share_dir, SHARE_FILENAME.format(pid=os.getpid()))
+                self._changed = False
+
+            tmp_path = path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                # Try again with the next change
+                self._changed = True
+
+    # Thread writing the shared file every SHARE_INTERVAL while it changes
+    def _start_writer(self):
+        def write():
+            while True:
+                time.sleep(SHARE_INTERVAL)
+                self.flush()
+
+        threading.Thread(target=write, name='metrics-writer', daemon=True).start()
+
+    # In a forked child: start again from zero with fresh locks (another
+    # thread may have held them at the fork) and a writer of its own
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._metrics = {}
+        self._changed = False
+        self._start_writer()
+
+    # Write the metrics for node_exporter's textfile collector, atomically so
+    # it never reads half a file
+    def write_textfile(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    # Forget every metric
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+            self._changed = True
+
+# Metrics instances sharing their numbers through a directory, see Metrics.share
+_shared = weakref.WeakSet()
+
+# Function to reset the shared metrics in a forked child, registered once for
+# the whole process
+def _after_fork_in_child():
+    for shared in list(_shared):
+        shared._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+# Metrics of this process
+metrics = Metrics()
+
+# Formats log records as one JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# Function to send the 'qrz' logger's events to a file (or stderr) as JSON
+# lines. Calling it again for the same file reuses the handler.
+def setup_json_logging(path=None, level=logging.INFO):
+    handler = _json_handlers.get(path)
+    if handler is None:
+        handler = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        _json_handlers[path] = handler
+    logger.setLevel(level)
+    return handler
+
+# Function to log one event with its fields; skipped cheaply when nobody listens
+def log_event(event, level=logging.INFO, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
@@ -0,0 +1,293 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Back up several QRZ logbooks at once, e.g. for a club station.
+#
+# Usage: python multi_backup.py accounts.json
+#
+# accounts.json looks like:
+#
+#   {
+#     "concurrency": 4,
+#     "host_delay": 0.25,
+#     "accounts": [
+#       {"name": "W1AW", "api_key": "XXXX-XXXX-XXXX-XXXX"},
+#       {"name": "K1ABC", "api_key": "YYYY-YYYY-YYYY-YYYY", "backup_dir": "/srv/qrz/k1abc",
+#        "retention": {"daily": 14, "weekly": 8, "monthly": 24},
+#        "compression": "gzip", "sync_mode": "incremental",
+#        "destinations": [{"type": "local", "path": "/mnt/nas/k1abc"}]}
+#     ]
+#   }
+#
+# Accounts run concurrently (up to "concurrency" at a time) over one pooled
+# keep-alive HTTP session. Requests to the same host are spaced at least
+# "host_delay" seconds apart so QRZ is not hammered, and every account gets
+# its own backup directory and retention (see retention.py; an older
+# "backup_count": N still keeps the newest N backups). Each finished backup
+# is then sent to the account's destinations (see destinations.py) in parallel.
+#
+# Unless an account sets "skip_unchanged": false, its QSO count and recent
+# changes are checked first and nothing is downloaded when the log is the
+# same as its last verified backup.
+#
+# Optional top-level "json_log" and "metrics_file" keys write every account's
+# events as JSON lines and the run's metrics in the Prometheus text format
+# (e.g. for node_exporter's textfile collector).
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from adif_diff import diff_files
+from backup_files import atomic_backup, compression_suffix, list_backups
+from backup_manifest import write_manifest
+from destinations import build_destinations, upload_session, upload_to_destinations
+from metrics import log_event, metrics, setup_json_logging
+from qrz_api import HEADERS, PAGE_SIZE, QRZ_API_URL, download_adif
+from qrz_sync import check_unchanged, record_backup, sync_logbook
+from retention import DEFAULT_RETENTION, apply_retention
+
+# Defaults for settings left out of the config file
+DEFAULT_CONCURRENCY = 4
+DEFAULT_HOST_DELAY = 0.25
+DEFAULT_BACKUP_ROOT = './qrz_backups'
+DEFAULT_ACCOUNT = {
+    'retention': DEFAULT_RETENTION,
+    'compression': None,
+    'sync_mode': 'full',
+    'page_size': PAGE_SIZE,
+    'diff': True,
+    'skip_unchanged': True,
+    'destinations': [],
+}
+ADIF_FILENAME = 'qrz_logbook_backup_{timestamp}.adif'
+
+# requests session that keeps a minimum gap between requests to the same host
+class PoliteSession(requests.Session):
+    def __init__(self, host_delay=DEFAULT_HOST_DELAY, pool_size=DEFAULT_CONCURRENCY):
+        super().__init__()
+        self.host_delay = host_delay
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    # Reserve the next free slot for the host and sleep until it comes round
+    def _wait_turn(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.host_delay
+        if slot > now:
+            time.sleep(slot - now)
+
+    def request(self, method, url, *args, **kwargs):
+        self._wait_turn(url)
+        return super().request(method, url, *args, **kwargs)
+
+# Function to read the config file and fill in defaults for every account
+def load_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    accounts = []
+    for account in config.get('accounts', []):
+        if not account.get('name') or not account.get('api_key'):
+            raise ValueError("Every account needs a name and an api_key")
+        if 'backup_count' in account and 'retention' not in account:
+            account['retention'] = {'last': account['backup_count']}
+        account = {**DEFAULT_ACCOUNT, **account}
+        account.setdefault('backup_dir', os.path.join(DEFAULT_BACKUP_ROOT, account['name']))
+        accounts.append(account)
+
+    config['accounts'] = accounts
+    return config
+
+# Function to thin out a backup directory to the retention tiers, returning
+# the deleted backups
+def prune_backups(backup_dir, retention):
+    _, removed = apply_retention(backup_dir, retention)
+    return sorted(removed)
+
+# Function to run the whole backup for one account (blocking, runs in a worker thread).
+# uploads is the HTTP session shared by the cloud destinations.
+def backup_account(account, session, api_url=QRZ_API_URL, uploads=None):
+    started = time.perf_counter()
+    backup_dir = account['backup_dir']
+    os.makedirs(backup_dir, exist_ok=True)
+
+    if account['skip_unchanged']:
+        check = check_unchanged(account['api_key'], backup_dir, session=session, api_url=api_url, headers=HEADERS)
+        if check:
+            return {'name': account['name'], 'file': os.path.join(backup_dir, check['backup']),
+                    'qso_count': check['qso_count'], 'verified': True, 'unchanged': True,
+                    'seconds': time.perf_counter() - started}
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    adif_file = os.path.join(backup_dir, ADIF_FILENAME.format(timestamp=timestamp)
+                             + compression_suffix(account['compression']))
+    previous = list_backups(backup_dir)
+
+    if account['sync_mode'] == 'incremental':
+        master_file, stats = sync_logbook(account['api_key'], backup_dir, page_size=account['page_size'],
+                                          session=session, api_url=api_url, headers=HEADERS)
+        with open(master_file, 'r', encoding='utf-8') as src, atomic_backup(adif_file) as dst:
+            shutil.copyfileobj(src, dst)
+        qso_count = stats['total']
+    else:
+        qso_count, _ = download_adif(account['api_key'], adif_file, page_size=account['page_size'],
+                                     session=session, api_url=api_url, headers=HEADERS)
+
+    manifest = write_manifest(adif_file, qso_count)
+    result = {'name': account['name'], 'file': adif_file, 'qso_count': qso_count,
+              'verified': manifest['verified']}
+    if account['skip_unchanged']:
+        kept = record_backup(backup_dir, adif_file, manifest)
+        if kept and kept != adif_file:
+            result.update(file=kept, unchanged=True, seconds=time.perf_counter() - started)
+            return result
+    if account['diff'] and previous:
+        diff = diff_files(max(previous, key=os.path.getmtime), adif_file)
+        result['changes'] = {kind: len(records) for kind, records in diff.items()}
+
+    result['deleted_backups'] = prune_backups(backup_dir, account['retention'])
+    if account['destinations']:
+        destinations = build_destinations(account['destinations'], session=uploads)
+        result['uploads'] = upload_to_destinations(adif_file, destinations)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+# Function to record one account's result as metrics and a log event
+def record_result(result):
+    account = result['name']
+    metrics.set('qrz_backup_success', int('error' not in result), help='1 if the last backup run succeeded',
+                account=account)
+    metrics.set('qrz_backup_last_run_timestamp_seconds', time.time(), help='When the backup last ran', account=account)
+    if 'error' in result:
+        log_event('backup_failed', level=logging.ERROR, account=account, error=result['error'])
+        return
+
+    metrics.set('qrz_backup_duration_seconds', result['seconds'], help='Length of the last backup run', account=account)
+    metrics.set('qrz_backup_qsos', result['qso_count'], help='QSOs in the latest backup', account=account)
+    metrics.set('qrz_backup_verified', int(result['verified']), help='1 if the latest backup was verified',
+                account=account)
+    metrics.set('qrz_backup_unchanged', int(bool(result.get('unchanged'))),
+                help='1 if the logbook had not changed and no new backup was saved', account=account)
+    for upload in result.get('uploads', []):
+        metrics.set('qrz_backup_upload_seconds', upload['seconds'], help='Upload time of the latest backup',
+                    account=account, destination=upload['name'])
+        metrics.set('qrz_backup_upload_success', int(upload['ok']), help='1 if the latest backup was uploaded',
+                    account=account, destination=upload['name'])
+    log_event('backup_unchanged' if result.get('unchanged') else 'backup_succeeded', account=account,
+              file=os.path.basename(result['file']), qsos=result['qso_count'], verified=result['verified'],
+              seconds=round(result['seconds'], 3), changes=result.get('changes'),
+              deleted=[os.path.basename(path) for path in result.get('deleted_backups', [])])
+
+# Function to back up every account concurrently, returning one result per account
+async def run_accounts(accounts, concurrency=DEFAULT_CONCURRENCY, host_delay=DEFAULT_HOST_DELAY,
+                       api_url=QRZ_API_URL):
+    session = PoliteSession(host_delay=host_delay, pool_size=concurrency)
+    uploads = upload_session(pool_size=concurrency * 2)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(account):
+        async with semaphore:
+            try:
+                result = await asyncio.to_thread(backup_account, account, session, api_url, uploads)
+            except Exception as e:
+                result = {'name': account['name'], 'error': str(e)}
+            record_result(result)
+            return result
+
+    try:
+        return await asyncio.gather(*(run_one(account) for account in accounts))
+    finally:
+        session.close()
+        uploads.close()
+
+# Function to print one line per account
+def print_results(results, elapsed):
+    for result in results:
+        if 'error' in result:
+            print(f"{result['name']}: Error: {result['error']}")
+            continue
+
+        line = f"{result['name']}: {result['qso_count']} QSOs in {result['seconds']:.1f}s -> {result['file']}"
+        if result.get('unchanged'):
+            print(line + " (unchanged, nothing new saved)")
+            continue
+        changes = result.get('changes')
+        if changes:
+            line += f" ({changes['added']} added, {changes['deleted']} deleted, {changes['modified']} modified)"
+            if changes['deleted']:
+                line += " WARNING: QSOs missing compared to the previous backup"
+        if not result.get('verified', True):
+            line += " WARNING: backup could not be verified"
+        print(line)
+
+        for upload in result.get('uploads', []):
+            if upload['ok']:
+                print(f"  uploaded to {upload['name']} in {upload['seconds']:.1f}s: {upload['location']}")
+            else:
+                print(f"  failed to upload to {upload['name']} after {upload['seconds']:.1f}s: {upload['error']}")
+    print(f"Backed up {len(results)} accounts in {elapsed:.1f}s")
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python multi_backup.py accounts.json")
+        sys.exit(1)
+
+    config = load_config(sys.argv[1])
+    if config.get('json_log'):
+        setup_json_logging(config['json_log'])
+    started = time.perf_counter()
+    results = asyncio.run(run_accounts(
+        config['accounts'],
+        concurrency=config.get('concurrency', DEFAULT_CONCURRENCY),
+        host_delay=config.get('host_delay', DEFAULT_HOST_DELAY),
+        api_url=config.get('api_url', QRZ_API_URL),
+    ))
+    print_results(results, time.perf_counter() - started)
+    if config.get('metrics_file'):
+        metrics.write_textfile(config['metrics_file'])
+    sys.exit(1 if any('error' in result for result in results) else 0)
@@ -0,0 +1,247 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Small client for the QRZ Logbook API.
+#
+# Every call goes to QRZ_API_URL, which can be pointed at the local stub in
+# qrz_stub.py for testing. Responses look like RESULT=OK&COUNT=2&ADIF=...
+# with the ADIF HTML-entity encoded.
+
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import time
+from urllib.parse import parse_qsl, unquote
+
+from adif import iter_adif_text
+from backup_files import atomic_backup, compression_of, fsync_file
+from metrics import metrics
+from transfer import TransferError, request_with_retry
+
+# QRZ Logbook API endpoint
+QRZ_API_URL = 'https://logbook.qrz.com/api'
+
+# Number of QSOs requested per page by download_adif
+PAGE_SIZE = 250
+
+# Default application header
+HEADERS = {
+    'User-Agent': 'QRZLogBackup/1.0.1'
+}
+
+# Partial download kept next to the backups so an interrupted download can
+# carry on from the last complete page on the next run
+PARTIAL_FILENAME = '.qrz_download.part'
+PROGRESS_FILENAME = '.qrz_download.json'
+
+# Partial downloads older than this are started again instead of resumed
+RESUME_MAX_AGE = 24 * 60 * 60
+
+# Keys QRZ uses in its responses. Values are HTML-entity encoded, so they can
+# contain '&' (as in &lt;) and the text cannot simply be split on '&'.
+RESPONSE_KEY_RE = re.compile(r'(?:^|&)(RESULT|REASON|COUNT|LOGIDS|LOGID|EXTENDED|DATA|STATUS|ADIF)=')
+
+# Raised when QRZ answers with RESULT=FAIL or an HTTP error
+class QRZError(Exception):
+    pass
+
+# Function to split a QRZ API response into a dict of its fields
+def parse_qrz_response(text):
+    fields = {}
+    matches = list(RESPONSE_KEY_RE.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(text)
+        fields[match.group(1)] = text[match.end():end]
+    return fields
+
+# Function to make one QRZ Logbook API call and return the parsed response
+def qrz_request(api_key, action, option=None, session=None, api_url=QRZ_API_URL, headers=HEADERS):
+    params = {'KEY': api_key, 'ACTION': action}
+    if option:
+        params['OPTION'] = option
+
+    start = time.perf_counter()
+    try:
+        response = request_with_retry(session, 'GET', api_url, params=params, headers=headers)
+    except TransferError as e:
+        metrics.inc('qrz_api_errors_total', help='QRZ API calls that failed', action=action)
+        raise QRZError(f"Failed to call QRZ API: {e}") from e
+    metrics.observe('qrz_api_request_seconds', time.perf_counter() - start,
+                    help='QRZ API call latency, retries included', action=action)
+    metrics.inc('qrz_api_downloaded_bytes_total', len(response.content),
+                help='Bytes received from the QRZ API', action=action)
+    if response.status_code != 200:
+        metrics.inc('qrz_api_errors_total', help='QRZ API calls that failed', action=action)
+        raise QRZError(f"Failed to call QRZ API, status code: {response.status_code}")
+
+    fields = parse_qrz_response(response.text)
+    result = fields.get('RESULT', fields.get('STATUS'))
+
+    # QRZ reports an empty result set as a failure with COUNT=0
+    if result != 'OK' and not (result == 'FAIL' and fields.get('COUNT') == '0'):
+        metrics.inc('qrz_api_errors_total', help='QRZ API calls that failed', action=action)
+        raise QRZError(f"QRZ API failed: {html.unescape(fields.get('REASON', response.text))}")
+
+    return fields
+
+# Function to fetch logbook records as decoded ADIF text.
+# option is passed through, e.g. 'ALL', 'MODSINCE:2024-05-01' or 'AFTERLOGID:123,MAX:250'.
+def fetch_adif(api_key, option='ALL', session=None, api_url=QRZ_API_URL, headers=HEADERS):
+    fields = qrz_request(api_key, 'FETCH', option, session=session, api_url=api_url, headers=headers)
+    return html.unescape(fields.get('ADIF', '')), int(fields.get('COUNT') or 0)
+
+# Function to get the logbook's STATUS (BOOKID, CALLSIGN, COUNT, ...) as a
+# dict. QRZ sends the values URL-encoded inside DATA; a plain COUNT next to it
+# is accepted too.
+def logbook_status(api_key, session=None, api_url=QRZ_API_URL, headers=HEADERS):
+    fields = qrz_request(api_key, 'STATUS', session=session, api_url=api_url, headers=headers)
+    status = {name.upper(): value for name, value in parse_qsl(unquote(fields.get('DATA', '')))}
+    if 'COUNT' in fields:
+        status['COUNT'] = fields['COUNT']
+    return status
+
+# Function to drop the QSOs of a page up to log ID after, keeping the rest as
+# QRZ sent them. QRZ documents AFTERLOGID as including the given ID, so the
+# page asked for after the last saved QSO starts with that QSO again; it is
+# skipped by its log ID, which works just as well if the API leaves it out.
+# Returns (ADIF text, QSO count, highest log ID).
+def _records_after(fields, adif_page, after):
+    texts = []
+    last = None
+    for record, text in iter_adif_text(adif_page):
+        log_id = record.get('app_qrzlog_logid', '')
+        if log_id.isdigit():
+            if int(log_id) <= after:
+                continue
+            last = max(last or 0, int(log_id))
+        texts.append(text)
+
+    if last is None:
+        # No log IDs in the records themselves; fall back to the LOGIDS list
+        log_ids = [int(log_id) for log_id in fields.get('LOGIDS', '').split(',') if log_id.strip().isdigit()]
+        last = max((log_id for log_id in log_ids if log_id > after), default=None)
+    return ''.join(texts), len(texts), last
+
+# Function to load the progress of an earlier interrupted download, if it can be resumed
+def _load_progress(progress_path, part_path, account):
+    try:
+        with open(progress_path, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (progress.get('account') != account
+            or time.time() - progress.get('started', 0) > RESUME_MAX_AGE
+            or not os.path.exists(part_path)
+            or os.path.getsize(part_path) < progress.get('bytes', 0)):
+        return None
+    return progress
+
+# Function to record download progress; written atomically so a crash never
+# leaves a progress file that points past the end of the data
+def _save_progress(progress_path, progress):
+    tmp_path = progress_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+# Function to download the whole logbook to dest_path one page at a time.
+# Only one page is held in memory. Pages are appended to a partial file in the
+# same directory, and after every page the progress is saved, so if the run is
+# cut short the next one carries on after the last saved page. The finished
+# file is renamed (or compressed) over dest_path. Returns the QSO count and the
+# highest log ID seen.
+def download_adif(api_key, dest_path, page_size=PAGE_SIZE, session=None, api_url=QRZ_API_URL,
+                  headers=HEADERS, resume=True):
+    dest_dir = os.path.dirname(dest_path) or '.'
+    part_path = os.path.join(dest_dir, PARTIAL_FILENAME)
+    progress_path = os.path.join(dest_dir, PROGRESS_FILENAME)
+
+    # Only resume a download of the same logbook from the same server
+    account = hashlib.sha256(f'{api_url}|{api_key}'.encode('utf-8')).hexdigest()[:16]
+    progress = _load_progress(progress_path, part_path, account) if resume else None
+    if progress is None:
+        progress = {'account': account, 'started': time.time(), 'after': 0, 'total': 0, 'bytes': 0}
+    elif progress['after']:
+        print(f"Resuming download after log ID {progress['after']} ({progress['total']} QSOs already saved).")
+
+    write_time = 0.0
+    with open(part_path, 'r+b' if progress['bytes'] else 'wb') as f:
+        # Drop anything written after the last saved page
+        f.truncate(progress['bytes'])
+        f.seek(progress['bytes'])
+
+        while True:
+            # One more than a page, for the QSO saved last that comes back first
+            max_count = page_size + 1 if progress['after'] else page_size
+            fields = qrz_request(api_key, 'FETCH', f"AFTERLOGID:{progress['after']},MAX:{max_count}",
+                                 session=session, api_url=api_url, headers=headers)
+            count = int(fields.get('COUNT') or 0)
+            if not count:
+                break
+
+            # Decode the HTML entities of this page only
+            adif_page, saved, last = _records_after(fields, html.unescape(fields.get('ADIF', '')),
+                                                   progress['after'])
+            if not saved and count < max_count:
+                # Only the QSO saved last came back
+                break
+            if last is None:
+                raise QRZError("QRZ API returned a page without new log IDs")
+
+            start = time.perf_counter()
+            f.write(adif_page.encode('utf-8'))
+            f.flush()
+            progress.update(after=last, total=progress['total'] + saved, bytes=f.tell())
+            _save_progress(progress_path, progress)
+            write_time += time.perf_counter() - start
+
+            if count < max_count:
+                break
+
+    start = time.perf_counter()
+    if compression_of(dest_path):
+        with open(part_path, 'r', encoding='utf-8') as src, atomic_backup(dest_path) as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(part_path)
+    else:
+        fsync_file(part_path)
+        os.replace(part_path, dest_path)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+
+    write_time += time.perf_counter() - start
+    metrics.inc('qrz_download_write_seconds_total', write_time,
+                help='Time spent writing downloaded pages and the finished backup to disk')
+    metrics.inc('qrz_download_qsos_total', progress['total'], help='QSOs saved by full downloads')
+    return progress['total'], progress['after']
@@ -0,0 +1,178 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Local stand-in for the QRZ Logbook API, for testing the backup scripts
+# without touching the real service.
+#
+# Usage: python qrz_stub.py [qso_count] [port]
+#
+# Then point QRZ_API_URL in a backup script at the printed URL. Any API key is
+# accepted. FETCH understands ALL, MODSINCE:<date>, AFTERLOGID:<id> and MAX:<n>.
+# Like the real API, AFTERLOGID includes the given log ID itself; set
+# afterlogid_inclusive = False on a StubLogbook to have it start after it.
+#
+# inject_faults() makes the next requests fail, to test retries and resumed
+# downloads.
+
+import html
+import sys
+import threading
+from collections import deque
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from adif import format_adif_fields
+from bench import generate_records
+
+# In-memory logbook served by the stub
+class StubLogbook:
+    afterlogid_inclusive = True
+
+    def __init__(self, records=(), moddate=None):
+        self.lock = threading.Lock()
+        self.records = {}
+        self.moddates = {}
+        for record in records:
+            self.add(record, moddate)
+
+    # Add or replace a QSO, stamping it with a modification date
+    def add(self, record, moddate=None):
+        with self.lock:
+            log_id = int(record['app_qrzlog_logid'])
+            self.records[log_id] = dict(record)
+            self.moddates[log_id] = moddate or date.today().isoformat()
+
+    # Change some fields of an existing QSO
+    def modify(self, log_id, moddate=None, **fields):
+        with self.lock:
+            self.records[int(log_id)].update(fields)
+            self.moddates[int(log_id)] = moddate or date.today().isoformat()
+
+    # Records matching a FETCH option string, in logid order
+    def select(self, option):
+        options = {}
+        for part in (option or 'ALL').split(','):
+            name, _, value = part.partition(':')
+            options[name.strip().upper()] = value.strip()
+
+        with self.lock:
+            log_ids = sorted(self.records)
+            if 'AFTERLOGID' in options:
+                after = int(options['AFTERLOGID']) - self.afterlogid_inclusive
+                log_ids = [log_id for log_id in log_ids if log_id > after]
+            if 'MODSINCE' in options:
+                log_ids = [log_id for log_id in log_ids if self.moddates[log_id] >= options['MODSINCE']]
+            if 'MAX' in options:
+                log_ids = log_ids[:int(options['MAX'])]
+            return [self.records[log_id] for log_id in log_ids]
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not self.inject_fault():
+            self.handle_api(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        query = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if not self.inject_fault():
+            self.handle_api(query)
+
+    # Fail this request if a fault is queued; returns True if it did
+    def inject_fault(self):
+        try:
+            fault = self.server.faults.popleft()
+        except IndexError:
+            return False
+
+        if not isinstance(fault, int):
+            # Hang up without answering, like a dropped connection
+            self.close_connection = True
+            self.connection.close()
+            return True
+
+        self.send_response(fault)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return True
+
+    def handle_api(self, query):
+        params = {key.upper(): values[-1] for key, values in query.items()}
+        action = params.get('ACTION', '').upper()
+        logbook = self.server.logbook
+
+        if not params.get('KEY'):
+            body = 'RESULT=AUTH&REASON=missing api key'
+        elif action == 'FETCH':
+            records = logbook.select(params.get('OPTION'))
+            if records:
+                adif_data = ''.join(format_adif_fields(record) + '<eor>\n' for record in records)
+                log_ids = ','.join(record['app_qrzlog_logid'] for record in records)
+                body = f'RESULT=OK&COUNT={len(records)}&LOGIDS={log_ids}&ADIF={html.escape(adif_data, quote=False)}'
+            else:
+                body = 'RESULT=FAIL&REASON=no log entries found&COUNT=0'
+        elif action == 'STATUS':
+            body = f'RESULT=OK&DATA=BOOKID=1&CALLSIGN=W9XYZ&COUNT={len(logbook.records)}'
+        else:
+            body = f'RESULT=FAIL&REASON=invalid action {action}'
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+# Function to start a stub server in a background thread, returning (server, url)
+def start_stub(logbook, port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.logbook = logbook
+    server.faults = deque()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/api'
+
+# Function to make the next requests to a stub fail. Each fault is an HTTP
+# status code such as 503, or 'drop' to close the connection without a reply.
+def inject_faults(server, *faults):
+    server.faults.extend(faults)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8073
+    server, url = start_stub(StubLogbook(generate_records(count)), port)
+    print(f"QRZ stub serving {count} QSOs at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
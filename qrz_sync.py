@@ -0,0 +1,215 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Incremental QRZ logbook sync.
+#
+# Instead of downloading the whole log every night, a master ADIF copy is kept
+# in BACKUP_DIR/sync together with a small state file. Each run asks QRZ only
+# for QSOs added or changed since the previous run (MODSINCE) and merges them
+# into the master by APP_QRZLOG_LOGID. QRZ cannot report deleted QSOs this way,
+# so a full download is still made every FULL_SYNC_DAYS days.
+#
+# Either way, check_unchanged() can tell before downloading anything whether
+# QRZ still holds exactly the QSOs of the last verified backup: the STATUS
+# QSO count must match and a MODSINCE query since the last check must come
+# back empty. The backup it matched is remembered in BACKUP_DIR/.qrz_last_check.json.
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from adif import iter_adif, read_adif_file, write_adif
+from backup_manifest import read_manifest, remove_backup
+from qrz_api import HEADERS, PAGE_SIZE, QRZ_API_URL, download_adif, fetch_adif, logbook_status
+
+# Subdirectory of the backup directory used for sync files
+SYNC_DIR = 'sync'
+MASTER_FILENAME = 'master.adif'
+STATE_FILENAME = 'state.json'
+
+# Record of the backup QRZ was last known to match, kept in the backup directory
+CHECK_FILENAME = '.qrz_last_check.json'
+
+# Days between full downloads, which also pick up QSOs deleted on QRZ
+FULL_SYNC_DAYS = 7
+
+# Function to read the sync state, or an empty state if there is none yet
+def load_sync_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Function to write a file atomically via a temporary file
+def _write_atomic(path, write):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        result = write(f)
+    os.replace(tmp_path, path)
+    return result
+
+# Function to merge changed records into the master ADIF, returning
+# (added, updated, total). The master is streamed through, so only the
+# changed records are held in memory.
+def merge_records(master_file, adif_data):
+    changed = {record.get('app_qrzlog_logid'): record for record in iter_adif(adif_data)}
+    counts = {'added': 0, 'updated': 0}
+
+    with open(master_file, 'r', encoding='utf-8') as src:
+        header, records = read_adif_file(src)
+
+        def merged():
+            for record in records:
+                log_id = record.get('app_qrzlog_logid')
+                if log_id in changed:
+                    record = changed.pop(log_id)
+                    counts['updated'] += 1
+                yield record
+
+            # Anything left over is new; log IDs only grow
+            for log_id in sorted(changed, key=lambda log_id: int(log_id or 0)):
+                counts['added'] += 1
+                yield changed[log_id]
+
+        total = _write_atomic(master_file, lambda f: write_adif(f, merged(), header))
+
+    return counts['added'], counts['updated'], total
+
+# Function to bring the master ADIF up to date and return its path and stats
+def sync_logbook(api_key, backup_dir, page_size=PAGE_SIZE, session=None, api_url=QRZ_API_URL, headers=HEADERS):
+    sync_dir = os.path.join(backup_dir, SYNC_DIR)
+    os.makedirs(sync_dir, exist_ok=True)
+    master_file = os.path.join(sync_dir, MASTER_FILENAME)
+    state_file = os.path.join(sync_dir, STATE_FILENAME)
+
+    state = load_sync_state(state_file)
+    now = datetime.now(timezone.utc)
+    last_full = state.get('last_full_sync')
+    full = (
+        not os.path.exists(master_file)
+        or not state.get('modsince')
+        or not last_full
+        or now - datetime.fromisoformat(last_full) >= timedelta(days=FULL_SYNC_DAYS)
+    )
+
+    if full:
+        # Page through the whole log straight into the master copy
+        count, last_logid = download_adif(api_key, master_file, page_size=page_size,
+                                          session=session, api_url=api_url, headers=headers)
+        added, updated, total = count, 0, count
+        log_ids = [last_logid]
+        state['last_full_sync'] = now.isoformat()
+    else:
+        # MODSINCE has day resolution; re-reading the last sync day is harmless
+        adif_data, count = fetch_adif(api_key, f"MODSINCE:{state['modsince']}",
+                                      session=session, api_url=api_url, headers=headers)
+        if count:
+            added, updated, total = merge_records(master_file, adif_data)
+        else:
+            added, updated, total = 0, 0, state.get('total', 0)
+        log_ids = [int(record['app_qrzlog_logid']) for record in iter_adif(adif_data)
+                   if record.get('app_qrzlog_logid', '').isdigit()]
+
+    state['modsince'] = now.date().isoformat()
+    state['last_logid'] = max(log_ids + [state.get('last_logid') or 0])
+    state['total'] = total
+    _write_atomic(state_file, lambda f: json.dump(state, f, indent=2))
+
+    return master_file, {'full': full, 'fetched': count, 'added': added, 'updated': updated, 'total': total}
+
+# Function to read the last check record, or None if there is none or the
+# backup it refers to is gone or no longer matches its manifest
+def load_last_check(backup_dir):
+    try:
+        with open(os.path.join(backup_dir, CHECK_FILENAME), 'r', encoding='utf-8') as f:
+            check = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    path = os.path.join(backup_dir, check.get('backup', ''))
+    manifest = read_manifest(path)
+    if (not manifest or not manifest.get('verified') or not os.path.isfile(path)
+            or manifest.get('fingerprint') != check.get('fingerprint')
+            or os.path.getsize(path) != manifest.get('bytes')):
+        return None
+    return check
+
+# Function to save the last check record
+def save_last_check(backup_dir, check):
+    _write_atomic(os.path.join(backup_dir, CHECK_FILENAME), lambda f: json.dump(check, f, indent=2))
+
+# Function to check whether QRZ still holds exactly the QSOs of the last
+# verified backup, using only STATUS and an (empty) MODSINCE query. Returns
+# the updated check record if nothing changed, or None if the log has to be
+# downloaded: it changed, there is no usable record, or the last full
+# download is max_age_days old (QRZ cannot report a deleted-and-replaced QSO
+# any other way).
+def check_unchanged(api_key, backup_dir, max_age_days=FULL_SYNC_DAYS, session=None,
+                    api_url=QRZ_API_URL, headers=HEADERS):
+    check = load_last_check(backup_dir)
+    now = datetime.now(timezone.utc)
+    if check is None or now - datetime.fromisoformat(check['downloaded']) >= timedelta(days=max_age_days):
+        return None
+
+    status = logbook_status(api_key, session=session, api_url=api_url, headers=headers)
+    if status.get('COUNT') != str(check['qso_count']):
+        return None
+
+    # MODSINCE has day resolution and QRZ's dates need not be UTC, so look one
+    # day further back than the last check
+    modsince = (datetime.fromisoformat(check['checked']) - timedelta(days=1)).date().isoformat()
+    _, count = fetch_adif(api_key, f"MODSINCE:{modsince}", session=session, api_url=api_url, headers=headers)
+    if count:
+        return None
+
+    check['checked'] = now.isoformat()
+    check['unchanged_runs'] = check.get('unchanged_runs', 0) + 1
+    save_last_check(backup_dir, check)
+    return check
+
+# Function to record a freshly downloaded backup as the one QRZ matches. If it
+# holds the same QSOs as the previously recorded backup it is deleted again
+# and the older file stays on record. Returns the path of the backup on record,
+# or None if the new backup is unverified and nothing was recorded.
+def record_backup(backup_dir, backup_path, manifest):
+    if not manifest.get('verified'):
+        return None
+
+    now = datetime.now(timezone.utc).isoformat()
+    check = load_last_check(backup_dir)
+    if check and check['fingerprint'] == manifest['fingerprint'] and check['backup'] != os.path.basename(backup_path):
+        remove_backup(backup_path)
+        check.update(downloaded=now, checked=now, unchanged_runs=check.get('unchanged_runs', 0) + 1)
+    else:
+        check = {'backup': os.path.basename(backup_path), 'qso_count': manifest['qso_count'],
+                 'fingerprint': manifest['fingerprint'], 'downloaded': now, 'checked': now,
+                 'unchanged_runs': 0}
+    save_last_check(backup_dir, check)
+    return os.path.join(backup_dir, check['backup'])
@@ -0,0 +1,199 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Grandfather-father-son retention for backup folders.
+#
+# Instead of keeping just the newest N backups, keep the newest backup of each
+# of the last few days, weeks, months and years that have one, so a week of
+# outages or a run of failed backups never wipes out the history:
+#
+#   RETENTION = {'last': 1, 'daily': 7, 'weekly': 4, 'monthly': 12, 'yearly': 0}
+#
+# Backups whose QSOs are identical to the next newer backup (same fingerprint
+# in their manifests) are dropped first, so quiet nights do not use up a
+# slot. Verified backups always win a slot before unverified ones. Only
+# backups with a timestamp in their name are touched, so the incremental
+# sync's master.adif and hand-copied files are left alone.
+#
+# Usage: python retention.py qrz_backups --daily 7 --weekly 4 --monthly 12 [--dry-run]
+
+import argparse
+import os
+import re
+from datetime import datetime
+
+from backup_files import COMPRESSION_SUFFIXES
+from backup_manifest import MANIFEST_SUFFIX, read_manifest, remove_backup
+from metrics import log_event, metrics
+
+# Default tiers: the newest backup, then one per day for a week, per week for
+# a month and per month for a year
+DEFAULT_RETENTION = {'last': 1, 'daily': 7, 'weekly': 4, 'monthly': 12, 'yearly': 0}
+
+# Order the tiers are filled in, and the period each one keeps a backup of
+TIERS = ('last', 'daily', 'weekly', 'monthly', 'yearly')
+PERIODS = {
+    'daily': lambda when: when.strftime('%Y-%m-%d'),
+    'weekly': lambda when: '%d-W%02d' % when.isocalendar()[:2],
+    'monthly': lambda when: when.strftime('%Y-%m'),
+    'yearly': lambda when: when.strftime('%Y'),
+}
+
+# Timestamp in backup names, e.g. qrz_logbook_backup_20240501_030000.adif
+TIMESTAMP_RE = re.compile(r'(\d{8}_\d{6})')
+
+# File name endings of backups
+BACKUP_SUFFIXES = tuple('.adif' + suffix for suffix in COMPRESSION_SUFFIXES.values())
+
+# One backup file as seen by the planner
+class BackupInfo:
+    __slots__ = ('path', 'when', 'verified', 'fingerprint')
+
+    def __init__(self, path, when, verified, fingerprint):
+        self.path = path
+        self.when = when
+        self.verified = verified
+        self.fingerprint = fingerprint
+
+# Function to get when a backup was made from the timestamp in its name,
+# None for files not named like a backup
+def backup_time(name):
+    match = TIMESTAMP_RE.search(name)
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), '%Y%m%d_%H%M%S')
+    except ValueError:
+        return None
+
+# Function to list the backups in a directory with one scan, reading the
+# manifests found alongside them
+def scan_backups(backup_dir):
+    entries = {}
+    manifests = set()
+    with os.scandir(backup_dir) as it:
+        for entry in it:
+            if entry.name.endswith(MANIFEST_SUFFIX):
+                manifests.add(entry.name[:-len(MANIFEST_SUFFIX)])
+            elif entry.name.endswith(BACKUP_SUFFIXES) and entry.is_file():
+                when = backup_time(entry.name)
+                if when is not None:
+                    entries[entry.name] = (when, entry.stat())
+
+    backups = []
+    for name, (when, stat) in entries.items():
+        path = os.path.join(backup_dir, name)
+        manifest = read_manifest(path) if name in manifests else None
+        # A manifest only vouches for the file it was written for
+        if manifest and manifest.get('bytes') != stat.st_size:
+            manifest = None
+        backups.append(BackupInfo(path, when,
+                                  bool(manifest and manifest.get('verified')),
+                                  manifest.get('fingerprint') if manifest else None))
+    return backups
+
+# Function to decide which backups to keep under the retention tiers.
+# Returns (keep, delete): keep maps each kept path to the tiers keeping it,
+# delete maps each path to be deleted to the reason.
+def plan_retention(backups, retention=DEFAULT_RETENTION):
+    unknown = set(retention) - set(TIERS)
+    if unknown:
+        raise ValueError(f"Unknown retention tiers: {', '.join(sorted(unknown))}")
+
+    keep = {}
+    delete = {}
+
+    # Collapse runs of backups with the same QSOs into the newest (verified) one
+    candidates = []
+    for backup in sorted(backups, key=lambda backup: backup.when, reverse=True):
+        newer = candidates[-1] if candidates else None
+        if newer is not None and backup.fingerprint and backup.fingerprint == newer.fingerprint:
+            if backup.verified and not newer.verified:
+                candidates[-1] = backup
+                delete[newer.path] = f"same QSOs as {os.path.basename(backup.path)}"
+            else:
+                delete[backup.path] = f"same QSOs as {os.path.basename(newer.path)}"
+            continue
+        candidates.append(backup)
+
+    # Verified backups claim slots first, newest first within each group
+    ranked = sorted(candidates, key=lambda backup: (backup.verified, backup.when), reverse=True)
+    for tier in TIERS:
+        slots = retention.get(tier, 0)
+        periods = set()
+        for backup in ranked:
+            if slots <= 0:
+                break
+            period = PERIODS[tier](backup.when) if tier in PERIODS else backup.path
+            if period in periods:
+                continue
+            periods.add(period)
+            slots -= 1
+            keep.setdefault(backup.path, []).append(tier if tier == 'last' else f'{tier} {period}')
+
+    for backup in candidates:
+        if backup.path not in keep:
+            delete[backup.path] = 'outside retention' if backup.verified else 'outside retention (unverified)'
+    return keep, delete
+
+# Function to apply the retention tiers to a backup folder, deleting what
+# they do not keep unless dry_run. Returns (keep, delete) as plan_retention.
+def apply_retention(backup_dir, retention=DEFAULT_RETENTION, dry_run=False):
+    keep, delete = plan_retention(scan_backups(backup_dir), retention)
+    if not dry_run:
+        for path in delete:
+            remove_backup(path)
+
+    help_text = 'Backups kept and deleted (or, in a dry run, to be deleted) by retention'
+    metrics.inc('retention_backups_total', len(keep), help=help_text, action='keep', dry_run=str(dry_run).lower())
+    metrics.inc('retention_backups_total', len(delete), help=help_text, action='delete', dry_run=str(dry_run).lower())
+    log_event('retention', backup_dir=backup_dir, dry_run=dry_run, kept=len(keep),
+              deleted=[os.path.basename(path) for path in sorted(delete)])
+    return keep, delete
+
+# Function to print a retention plan
+def print_plan(keep, delete, dry_run=False):
+    for path, tiers in sorted(keep.items()):
+        print(f"keep    {os.path.basename(path)} ({', '.join(tiers)})")
+    for path, reason in sorted(delete.items()):
+        print(f"{'would delete' if dry_run else 'deleted'} {os.path.basename(path)} ({reason})")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Thin out a backup folder with daily/weekly/monthly/yearly tiers.')
+    parser.add_argument('backup_dir')
+    for tier in TIERS:
+        parser.add_argument(f'--{tier}', type=int, default=DEFAULT_RETENTION[tier],
+                            help=f'backups to keep in the {tier} tier (default {DEFAULT_RETENTION[tier]})')
+    parser.add_argument('--dry-run', action='store_true', help='only show what would be deleted')
+    args = parser.parse_args()
+
+    retention = {tier: getattr(args, tier) for tier in TIERS}
+    keep, delete = apply_retention(args.backup_dir, retention, dry_run=args.dry_run)
+    print_plan(keep, delete, dry_run=args.dry_run)
@@ -0,0 +1,236 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Production server for Local Logger.
+#
+# LocalLogger1.0.0.py runs Flask's development server. This script serves the
+# same app under gunicorn (Linux/macOS) or waitress (any OS, single process):
+#
+#   python serve.py [--host 0.0.0.0] [--port 5000] [--workers 4] [--threads 4]
+#
+# The latest backup is parsed once before gunicorn starts its workers, so they
+# all share the columnar logbook's memory copy-on-write instead of parsing a
+# copy each. A watcher thread looks for new backups every RELOAD_INTERVAL
+# seconds, loads them in the background and then restarts the workers
+# gracefully so they pick up the new logbook without a request ever waiting
+# for a parse. The master and workers share their metrics through files in a
+# temporary directory, so /metrics adds up every process whichever answers.
+
+import argparse
+import gc
+import importlib.util
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from logbook import SORT_FIELDS, backup_key
+from metrics import metrics
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+# Local Logger script served by default
+LOCAL_LOGGER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'LocalLogger1.0.0.py')
+
+# Default address and worker counts
+HOST = '127.0.0.1'
+PORT = 5000
+WORKERS = os.cpu_count() or 1
+THREADS = 4
+
+# Seconds between checks for a new backup
+RELOAD_INTERVAL = 30
+
+# Function to import Local Logger (its file name is not a valid module name)
+def load_local_logger(path=LOCAL_LOGGER_PATH):
+    spec = importlib.util.spec_from_file_location('local_logger', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['local_logger'] = module
+    spec.loader.exec_module(module)
+    return module
+
+# Function to parse a backup and work out its sort orders up front, then pin
+# it as the backup Local Logger serves. Returns the backup, or None if there is none.
+def preload(logger, path=None):
+    path = path or logger.find_latest_backup()
+    if path is None:
+        return None
+
+    if logger.logstore:
+        logger.logstore.sync(path)
+    else:
+        # Only the new logbook should be in memory when workers are forked
+        logger.logbook_cache.clear()
+        logbook = logger.logbook_cache.get(path)
+        for field in SORT_FIELDS:
+            logbook.sort_ranks(field)
+    # Count the QSOs of backups without a manifest once here rather than in every worker
+    logger.backup_catalog().count_pending()
+    logger.pinned_backup = path
+    return path
+
+# Thread that preloads each new backup as it appears, then calls on_change
+class BackupWatcher(threading.Thread):
+    def __init__(self, logger, interval=RELOAD_INTERVAL, on_change=None):
+        super().__init__(name='backup-watcher', daemon=True)
+        self.logger = logger
+        self.interval = interval
+        self.on_change = on_change
+        self.loaded_key = backup_key(logger.pinned_backup) if logger.pinned_backup else None
+        self.pending_key = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                # A half-written or unreadable backup: keep serving the old one
+                print(f"Backup watcher: {e}", file=sys.stderr)
+
+    # Preload the newest backup if it is not the one being served, once it
+    # has stopped changing for an interval (in case it is still being copied)
+    def check(self):
+        latest = self.logger.find_latest_backup()
+        if latest is None:
+            return False
+        key = backup_key(latest)
+        if key == self.loaded_key:
+            return False
+        if key != self.pending_key:
+            self.pending_key = key
+            return False
+
+        start = time.perf_counter()
+        preload(self.logger, latest)
+        self.loaded_key = key
+        print(f"Loaded {os.path.basename(latest)} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        if self.on_change:
+            self.on_change()
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+
+# Function to serve under gunicorn: preload in the master, fork the workers
+# from it and restart them gracefully (SIGHUP) after each new backup
+def serve_gunicorn(logger, host, port, workers, threads, interval):
+    class LocalLoggerApplication(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                'bind': f'{host}:{port}',
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread',
+                'preload_app': True,
+                'when_ready': self.when_ready,
+                'pre_fork': self.pre_fork,
+                'post_fork': self.post_fork,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return logger.app
+
+        # Master is listening: start watching for new backups
+        def when_ready(self, server):
+            BackupWatcher(logger, interval, on_change=self.reload_workers).start()
+
+        # Let the previous logbook be collected, then have gunicorn replace the
+        # workers with ones forked from the master's new state
+        def reload_workers(self):
+            gc.unfreeze()
+            gc.collect()
+            os.kill(os.getpid(), signal.SIGHUP)
+
+        # Move everything loaded so far out of the collector's reach, so
+        # garbage collection in the workers does not copy the shared pages
+        def pre_fork(self, server, worker):
+            gc.freeze()
+
+        # SQLite connections must not cross a fork
+        def post_fork(self, server, worker):
+            if logger.logstore:
+                logger.logstore._local = threading.local()
+
+    # Worker exits unwind through here too, only the master cleans up
+    master_pid = os.getpid()
+    metrics_dir = tempfile.mkdtemp(prefix='locallogger-metrics-')
+    metrics.share(metrics_dir)
+    try:
+        LocalLoggerApplication().run()
+    finally:
+        if os.getpid() == master_pid:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+# Function to serve under waitress: one process with a thread pool, the
+# watcher loading new backups alongside it
+def serve_waitress(logger, host, port, threads, interval):
+    BackupWatcher(logger, interval).start()
+    waitress.serve(logger.app, host=host, port=port, threads=threads)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve Local Logger with a production WSGI server.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--threads', type=int, default=THREADS)
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_INTERVAL)
+    parser.add_argument('--backup-dir', help='overrides BACKUP_DIR in Local Logger')
+    args = parser.parse_args()
+
+    use_gunicorn = BaseApplication is not None and os.name != 'nt'
+    if not use_gunicorn and waitress is None:
+        sys.exit("serve.py needs gunicorn (Linux/macOS) or waitress: pip install gunicorn waitress")
+
+    logger = load_local_logger()
+    if args.backup_dir:
+        logger.BACKUP_DIR = args.backup_dir
+
+    start = time.perf_counter()
+    backup = preload(logger)
+    if backup:
+        print(f"Preloaded {os.path.basename(backup)} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    if use_gunicorn:
+        serve_gunicorn(logger, args.host, args.port, args.workers, args.threads, args.reload_interval)
+    else:
+        serve_waitress(logger, args.host, args.port, args.threads, args.reload_interval)
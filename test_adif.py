@@ -0,0 +1,127 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+
+
+# Checks the ADIF reader (adif.py) on well-formed and malformed input, read
+# all at once and through iter_adif_file in chunks of many sizes, so records
+# cut off at chunk edges are covered too.
+#
+# Usage: python -m pytest test_adif.py (or python -m unittest test_adif)
+
+import io
+import unittest
+
+from adif import count_adif, iter_adif, iter_adif_file, parse_adif, parse_adif_header, read_adif_file, write_adif
+
+HEADER = 'Exported by a test\n<ADIF_VER:5>3.1.4 <PROGRAMID:4>test\n<EOH>\n'
+
+# Chunk sizes for iter_adif_file: a character at a time, sizes that cut tags
+# and values in the middle, and the default
+CHUNK_SIZES = (1, 2, 7, 13, 64, 1000, None)
+
+class AdifReaderTest(unittest.TestCase):
+    # Function to check that every way of reading data gives the expected records
+    def assertRecords(self, data, expected):
+        self.assertEqual(list(iter_adif(data)), expected)
+        self.assertEqual(count_adif(data), len(expected))
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                f = io.StringIO(data)
+                records = iter_adif_file(f) if chunk_size is None else iter_adif_file(f, chunk_size)
+                self.assertEqual(list(records), expected)
+
+    def test_round_trip(self):
+        records = [
+            {'call': 'W1AW', 'band': '20m', 'mode': 'FT8', 'app_qrzlog_logid': '1'},
+            {'call': 'DL1ABC', 'name': 'Jörg Müller', 'comment': 'line one\nline two', 'app_qrzlog_logid': '2'},
+            {'call': 'K9XYZ', 'comment': ''},
+        ]
+        f = io.StringIO()
+        write_adif(f, records, {'adif_ver': '3.1.4'})
+        self.assertRecords(f.getvalue(), records)
+        self.assertEqual(parse_adif_header(f.getvalue()), {'adif_ver': '3.1.4'})
+
+    def test_header(self):
+        data = HEADER + '<call:4>W1AW<eor>\n'
+        self.assertEqual(parse_adif_header(data), {'adif_ver': '3.1.4', 'programid': 'test'})
+        self.assertEqual(read_adif_file(io.StringIO(data))[0], {'adif_ver': '3.1.4', 'programid': 'test'})
+        self.assertRecords(data, [{'call': 'W1AW'}])
+
+    def test_no_header(self):
+        data = '<call:4>W1AW<band:3>20m<eor>\n<call:5>K9XYZ<eor>\n'
+        self.assertEqual(parse_adif_header(data), {})
+        self.assertRecords(data, [{'call': 'W1AW', 'band': '20m'}, {'call': 'K9XYZ'}])
+
+    def test_case_types_and_whitespace(self):
+        data = HEADER + '<CALL:4>W1AW <Freq:6:N>14.074\n<qso_date:8:D>20240101 <EOR>\n\n<call:5>K9XYZ<eor>'
+        self.assertRecords(data, [{'call': 'W1AW', 'freq': '14.074', 'qso_date': '20240101'}, {'call': 'K9XYZ'}])
+
+    def test_angle_brackets_in_values(self):
+        data = (HEADER + '<call:4>W1AW<comment:12>73 <3 <eor>!<eor>\n'
+                '<call:5>K9XYZ<notes:9>a>b<c:1>d<eor>\n'
+                '<call:6>DL1ABC<name:3>Bob<eor>\n')
+        self.assertRecords(data, [
+            {'call': 'W1AW', 'comment': '73 <3 <eor>!'},
+            {'call': 'K9XYZ', 'notes': 'a>b<c:1>d'},
+            {'call': 'DL1ABC', 'name': 'Bob'},
+        ])
+
+    def test_stray_text_between_fields(self):
+        # A stray '>' (or any text) outside a value is skipped, not taken as a tag
+        data = HEADER + 'x><call:4>W1AW>name:3>Bob<name:3>Ann<eor>\n<call:5>K9XYZ<eor>\n'
+        self.assertRecords(data, [{'call': 'W1AW', 'name': 'Ann'}, {'call': 'K9XYZ'}])
+
+    def test_wrong_lengths(self):
+        # The length prefix wins over where the next tag seems to start, so a
+        # value that is too long swallows the <eor> and runs into the next QSO
+        data = HEADER + '<call:3>W1AW<band:3>20m<eor>\n<call:7>K9X<eor>\n<call:4>N0NE<name:3>Bob<eor>\n'
+        self.assertRecords(data, [{'call': 'W1A', 'band': '20m'}, {'call': 'N0NE', 'name': 'Bob'}])
+
+    def test_incomplete_last_record(self):
+        data = HEADER + '<call:4>W1AW<eor>\n<call:5>K9XYZ<band:3>20'
+        self.assertRecords(data, [{'call': 'W1AW'}])
+
+    def test_value_cut_off_by_end_of_data(self):
+        data = HEADER + '<call:4>W1AW<eor>\n<call:5>K9X'
+        self.assertRecords(data, [{'call': 'W1AW'}])
+
+    def test_empty_records_skipped(self):
+        data = HEADER + '<eor>\n<call:4>W1AW<eor>\n<eor><eor>\n'
+        self.assertRecords(data, [{'call': 'W1AW'}])
+
+    def test_parse_adif_projects_fields(self):
+        data = HEADER + '<call:4>W1AW<band:3>20m<rst_sent:3>599<eor>\n<band:3>40m<eor>\n'
+        entries = parse_adif(data, fields=('call', 'band', 'mode'))
+        # QSOs without a call are dropped, missing fields are None
+        self.assertEqual(entries, [{'call': 'W1AW', 'band': '20m', 'mode': None}])
+
+if __name__ == '__main__':
+    unittest.main()
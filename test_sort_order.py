@@ -0,0 +1,131 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+
+
+# Checks that the in-memory logbook (logbook.py) and the SQLite store
+# (logstore.py) list QSOs in exactly the same order, junk values included.
+#
+# Usage: python -m pytest test_sort_order.py (or python -m unittest test_sort_order)
+
+import unittest
+
+from logbook import SORT_FIELDS, Logbook
+from logstore import LogStore, sort_terms
+
+# Values for each field, cycled through the QSOs at different strides so
+# every combination of good, junk and missing values (and plenty of ties) turns up
+FIXTURE_VALUES = {
+    'call': ['W1AW', 'w1aw', 'K9XYZ', 'DL1ABC', 'ÄA1A', '', None, 'ja1zzz'],
+    'freq': ['14.074', '7.074', '7.0740', 'abc', '', None, '1e3', 'nan', '14.074.1', '-3', '0'],
+    'band': ['20m', '20M', '40m', '2m', '70cm', 'foo', '', None, '160m'],
+    'mode': ['FT8', 'ft8', 'CW', 'SSB', '', None, 'JT65'],
+    'qso_date': ['20240101', '20231231', '2024', 'abcdefgh', '', None, '20240101', '19991231'],
+    'time_on': ['1234', '123400', '0000', '12', 'xx', '', None, '235959', '1234'],
+    'name': ['Ann', 'bob', '', None, 'Ann'],
+}
+
+# Function to build the fixture QSOs
+def fixture_records(count=400):
+    records = []
+    for number in range(count):
+        record = {'app_qrzlog_logid': str(1000 + number)}
+        for stride, (field, values) in enumerate(FIXTURE_VALUES.items(), 1):
+            value = values[(number * stride + number // 7) % len(values)]
+            if value is not None:
+                record[field] = value
+        records.append(record)
+    return records
+
+class SortOrderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        records = fixture_records()
+        cls.logbook = Logbook('fixture.adif', None, records)
+        cls.store = LogStore(':memory:')
+        cls.store.ingest(records, ['fixture'])
+
+    # Function to list the log IDs of every QSO a back end returns
+    def log_ids(self, backend, query, sort_by, order):
+        entries, total = backend.search(query, sort_by, order, 1, 100000)
+        log_ids = [entry['app_qrzlog_logid'] for entry in entries]
+        self.assertEqual(len(log_ids), total)
+        return log_ids
+
+    # Function to page through a back end with keyset cursors, 13 QSOs at a time
+    def paged_log_ids(self, backend, query, sort_by, order):
+        log_ids = []
+        after = None
+        while True:
+            entries, _ = backend.search(query, sort_by, order, per_page=13, after=after)
+            log_ids += [entry['app_qrzlog_logid'] for entry in entries]
+            if len(entries) < 13:
+                return log_ids
+            after = log_ids[-1]
+
+    def test_same_order(self):
+        for query in ('', 'mode:FT8', 'W1AW'):
+            for sort_by in SORT_FIELDS + ('name', 'nonsense'):
+                for order in ('asc', 'desc'):
+                    with self.subTest(query=query, sort_by=sort_by, order=order):
+                        expected = self.log_ids(self.logbook, query, sort_by, order)
+                        self.assertTrue(expected)
+                        self.assertEqual(self.log_ids(self.store, query, sort_by, order), expected)
+                        self.assertEqual(self.paged_log_ids(self.logbook, query, sort_by, order), expected)
+                        self.assertEqual(self.paged_log_ids(self.store, query, sort_by, order), expected)
+
+    def test_missing_and_junk_values_last(self):
+        junk = {'freq': ('abc', 'nan', '14.074.1'), 'qso_date': ('2024', 'abcdefgh'), 'time_on': ('12', 'xx')}
+        for field, values in junk.items():
+            for order in ('asc', 'desc'):
+                with self.subTest(field=field, order=order):
+                    entries, _ = self.store.search('', field, order, 1, 100000)
+                    missing = [not entry.get(field) or entry[field] in values for entry in entries]
+                    # Once the QSOs without a usable value start, only they follow
+                    self.assertEqual(missing, sorted(missing))
+
+    def test_unknown_sort_is_log_order(self):
+        # Both leave out QSOs without a call
+        log_ids = [record['app_qrzlog_logid'] for record in fixture_records() if record.get('call')]
+        for backend in (self.logbook, self.store):
+            for order in ('asc', 'desc'):
+                self.assertEqual(self.log_ids(backend, '', 'nonsense', order), log_ids)
+
+    def test_pages_read_from_index(self):
+        conn = self.store._connect()
+        for sort_by in SORT_FIELDS:
+            for order in ('asc', 'desc'):
+                with self.subTest(sort_by=sort_by, order=order):
+                    order_by = ', '.join(f'{term} {direction}' for term, direction in sort_terms(sort_by, order))
+                    plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN SELECT * FROM qsos ORDER BY {order_by}')]
+                    self.assertEqual(plan, [f'SCAN qsos USING INDEX qsos_{sort_by}_{order}'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Saved sign-ins for the cloud destinations.
+#
+# OneDrive tokens are kept in an MSAL token cache file and Google Drive
+# credentials in a PyDrive credentials file, both under TOKEN_CACHE_DIR. Only
+# the very first run has to sign in through the browser or a device code;
+# after that tokens are refreshed silently, so nightly runs from cron or Task
+# Scheduler never wait for a person. The files are locked while a token is
+# read or refreshed, so several backups running at once (one per account, or
+# several destinations in one run) share the same sign-in and never overwrite
+# each other's refreshed tokens.
+
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+try:
+    import msal
+except ImportError:
+    msal = None
+
+try:
+    from pydrive.auth import GoogleAuth
+except ImportError:
+    GoogleAuth = None
+
+# Where saved sign-ins are kept; readable by the current user only
+TOKEN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.qrz_log_backup')
+ONEDRIVE_CACHE_FILE = os.path.join(TOKEN_CACHE_DIR, 'onedrive_tokens.json')
+GOOGLE_DRIVE_CREDENTIALS_FILE = os.path.join(TOKEN_CACHE_DIR, 'google_drive_credentials.json')
+
+# OneDrive sign-in defaults
+ONEDRIVE_AUTHORITY = 'https://login.microsoftonline.com/common'
+ONEDRIVE_SCOPES = ['Files.ReadWrite.All']
+
+# Clients and sign-ins already set up in this process
+_auth_lock = threading.Lock()
+_onedrive_apps = {}
+_google_auths = {}
+
+# Lock a file against other processes for the duration of the with block
+@contextmanager
+def locked(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.lock', 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+# Function to write a secret file atomically, readable by the current user only
+def _write_private(path, data):
+    tmp_path = path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# Function to stop a run that would have to wait for someone to sign in
+def _check_interactive(service, cache_path, interactive):
+    if interactive is None:
+        interactive = sys.stdin is not None and sys.stdin.isatty()
+    if not interactive:
+        raise RuntimeError(f"No saved {service} sign-in in {cache_path}; run the backup once by hand to sign in")
+
+# Function to get a OneDrive access token from the saved cache, refreshing it
+# silently when it has expired. Falls back to the device code flow only when
+# there is no usable sign-in and someone is at the keyboard. username picks
+# one of several signed-in accounts. The device code flow signs in as a public
+# client, so the app registration needs no client secret.
+def onedrive_token(client_id, authority=ONEDRIVE_AUTHORITY, scopes=ONEDRIVE_SCOPES,
+                   username=None, cache_file=ONEDRIVE_CACHE_FILE, interactive=None):
+    if msal is None:
+        raise RuntimeError("OneDrive uploads need the msal package")
+
+    with _auth_lock, locked(cache_file):
+        key = (client_id, authority, cache_file)
+        if key not in _onedrive_apps:
+            cache = msal.SerializableTokenCache()
+            app = msal.PublicClientApplication(client_id, authority=authority, token_cache=cache)
+            _onedrive_apps[key] = (app, cache)
+        app, cache = _onedrive_apps[key]
+
+        # Another process may have refreshed the tokens since we last looked
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache.deserialize(f.read())
+
+        # Attempt to acquire a token from cache
+        result = None
+        accounts = app.get_accounts(username=username)
+        if accounts:
+            result = app.acquire_token_silent(scopes, account=accounts[0])
+        if not result:
+            # Interactive login for the first time
+            _check_interactive('OneDrive', cache_file, interactive)
+            flow = app.initiate_device_flow(scopes=scopes)
+            print(flow['message'])  # This provides the code to log in via browser
+            result = app.acquire_token_by_device_flow(flow)
+
+        if cache.has_state_changed:
+            _write_private(cache_file, cache.serialize())
+            cache.has_state_changed = False
+
+    if 'access_token' not in result:
+        raise RuntimeError(f"Failed to authenticate OneDrive: {result.get('error_description', result)}")
+    return result['access_token']
+
+# Function to get a Google Drive access token from the saved credentials,
+# refreshing it silently when it has expired. The browser sign-in only runs
+# when there are no saved credentials and someone is at the keyboard.
+def google_drive_token(settings_file='settings.yaml', credentials_file=GOOGLE_DRIVE_CREDENTIALS_FILE,
+                       interactive=None):
+    if GoogleAuth is None:
+        raise RuntimeError("Google Drive uploads need the PyDrive package")
+
+    with _auth_lock, locked(credentials_file):
+        key = (settings_file, credentials_file)
+        gauth = _google_auths.get(key)
+        if gauth is None:
+            gauth = GoogleAuth(settings_file=settings_file)
+            # Ask for a refresh token so later runs can sign in silently
+            gauth.settings['get_refresh_token'] = True
+            _google_auths[key] = gauth
+
+        # Another process may have refreshed the credentials since we last looked
+        if os.path.exists(credentials_file):
+            gauth.LoadCredentialsFile(credentials_file)
+
+        if gauth.credentials is None:
+            _check_interactive('Google Drive', credentials_file, interactive)
+            gauth.LocalWebserverAuth()  # Creates a local webserver for authentication
+        elif gauth.access_token_expired:
+            gauth.Refresh()
+        else:
+            return gauth.credentials.access_token
+
+        _write_private(credentials_file, gauth.credentials.to_json())
+        return gauth.credentials.access_token
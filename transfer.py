@@ -0,0 +1,268 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Shared transfer layer: timeouts, retries with jittered exponential backoff,
+# and resumable chunked uploads to OneDrive and Google Drive.
+#
+# A transient network error or a 429/5xx answer no longer loses the night's
+# backup: the request is retried, waiting up to BACKOFF_MAX seconds between
+# attempts (or whatever Retry-After asks for). Uploads go through upload
+# sessions in CHUNK_SIZE pieces, so a dropped connection only costs the chunk
+# in flight; the server is asked how much it already has before carrying on.
+# An upload whose resumes keep gaining nothing is given up after
+# MAX_STALLED_RESUMES tries rather than retried forever, and an upload given
+# a deadline stops making requests once it has passed.
+
+import json
+import os
+import random
+import time
+
+import requests
+
+# (connect, read) timeout in seconds for every request
+TIMEOUT = (10, 60)
+
+# Retry settings
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Upload chunk sizes; Graph wants multiples of 320 KiB, Drive of 256 KiB
+ONEDRIVE_CHUNK_SIZE = 10 * 320 * 1024
+DRIVE_CHUNK_SIZE = 8 * 256 * 1024
+
+# Times in a row an upload may be resumed without the server gaining any
+# bytes before it is given up
+MAX_STALLED_RESUMES = 3
+
+# API endpoints (can be pointed at local stand-ins for testing)
+GRAPH_URL = 'https://graph.microsoft.com/v1.0'
+DRIVE_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files'
+
+# Raised when a transfer still fails after all retries
+class TransferError(Exception):
+    pass
+
+# Function to work out how long to wait before retry number attempt (0-based)
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    # "Full jitter": a random wait up to the exponential limit, so many
+    # clients that failed together do not all come back at the same moment
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# Function to read a Retry-After header (seconds only), or None
+def _retry_after(response):
+    value = response.headers.get('Retry-After', '')
+    return min(float(value), BACKOFF_MAX) if value.replace('.', '', 1).isdigit() else None
+
+# Function to cap a (connect, read) timeout to the time left before deadline
+# (a time.monotonic() value), raising TransferError once it has passed
+def _timeout_before(deadline, timeout, method, url):
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TransferError(f"{method} {url} gave up: out of time")
+    return tuple(min(part, remaining) for part in timeout)
+
+# Function to make an HTTP request, retrying network errors and retryable statuses.
+# session can be a requests.Session or the requests module itself. With a
+# deadline (a time.monotonic() value) no attempt or wait runs past it.
+def request_with_retry(session, method, url, retries=MAX_RETRIES, timeout=TIMEOUT,
+                       retry_statuses=RETRY_STATUSES, deadline=None, **kwargs):
+    session = session or requests
+    for attempt in range(retries + 1):
+        wait = None
+        try:
+            response = session.request(method, url, timeout=_timeout_before(deadline, timeout, method, url),
+                                       **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if response.status_code not in retry_statuses:
+                return response
+            error = f"status code {response.status_code}"
+            wait = _retry_after(response)
+
+        if attempt == retries:
+            raise TransferError(f"{method} {url} failed after {retries + 1} attempts: {error}")
+        wait = wait if wait is not None else backoff_delay(attempt)
+        if deadline is not None and time.monotonic() + wait >= deadline:
+            raise TransferError(f"{method} {url} gave up: out of time ({error})")
+        time.sleep(wait)
+
+# Function to read one chunk of a file
+def _read_chunk(file_path, start, size):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return f.read(size)
+
+# Function to check that a resumed upload moved on from previous to start.
+# Returns the new count of resumes in a row that made no progress, raising
+# TransferError once there have been MAX_STALLED_RESUMES of them.
+def _check_progress(previous, start, stalled, error):
+    if start > previous:
+        return 0
+    stalled += 1
+    if stalled >= MAX_STALLED_RESUMES:
+        raise TransferError(f"Upload made no progress after {stalled} attempts to resume: {error}")
+    return stalled
+
+# Function to upload a file to OneDrive through a Graph upload session.
+# remote_path is relative to the drive root, e.g. 'backups/log.adif.gz'.
+def upload_onedrive(file_path, access_token, remote_path, session=None, graph_url=GRAPH_URL,
+                    chunk_size=ONEDRIVE_CHUNK_SIZE, deadline=None):
+    session = session or requests
+    auth = {'Authorization': f'Bearer {access_token}'}
+    total = os.path.getsize(file_path)
+
+    if total == 0:
+        # Upload sessions cannot take an empty file; a simple upload can
+        response = request_with_retry(session, 'PUT', f'{graph_url}/me/drive/root:/{remote_path}:/content',
+                                      headers={**auth, 'Content-Length': '0'}, data=b'', deadline=deadline)
+        if response.status_code not in (200, 201):
+            raise TransferError(f"OneDrive upload failed: {response.status_code} {response.text}")
+        return response.json()
+
+    response = request_with_retry(
+        session, 'POST', f'{graph_url}/me/drive/root:/{remote_path}:/createUploadSession',
+        headers={**auth, 'Content-Type': 'application/json'},
+        data=json.dumps({'item': {'@microsoft.graph.conflictBehavior': 'replace'}}),
+        deadline=deadline,
+    )
+    if response.status_code != 200:
+        raise TransferError(f"Could not start OneDrive upload: {response.status_code} {response.text}")
+    upload_url = response.json()['uploadUrl']
+
+    start = 0
+    stalled = 0
+    while True:
+        chunk = _read_chunk(file_path, start, chunk_size)
+        end = start + len(chunk) - 1
+        previous = start
+        try:
+            # The upload URL is pre-authorised; no bearer token on chunk requests
+            response = request_with_retry(session, 'PUT', upload_url, data=chunk, deadline=deadline, headers={
+                'Content-Length': str(len(chunk)),
+                'Content-Range': f'bytes {start}-{end}/{total}',
+            })
+        except TransferError as e:
+            # Ask the session where to carry on from, then keep going
+            response = request_with_retry(session, 'GET', upload_url, deadline=deadline)
+            if response.status_code != 200:
+                raise
+            start = int(response.json()['nextExpectedRanges'][0].split('-')[0])
+            stalled = _check_progress(previous, start, stalled, e)
+            continue
+
+        if response.status_code in (200, 201):
+            return response.json()
+        if response.status_code == 202:
+            start = int(response.json()['nextExpectedRanges'][0].split('-')[0])
+            stalled = _check_progress(previous, start, stalled, "status code 202")
+            continue
+        if response.status_code == 416:
+            # We sent a range the server already has; re-sync with it
+            status = request_with_retry(session, 'GET', upload_url, deadline=deadline).json()
+            start = int(status['nextExpectedRanges'][0].split('-')[0])
+            stalled = _check_progress(previous, start, stalled, "status code 416")
+            continue
+        raise TransferError(f"OneDrive upload failed: {response.status_code} {response.text}")
+
+# Function to ask a Drive resumable session how many bytes it already has
+def _drive_received(session, upload_url, total, deadline=None):
+    response = request_with_retry(session, 'PUT', upload_url, deadline=deadline, headers={
+        'Content-Length': '0',
+        'Content-Range': f'bytes */{total}',
+    })
+    if response.status_code in (200, 201):
+        return total, response
+    if response.status_code == 308:
+        received = response.headers.get('Range')
+        return (int(received.split('-')[1]) + 1 if received else 0), None
+    raise TransferError(f"Google Drive upload failed: {response.status_code} {response.text}")
+
+# Function to upload a file to Google Drive with a resumable upload session
+def upload_google_drive(file_path, access_token, name=None, folder_id=None, session=None,
+                        upload_url=DRIVE_UPLOAD_URL, chunk_size=DRIVE_CHUNK_SIZE, deadline=None):
+    session = session or requests
+    total = os.path.getsize(file_path)
+    metadata = {'name': name or os.path.basename(file_path)}
+    if folder_id:
+        metadata['parents'] = [folder_id]
+
+    response = request_with_retry(
+        session, 'POST', f'{upload_url}?uploadType=resumable',
+        headers={
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-Upload-Content-Length': str(total),
+        },
+        data=json.dumps(metadata),
+        deadline=deadline,
+    )
+    if response.status_code != 200 or 'Location' not in response.headers:
+        raise TransferError(f"Could not start Google Drive upload: {response.status_code} {response.text}")
+    session_url = response.headers['Location']
+
+    if total == 0:
+        # One empty PUT (Content-Range: bytes */0) finishes an empty upload
+        _, done = _drive_received(session, session_url, total, deadline)
+        if done is None:
+            raise TransferError("Google Drive did not finish the empty upload")
+        return done.json()
+
+    start = 0
+    stalled = 0
+    while True:
+        chunk = _read_chunk(file_path, start, chunk_size)
+        end = start + len(chunk) - 1
+        previous = start
+        try:
+            response = request_with_retry(session, 'PUT', session_url, data=chunk, deadline=deadline, headers={
+                'Content-Length': str(len(chunk)),
+                'Content-Range': f'bytes {start}-{end}/{total}',
+            })
+        except TransferError as e:
+            start, done = _drive_received(session, session_url, total, deadline)
+            if done is not None:
+                return done.json()
+            stalled = _check_progress(previous, start, stalled, e)
+            continue
+
+        if response.status_code in (200, 201):
+            return response.json()
+        if response.status_code == 308:
+            received = response.headers.get('Range')
+            start = int(received.split('-')[1]) + 1 if received else 0
+            stalled = _check_progress(previous, start, stalled, "status code 308")
+            continue
+        raise TransferError(f"Google Drive upload failed: {response.status_code} {response.text}")
@@ -0,0 +1,167 @@
+# Private Open Source License 1.0
+# Copyright 2024 Dominic Hord
+#
+# https://github.com/DomTheDorito/Private-Open-Source-License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the “Software”),
+# to deal in the Software without limitation the rights to personally use,
+# copy, modify, distribute, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# 1. The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# 2. The source code shall not be used for commercial purposes, including but not
+# limited to sale of the Software, or use in products intended for sale, unless
+# express writen permission is given by the source creator.
+#
+# 3. Attribution to source work shall be made plainly available in a reasonable manner.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# THIS LICENSE MAY BE UPDATED OR REVISED, WITH NOTICE ON THE POS LICENSE REPOSITORY.
+
+
+# Local stand-in for the OneDrive (Microsoft Graph) and Google Drive upload
+# APIs, for testing the resumable uploads in transfer.py.
+#
+# Usage: python upload_stub.py [dest_dir] [port]
+#
+# Uploaded files are written to dest_dir. Point transfer.GRAPH_URL at
+# <url>/v1.0 and transfer.DRIVE_UPLOAD_URL at <url>/upload/drive/v3/files.
+# Besides the faults of qrz_stub.inject_faults, 'drop-after' stores a chunk
+# and then hangs up, so the client has to ask where to resume from.
+
+import json
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import deque
+from http.server import ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+from qrz_stub import StubHandler
+
+CONTENT_RANGE_RE = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+)')
+
+# One upload in progress
+class UploadSession:
+    def __init__(self, kind, name, dest_path):
+        self.kind = kind
+        self.name = name
+        self.dest_path = dest_path
+        self.received = 0
+        self.complete = False
+        open(dest_path, 'wb').close()
+
+    def item(self):
+        return {'id': os.path.basename(self.dest_path), 'name': self.name, 'size': self.received}
+
+class UploadStubHandler(StubHandler):
+    def do_GET(self):
+        if self.inject_fault():
+            return
+        upload = self.server.sessions.get(urlparse(self.path).path.rsplit('/', 1)[-1])
+        if upload is None or upload.kind != 'onedrive':
+            return self.send_json(404, {'error': 'no such upload session'})
+        self.send_json(200, {'nextExpectedRanges': [f'{upload.received}-']})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.inject_fault():
+            return
+
+        path = unquote(urlparse(self.path).path)
+        match = re.fullmatch(r'/v1\.0/me/drive/root:/(.+):/createUploadSession', path)
+        if match:
+            upload_id = self.new_session('onedrive', match.group(1))
+            return self.send_json(200, {'uploadUrl': f'{self.server.url}/upload/onedrive/{upload_id}'})
+
+        if path == '/upload/drive/v3/files' and 'uploadType=resumable' in self.path:
+            metadata = json.loads(body or b'{}')
+            upload_id = self.new_session('drive', metadata.get('name', 'untitled'))
+            return self.send_json(200, {}, {'Location': f'{self.server.url}/upload/drive/session/{upload_id}'})
+
+        self.send_json(404, {'error': f'unknown endpoint {path}'})
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        fault = self.server.faults[0] if self.server.faults else None
+        if fault != 'drop-after' and self.inject_fault():
+            return
+
+        upload = self.server.sessions.get(urlparse(self.path).path.rsplit('/', 1)[-1])
+        match = CONTENT_RANGE_RE.fullmatch(self.headers.get('Content-Range', ''))
+        if upload is None or match is None:
+            return self.send_json(404 if upload is None else 400, {'error': 'bad upload request'})
+
+        start, end, total = match.groups()
+        if start is not None:
+            if int(start) != upload.received or int(end) - int(start) + 1 != len(body):
+                if upload.kind == 'onedrive':
+                    return self.send_json(416, {'error': 'unexpected range'})
+            else:
+                with open(upload.dest_path, 'ab') as f:
+                    f.write(body)
+                upload.received += len(body)
+                upload.complete = upload.received == int(total)
+
+        if fault == 'drop-after':
+            self.server.faults.popleft()
+            self.close_connection = True
+            self.connection.close()
+            return
+
+        if upload.complete:
+            return self.send_json(201 if upload.kind == 'onedrive' else 200, upload.item())
+        if upload.kind == 'onedrive':
+            return self.send_json(202, {'nextExpectedRanges': [f'{upload.received}-']})
+
+        headers = {'Range': f'bytes=0-{upload.received - 1}'} if upload.received else {}
+        self.send_json(308, None, headers)
+
+    # Function to start an upload session and return its ID
+    def new_session(self, kind, name):
+        upload_id = uuid.uuid4().hex
+        dest_path = os.path.join(self.server.dest_dir, os.path.basename(name))
+        self.server.sessions[upload_id] = UploadSession(kind, os.path.basename(name), dest_path)
+        return upload_id
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+# Function to start an upload stub in a background thread, returning (server, url)
+def start_upload_stub(dest_dir, port=0):
+    os.makedirs(dest_dir, exist_ok=True)
+    server = ThreadingHTTPServer(('127.0.0.1', port), UploadStubHandler)
+    server.dest_dir = dest_dir
+    server.sessions = {}
+    server.faults = deque()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.url
+
+if __name__ == '__main__':
+    dest_dir = sys.argv[1] if len(sys.argv) > 1 else './uploads'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8074
+    server, url = start_upload_stub(dest_dir, port)
+    print(f"Upload stub saving to {dest_dir} at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()